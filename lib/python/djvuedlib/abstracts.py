@@ -1,10 +1,12 @@
 import collections
 import collections.abc
 import abc
+import contextlib
 import json
 import os.path
 
 from . import jsonlib
+from . import storage
 
 class DictProxy(collections.abc.MutableMapping,abc.ABC):
     """Abstract for masquerading an OrderedDict. 
@@ -90,31 +92,84 @@ class KeyValuePair(collections.abc.MutableMapping,abc.ABC):
 
 class SerializedDict(DictProxy):
     """A standard OrderedDict that keeps a copy of self on filesystem, in
-       ''fpath'', in json format."""
+       ''fpath''.
 
-    def __init__(self,fpath):
+       Persistence is delegated to a storage (see module storage):
+       json, optionally journaled, or sqlite.
+
+    """
+
+    def __init__(self,fpath,journal=False,backend=None):
         DictProxy.__init__(self)
         self._fpath=fpath
-        if os.path.exists(self._fpath):
-            self._dict=jsonlib.json_load(self._fpath)
-            for k in self._dict:
-                val=self._dict[k]
-                if isinstance(val,collections.OrderedDict):
-                    if "year" in val:
-                        self._dict[k]=common.dict_to_utc(val)
-        
-    def _save(self):
-        with open(self._fpath,"w") as fd:
+        self._transaction_level=0
+        self._changes=collections.OrderedDict()
+        self._storage=storage.open_storage(fpath,backend=backend,journal=journal)
+        self._dict=self._storage.load()
+        for k in self._dict:
+            val=self._dict[k]
+            if isinstance(val,collections.OrderedDict):
+                if "year" in val:
+                    self._dict[k]=common.dict_to_utc(val)
+
+    def _lookup(self,path):
+        obj=self._dict
+        for k in path:
+            obj=obj[k]
+        return obj
+
+    def _save(self,*path):
+        """Record a change. ''path'' is the list of keys leading to the
+        changed item; without it the whole document is changed."""
+        if not path: path=None
+        self._changes[path]=True
+        if self._transaction_level>0: return
+        self._commit()
+
+    def _commit(self):
+        if not self._changes: return
+        changes=list(self._changes)
+        self._changes.clear()
+        self._storage.commit(self,changes)
+
+    def _discard_changes(self):
+        """Forget the changes recorded and not yet committed."""
+        self._changes.clear()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Collect all the changes made inside the block and write them
+        on filesystem just once, when the outermost transaction
+        ends. Transactions can be nested."""
+        self._transaction_level+=1
+        try:
+            yield self
+        finally:
+            self._transaction_level-=1
+            if self._transaction_level==0:
+                self._commit()
+
+    def export_json(self,fpath):
+        with open(fpath,"w") as fd:
             json.dump(self._dict,fd)
 
-    def __delitem__(self,*args,**kwargs):  
-        ret=self._dict.__delitem__(*args,**kwargs)
-        self._save()
+    def flush(self):
+        """Wait until all the committed changes are on disk."""
+        self._storage.flush()
+
+    def close(self):
+        """Write pending changes and release the storage."""
+        self._commit()
+        self._storage.close(self)
+
+    def __delitem__(self,key):  
+        ret=self._dict.__delitem__(key)
+        self._save(key)
         return ret
 
-    def __setitem__(self,*args,**kwargs): 
-        ret=self._dict.__setitem__(*args,**kwargs)
-        self._save()
+    def __setitem__(self,key,value): 
+        ret=self._dict.__setitem__(key,value)
+        self._save(key)
         return ret
 
 class Sequence(object):
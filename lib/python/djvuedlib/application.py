@@ -18,14 +18,15 @@ from . import mainwidget
 import signal
 
 class DjvuEditorBatch(object):
-    def __init__(self,base_dir,project_fname):
-        self._project=libproject.Project(project_fname)
+    def __init__(self,base_dir,project_fname,backend=None):
+        self._project=libproject.Project(project_fname,backend=backend)
 
     def save_djvu(self,djvu_name):
         if not djvu_name.endswith(".djvu"):
             djvu_name+=".djvu"
         djvu_name=os.path.abspath(djvu_name)
         self._project.djvubind(djvu_name)
+        self._project.close()
 
 class DjvuEditorGui(qtwidgets.QApplication):
     _font_files=[
@@ -38,12 +39,21 @@ class DjvuEditorGui(qtwidgets.QApplication):
     _font_family="Raleway"
             
     def quit(self):
+        if (self.project is not None) and self.project.ocr_running:
+            # the OCR is cancelled, then ProjectWidget._apply_ocr()
+            # quits
+            self.quit_requested=True
+            self.project.cancel_ocr()
+            return
         print("")
+        self.close_project()
         self.window.close()
 
-    def __init__(self,base_dir,open_file=None,page_num=None):
+    def __init__(self,base_dir,open_file=None,page_num=None,backend=None):
         qtwidgets.QApplication.__init__(self,[])
         self.project=None
+        self.quit_requested=False
+        self._backend=backend
 
         font_dir=os.path.join(base_dir,"share","fonts")
         for fname in self._font_files:
@@ -131,8 +141,21 @@ class DjvuEditorGui(qtwidgets.QApplication):
         font=font_db.font(family,style,size)
         return font
 
+    def set_ocr_running(self,running):
+        """No project opened, created or closed while the OCR runs
+        (see ProjectWidget._set_ocr_running())."""
+        for k in [ "new", "open", "quit" ]:
+            self.actions[k].setEnabled(not running)
+
+    def close_project(self):
+        if self.project is None: return
+        self.project.close()
+        self.project=None
+
     def open_project(self,project_fname,page_num=None):
-        self.project=libproject.Project(project_fname)
+        self.close_project()
+        self.project=libproject.Project(project_fname,journal=True,backend=self._backend,
+                                        emit_status=self.emit_progress)
         self.window.setWindowTitle("DjvuEditor: "+project_fname)
         self.refresh_project()
         if page_num is None: return
@@ -140,7 +163,9 @@ class DjvuEditorGui(qtwidgets.QApplication):
         
 
     def new_project(self,project_fname,metadata,tiff_dir):
-        self.project=libproject.Project(project_fname)
+        self.close_project()
+        self.project=libproject.Project(project_fname,journal=True,backend=self._backend,
+                                        emit_status=self.emit_progress)
         self.project.new_project(metadata,tiff_dir)
         self.window.setWindowTitle("DjvuEditor: "+project_fname)
         self.refresh_project()
@@ -175,6 +200,13 @@ class DjvuEditorGui(qtwidgets.QApplication):
         msg="[%s] %s" % (str(datetime.datetime.today()),msg)
         self.window.statusBar().showMessage(msg)
 
+    def emit_progress(self,msg,*args,**kwargs):
+        """emit_status() for long operations running in the gui thread."""
+        self.emit_status(msg,*args,**kwargs)
+        self.processEvents()
+
     def exec_(self):
         self.window.show()
-        qtwidgets.QApplication.exec_()
+        ret=qtwidgets.QApplication.exec_()
+        self.close_project()
+        return ret
@@ -1,13 +1,15 @@
 import os
 import sys
-import wand.image
+import threading
 import traceback
-import grako.exceptions
 
 #from djvubind import utils
 
 from . import ocr as libocr
 from . import hiddentext
+from . import imageinfo
+from . import cache
+from . import undo
 
 import os.path
 import concurrent.futures
@@ -86,35 +88,129 @@ import concurrent.futures
 #     #                 print('Page %s is %d bytes' % (page.title, len(data)))
         
 
-class Cover(object):
-    def __init__(self, path):
+class LazyImage(object):
+    """
+    An image file whose header (dpi, depth, size, format) is read only
+    on first access, through ''info'' (an imageinfo.ImageInfoCache)
+    if given.
+    """
+
+    def __init__(self, path, info=None):
         self.path = os.path.abspath(path)
-        with wand.image.Image.ping(filename=self.path) as img:
-            self.dpi=int(img.resolution[0])
-            self.depth=img.depth
-            self.bitonal=(self.depth==1)
-            self.height=img.height
-            self.width=img.width
-            self.format=img.format
+        self._info = info
+        self._header = None
+        self.stamp = self.file_stamp()
 
+    def file_stamp(self):
+        """(size, modification time in ns) of the file, None if
+        missing. ''stamp'' keeps the one of the current header."""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_size, st.st_mtime_ns)
 
-def read_text_structure_decorator(func):
-    def decorated(self,*args,**kwargs):
-        if self._text_structure is None: return None
-        ret=func(self,*args,**kwargs)
-        return ret
-    return decorated
+    def refresh(self):
+        """Forget the header, read again on next access."""
+        self._header = None
+        self.stamp = self.file_stamp()
+
+    def _ping(self):
+        if self._info is None: return imageinfo.ping(self.path)
+        return self._info.get(self.path)
+
+    def _header_loaded(self): pass
+
+    def _get_header(self):
+        if self._header is None:
+            self._header=self._ping()
+            self._header_loaded()
+        return self._header
+
+    @property
+    def dpi(self): return self._get_header()[0]
 
-def text_structure_decorator(func):
+    @property
+    def depth(self): return self._get_header()[1]
+
+    @property
+    def width(self): return self._get_header()[2]
+
+    @property
+    def height(self): return self._get_header()[3]
+
+    @property
+    def format(self): return self._get_header()[4]
+
+    @property
+    def bitonal(self): return self.depth==1
+
+class Cover(LazyImage): pass
+
+
+def read_text_structure_decorator(func):
     def decorated(self,*args,**kwargs):
-        print("decorated!!!")
-        if self._text_structure is None: return None
+        if self.text_structure is None: return None
         ret=func(self,*args,**kwargs)
-        self.save_text_structure()
         return ret
     return decorated
 
-class Page(object):
+def text_structure_decorator(nodes):
+    """For the methods changing the text structure: the change goes
+    on the undo stack (and is saved later, see save_text_structure()).
+    ''nodes''(structure,*args) are the rules it touches, None for the
+    list of rules."""
+    def decorator(func):
+        def decorated(self,*args,**kwargs):
+            if self.text_structure is None: return None
+            touched=nodes(self._text_structure,*args)
+            before=undo.TreeState(self._text_structure,touched)
+            ret=func(self,*args,**kwargs)
+            after=undo.TreeState(self._text_structure,touched)
+            self.undo_stack.push(undo.Command(func.__name__,before,after))
+            return ret
+        return decorated
+    return decorator
+
+# the rules touched by the changes. When the level of a rule changes,
+# its subtree is included: the levels of the children are adjusted
+# when read (OcrBlock.level).
+
+def _container(structure,parent,*args): return [parent]
+def _parent(structure,obj,*args): return [obj.parent]
+def _parent_and_rule(structure,obj,*args): return [obj.parent,obj]
+def _rule(structure,obj,*args): return [obj]
+
+def _subtree(structure,obj,*args):
+    nodes=[]
+    stack=[obj]
+    while stack:
+        obj=stack.pop()
+        nodes.append(obj)
+        stack.extend(obj.children)
+    return nodes
+
+def _parent_and_subtree(structure,obj,*args): 
+    return [obj.parent]+_subtree(structure,obj)
+
+def _ancestors_and_subtree(structure,obj,*args):
+    nodes=_subtree(structure,obj)
+    obj=obj.parent
+    while obj is not None:
+        nodes.append(obj)
+        obj=obj.parent
+    return nodes
+
+def _move_left_nodes(structure,obj):
+    if obj.parent is None: return []
+    return [obj.parent,obj.parent.parent]+_subtree(structure,obj)
+
+def _move_right_nodes(structure,obj):
+    ind=structure.index(obj)
+    if ind==0: return []
+    return [obj.parent,structure.get_rule(obj.parent,ind-1)]+_subtree(structure,obj)
+
+class Page(LazyImage):
     """
     Contains information relevant to a single page/image.
     """
@@ -132,86 +228,137 @@ class Page(object):
             label="[%s] %s" % (self.title,label)
         return label
 
-    def __init__(self, path):
-        self.path = os.path.abspath(path)
+    def __init__(self, path, info=None):
+        LazyImage.__init__(self, path, info)
         t = self.path.split(".")
         self.basepath=".".join(t[:-1]) # path without suffix
         self._text_path="%s.txt" % self.basepath
         self._text_cache=None
         self._text_structure=None
+        self._text_parsed=False
+        self._text_lock=threading.RLock() # text may be loaded in background
+        self.undo_stack=undo.UndoStack()
 
-        with wand.image.Image.ping(filename=self.path) as img:
-            self.dpi=int(img.resolution[0])
-            self.depth=img.depth
-            self.bitonal=(self.depth==1)
-            self.height=img.height
-            self.width=img.width
-            self.format=img.format
- 
         self.title = None
 
+    def _header_loaded(self):
         if self.bitonal and (self.path[-4:].lower() == '.pgm'):
             msg = "wrn: {0}: Bitonal image but using a PGM format instead of PBM. Tesseract might get mad!".format(os.path.split(self.path)[1])
             print(msg, file=sys.stderr)
 
+    def _parse_text(self,text):
+        structure=cache.text_structures.get(text)
+        if structure is None:
+            structure=hiddentext.djvused_parse_text(text)
+            cache.text_structures.put(text,structure)
+        return structure
+
     def _load_text(self):
+        """Read the text (not parsed: see _load_text_structure())."""
         if self._text_cache is not None:
             return
-        try:
-            with open(self._text_path,'r') as fd:
-                self._text_cache=fd.read()
-            self._text_structure=hiddentext.djvused_parse_text(self._text_cache)
-        except IOError as e:
-            self._text_cache=None
+        with self._text_lock:
+            if self._text_cache is not None: return
+            try:
+                with open(self._text_path,'r') as fd:
+                    self._text_cache=fd.read()
+            except IOError as e:
+                self._text_cache=None
             self._text_structure=None
-            return
-        except grako.exceptions.FailedToken as e:
+            self._text_parsed=False
+
+    def _load_text_structure(self):
+        self._load_text()
+        if self._text_parsed: return
+        with self._text_lock:
+            if self._text_parsed: return
             self._text_structure=None
-            print("Grako error:",self._text_path)
+            if self._text_cache is not None:
+                try:
+                    self._text_structure=self._parse_text(self._text_cache)
+                except hiddentext.ParseError as e:
+                    print("Parse error:",self._text_path,e)
+            self._text_parsed=True
 
     def _get_text(self):
+        if self.dirty:
+            return self._text_structure.out_tree()
         self._load_text()
         return self._text_cache
 
     def _set_text(self, val):
-        self._text_cache=val
-        with open(self._text_path, 'w') as fd:
-            fd.write(self._text_cache)
-        try:
-            self._text_structure=hiddentext.djvused_parse_text(val)
-        except grako.exceptions.FailedToken as e:
-            self._text_structure=None
-            print("Grako error:",self._text_path)
+        self._store_text(val)
+
+    def _store_text(self,text,structure=None):
+        """Write ''text''. Its ''structure'', when already built, takes
+        the place of the parse."""
+        with self._text_lock:
+            self._text_cache=text
+            with open(self._text_path, 'w') as fd:
+                fd.write(self._text_cache)
+            self._text_structure=structure
+            self._text_parsed=structure is not None
+            self.undo_stack.clear()
 
 
     text=property(_get_text,_set_text)
 
     @property
     def text_structure(self):
-        self._load_text()
+        self._load_text_structure()
         return self._text_structure
 
+    @property
+    def text_structure_loaded(self):
+        """The text is parsed already (see text_structure)."""
+        return self._text_parsed
+
+    def release_text_structure(self):
+        """Forget the parsed text, to free memory: it is parsed again
+        when needed. Not while there are changes to undo or redo,
+        they refer to its rules. Return True if released."""
+        with self._text_lock:
+            if not self._text_parsed: return False
+            if self.undo_stack.can_undo() or self.undo_stack.can_redo(): return False
+            self._text_structure=None
+            self._text_parsed=False
+            return True
+
     def reload_text(self):
-        try:
-            with open(self._text_path,'r') as fd:
-                self._text_cache=fd.read()
-            self._text_structure=hiddentext.djvused_parse_text(self._text_cache)
-        except IOError as e:
+        with self._text_lock:
             self._text_cache=None
-            self._text_structure=None
-            return
+            self._load_text()
+            self.undo_stack.clear()
+
+    @property
+    def dirty(self):
+        """Text structure changed since last saved."""
+        return not self.undo_stack.is_clean()
 
     def save_text_structure(self):
+        """Write the text structure, if dirty. Return True if written."""
+        if not self.dirty: return False
         txt=self._text_structure.out_tree()
-        print("Save!")
-        self._text_cache=txt
-        with open(self._text_path, 'w') as fd:
-            fd.write(self._text_cache)
-
-    def apply_ocr(self,ocr):
+        with self._text_lock:
+            self._text_cache=txt
+            with open(self._text_path, 'w') as fd:
+                fd.write(self._text_cache)
+        self.undo_stack.set_clean()
+        return True
+
+    def undo_text(self):
+        """Undo the last change of the text structure. Return the
+        command undone, None if nothing to undo."""
+        return self.undo_stack.undo()
+
+    def redo_text(self):
+        return self.undo_stack.redo()
+
+    def apply_ocr(self,ocr,job=None):
         if os.path.exists(self._text_path): return self.text
-        boxing = ocr.analyze(self)
-        self.text = libocr.translate(boxing)
+        words = ocr.analyze(self,job)
+        # written once, never parsed back
+        self._store_text(libocr.translate(words),libocr.text_structure(words))
         return self.text
 
     ###
@@ -231,79 +378,102 @@ class Page(object):
         # if self._text_structure is None: return None
         return self._text_structure.get_rule(parent,ind)
 
-    @text_structure_decorator
+    @text_structure_decorator(_container)
     def insert_text_rules(self,parent,ind,count):
         # if self._text_structure is None: return
         return self._text_structure.insert_rules(parent,ind,count)
 
-    @text_structure_decorator
+    @text_structure_decorator(_container)
     def remove_text_rules(self,parent,ind,count):
         # if self._text_structure is None: return
         return self._text_structure.remove_rules(parent,ind,count)
          
-    @text_structure_decorator
+    @text_structure_decorator(_parent)
     def duplicate_text_rule(self,obj):
         # if self._text_structure is None: return None
         return self._text_structure.duplicate_rule(obj)
 
-    @text_structure_decorator
+    @text_structure_decorator(_container)
     def create_text_rule(self,parent,level,xmin,ymin,xmax,ymax,text):
         # if self._text_structure is None: return None
         return self._text_structure.create_rule(parent,level,xmin,ymin,xmax,ymax,text)
 
-    @text_structure_decorator
+    @text_structure_decorator(_parent_and_subtree)
     def merge_above_text_rule(self,obj):
         # if self._text_structure is None: return None
         return self._text_structure.merge_above_rule(obj)
          
-    @text_structure_decorator
+    @text_structure_decorator(_parent_and_subtree)
     def merge_below_text_rule(self,obj):
         # if self._text_structure is None: return None
         return self._text_structure.merge_below_rule(obj)
          
-    @text_structure_decorator
+    @text_structure_decorator(_parent_and_rule)
     def split_rule(self,obj,splitted):
         # if self._text_structure is None: return None
         return self._text_structure.split_rule(obj,splitted)
 
-    @text_structure_decorator
+    @text_structure_decorator(_subtree)
     def shift_down_text_rule(self,obj,val):
         # if self._text_structure is None: return None
         return self._text_structure.shift_down_rule(obj,val)
 
-    @text_structure_decorator
+    @text_structure_decorator(_subtree)
     def shift_up_text_rule(self,obj,val):
         # if self._text_structure is None: return None
         return self._text_structure.shift_up_rule(obj,val)
 
-    @text_structure_decorator
+    @text_structure_decorator(_subtree)
     def shift_right_text_rule(self,obj,val):
         # if self._text_structure is None: return None
         return self._text_structure.shift_right_rule(obj,val)
 
-    @text_structure_decorator
+    @text_structure_decorator(_subtree)
     def shift_left_text_rule(self,obj,val):
         # if self._text_structure is None: return None
         return self._text_structure.shift_left_rule(obj,val)
 
-    @text_structure_decorator
+    @text_structure_decorator(_parent)
     def move_up(self,obj):
         # if self._text_structure is None: return None
         return self._text_structure.move_up(obj)
 
-    @text_structure_decorator
+    @text_structure_decorator(_parent)
     def move_down(self,obj):
         # if self._text_structure is None: return None
         return self._text_structure.move_down(obj)
 
-    @text_structure_decorator
+    @text_structure_decorator(_move_left_nodes)
     def move_left(self,obj):
         # if self._text_structure is None: return None
         return self._text_structure.move_left(obj)
     
-    @text_structure_decorator
+    @text_structure_decorator(_move_right_nodes)
     def move_right(self,obj):
         # if self._text_structure is None: return None
         return self._text_structure.move_right(obj)
 
+    @text_structure_decorator(_ancestors_and_subtree)
+    def set_text_rule(self,obj,**values):
+        """Set attributes (level, xmin, ymin, xmax, ymax, text) of
+        rule ''obj''."""
+        for key,value in values.items():
+            setattr(obj,key,value)
+        self._text_structure.reindex_rule(obj)
 
+    @text_structure_decorator(_rule)
+    def crop_text_rule(self,obj):
+        obj.crop_to_children()
+        self._text_structure.reindex_rule(obj)
+
+    @read_text_structure_decorator
+    def text_rules_at(self,x,y):
+        return self._text_structure.rules_at(x,y)
+
+    @read_text_structure_decorator
+    def text_rules_containing(self,xmin,ymin,xmax,ymax):
+        return self._text_structure.rules_containing(xmin,ymin,xmax,ymax)
+
+    @read_text_structure_decorator
+    def text_rules_inside(self,xmin,ymin,xmax,ymax):
+        return self._text_structure.rules_inside(xmin,ymin,xmax,ymax)
@@ -0,0 +1,159 @@
+"""
+Caches kept in the user cache directory ($XDG_CACHE_HOME/djvueditor),
+shared by all projects.
+"""
+
+import hashlib
+import os
+import os.path
+import pickle
+import sys
+import threading
+import zlib
+
+def cache_dir():
+    base=os.environ.get("XDG_CACHE_HOME")
+    if not base: base=os.path.join(os.path.expanduser("~"),".cache")
+    return os.path.join(base,"djvueditor")
+
+class FileCache(object):
+    """Binary values, one file for each key, in directory ''name'' of
+    ''base_dir'' (default: cache_dir()). Keys are hex digests. The
+    least recently used entries go when the total exceeds max_size
+    bytes, down to low_water of it."""
+
+    name=""
+    max_size=256*1024*1024
+    low_water=0.9
+
+    def __init__(self,base_dir=None):
+        if base_dir is None: base_dir=cache_dir()
+        self._dir=os.path.join(base_dir,self.name)
+        self._lock=threading.Lock()
+        # bytes in the directory: counted on the first store(), then
+        # kept up to date (other processes are seen on eviction)
+        self._total=None
+
+    def _path(self,key):
+        return os.path.join(self._dir,key[:2],key)
+
+    def load(self,key):
+        """Data stored for ''key'', None if missing."""
+        path=self._path(key)
+        try:
+            with open(path,"rb") as fd:
+                data=fd.read()
+        except OSError:
+            return None
+        # the mtime is the last use
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def store(self,key,data):
+        path=self._path(key)
+        tmp_path="%s.%d.%d.tmp" % (path,os.getpid(),threading.get_ident())
+        try:
+            os.makedirs(os.path.dirname(path),exist_ok=True)
+            with open(tmp_path,"wb") as fd:
+                fd.write(data)
+            try:
+                replaced=os.stat(path).st_size
+            except FileNotFoundError:
+                replaced=0
+            os.replace(tmp_path,path)
+        except OSError as e:
+            print("wrn: [%s] %s" % (self.__class__.__name__,e), file=sys.stderr)
+            return
+        with self._lock:
+            if self._total is None:
+                self._total=sum([ size for mtime,size,path in self._entries() ])
+            else:
+                self._total+=len(data)-replaced
+            if self._total>self.max_size: self._evict()
+
+    def _entries(self):
+        """(mtime,size,path) of the files in the cache."""
+        entries=[]
+        try:
+            for sub in os.scandir(self._dir):
+                if not sub.is_dir(): continue
+                for entry in os.scandir(sub.path):
+                    if entry.name.endswith(".tmp"): continue
+                    st=entry.stat()
+                    entries.append( (st.st_mtime,st.st_size,entry.path) )
+        except OSError as e:
+            print("wrn: [%s] %s" % (self.__class__.__name__,e), file=sys.stderr)
+        return entries
+
+    def _evict(self):
+        # called with the lock held
+        entries=self._entries()
+        total=sum([ size for mtime,size,path in entries ])
+        entries.sort()
+        for mtime,size,path in entries:
+            if total<=self.max_size*self.low_water: break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total-=size
+        self._total=total
+
+class TextStructureCache(FileCache):
+    """Parsed hidden text (OcrGrammar), keyed on the hash of the
+    text. CACHE_VERSION must change whenever the parser or the tree
+    classes do."""
+
+    name="text_structure"
+    max_size=128*1024*1024
+    CACHE_VERSION=3
+
+    def _key(self,text):
+        h=hashlib.sha1(("%d\n" % self.CACHE_VERSION).encode())
+        h.update(text.encode("utf-8","surrogatepass"))
+        return h.hexdigest()
+
+    def get(self,text):
+        data=self.load(self._key(text))
+        if data is None: return None
+        try:
+            return pickle.loads(data)
+        except Exception:
+            return None
+
+    def put(self,text,structure):
+        self.store(self._key(text),pickle.dumps(structure,protocol=pickle.HIGHEST_PROTOCOL))
+
+class OcrResultCache(FileCache):
+    """Output of the OCR engines (hocr text, compressed), keyed on the
+    content of the image, the engine (name and version) and its
+    options: the same image in another project, or exported again
+    unchanged, is not recognized again."""
+
+    name="ocr"
+
+    def key(self,image_path,engine,options):
+        h=hashlib.sha256()
+        with open(image_path,"rb") as fd:
+            for block in iter(lambda: fd.read(1<<20),b""):
+                h.update(block)
+        image=h.hexdigest()
+        return hashlib.sha256(("%s\n%s\n%s" % (image,engine,options)).encode("utf-8")).hexdigest()
+
+    def get(self,key):
+        data=self.load(key)
+        if data is None: return None
+        try:
+            text=zlib.decompress(data).decode("utf-8")
+        except (zlib.error,UnicodeDecodeError):
+            return None
+        return text
+
+    def put(self,key,text):
+        self.store(key,zlib.compress(text.encode("utf-8")))
+
+text_structures=TextStructureCache()
+ocr_results=OcrResultCache()
@@ -264,6 +264,20 @@ class DockConfiguration(BaseDock):
     class ConfOcrComboBox(ConfEncodingComboBox):
         section="Ocr Options"
 
+    class ConfOcrSpinBox(ConfSpinBox):
+        section="Ocr Options"
+
+        def _changed(self):
+            val=self.value()
+            if self._app.project is not None:
+                self._app.project[self.section][self._label]=val
+
+        def set_project(self,project):
+            if self._label not in project[self.section]: return
+            self.valueChanged.disconnect(self._changed)
+            self.setValue(project[self.section][self._label])
+            self.valueChanged.connect(self._changed)
+
     dock_title="Configuration"
 
     def __init__(self,application):
@@ -307,7 +321,7 @@ class DockConfiguration(BaseDock):
  
         f_layout.addRow(qtwidgets.QLabel(""))
         widget=self.ConfOcrComboBox(application,"ocr_engine",
-                                    ["tesseract","cuneiform","no ocr"])
+                                    ["tesseract","tesserocr","cuneiform","no ocr"])
         add_row("OCR engine",widget)
 
         for plabel in [ "tesseract_options",
@@ -315,6 +329,21 @@ class DockConfiguration(BaseDock):
             wlabel=plabel.capitalize().replace("_"," ")
             widget=self.ConfOcrLineEdit(application,plabel)
             add_row(wlabel,widget)
+
+        widget=self.ConfOcrSpinBox(application,"tesseract_threads")
+        widget.setMinimum(1)
+        add_row("Tesseract threads",widget)
+
+        widget=self.ConfOcrSpinBox(application,"ocr_timeout")
+        widget.setMinimum(0)
+        widget.setMaximum(3600)
+        widget.setSpecialValueText("none")
+        widget.setSuffix(" s")
+        add_row("OCR timeout",widget)
+
+        widget=self.ConfOcrSpinBox(application,"ocr_retries")
+        widget.setMinimum(0)
+        add_row("OCR retries",widget)
         
         f_widget=qtwidgets.QWidget(self)
         f_widget.setLayout(f_layout)
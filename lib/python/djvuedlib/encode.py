@@ -20,8 +20,6 @@ import glob
 import os
 import shutil
 import sys
-import wand.image
-import wand.color
 import subprocess
 import shlex
 
@@ -115,20 +113,26 @@ class ExternalEncoder(object):
         self._options=shlex.split(options)
         self._temporary_files=[]
 
-    # ImageMagick convert
+    # ImageMagick convert: wand (and MagickWand with it) is loaded
+    # only to encode, not with the project
 
     def _convert(self,dst_format,src_path,dst_path):
+        import wand.image
         with wand.image.Image(filename=src_path) as img:
             img.format = dst_format
             img.save(filename=dst_path)
 
     def _extract_graphics(self,dst_format,src_path,dst_path):
+        import wand.image
+        import wand.color
         with wand.image.Image(filename=src_path) as img:
            img.opaque_paint(target=wand.color.Color("black"),fill=wand.color.Color("white"))
            img.format = dst_format
            img.save(filename=dst_path)
 
     def _extract_textual(self,dst_format,src_path,dst_path):
+        import wand.image
+        import wand.color
         with wand.image.Image(filename=src_path) as img:
            img.opaque_paint(target=wand.color.Color("black"),fill=wand.color.Color("white"),invert=True)
            img.depth = 1
@@ -2,19 +2,33 @@
 
 import re
 
+import grako.exceptions
+
 from . import djvused_hiddentext_parser
 from . import djvused_hiddentext_semantics
+from . import djvused_hiddentext_reader
 
 from .djvused_hiddentext_semantics import OcrBlock as DjvusedOcrBlock
+from .djvused_hiddentext_semantics import OcrGrammar as DjvusedOcrGrammar
+from .djvused_hiddentext_reader import ParseError
+from .djvused_hiddentext_reader import block as djvused_block
 
 def djvused_parse_text(text):
+    return djvused_hiddentext_reader.parse(text)
+
+def djvused_parse_text_grako(text):
+    """Same as djvused_parse_text(), with the grako generated parser
+    (slower)."""
     text=re.sub(r'\s+',' ',text)
     text=text.strip()
     text=re.sub(r'\\\\','&#92;',text)
     text=re.sub(r'\\"','&#34;',text)
     semantics=djvused_hiddentext_semantics.HiddenTextSemantics()
     parser=djvused_hiddentext_parser.djvused_hiddentextParser()
-    return parser.parse(text,rule_name='grammar',semantics=semantics) 
+    try:
+        return parser.parse(text,rule_name='grammar',semantics=semantics) 
+    except grako.exceptions.FailedParse as e:
+        raise ParseError("%s at char %d" % (type(e).__name__,e.pos))
 
 def djvused_parse_file(fname):
     with open(fname,'r') as fd:
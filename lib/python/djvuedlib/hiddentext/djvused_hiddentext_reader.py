@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+"""
+Hand-written parser for djvused hidden text, building the same tree
+as djvused_hiddentextParser with HiddenTextSemantics, in one pass
+and without recursion.
+"""
+
+import re
+
+from .djvused_hiddentext_semantics import OcrBlock, OcrGrammar
+
+class ParseError(Exception): pass
+
+# a token, with the whitespace before it:
+#  * open: "(" label xmin ymin xmax ymax  (groups 1-5)
+#  * close: ")"                            (group 6)
+#  * string: '"' text '"'                  (group 7)
+_TOKEN=re.compile(r'\s*(?:\(\s*(page|column|region|para|line|word|char)\s+(\d+)\s+(\d+)\s+(\d+)\s+(\d+)'
+                  r'|(\))|"((?:[^"\\]|\\.)*)")',re.S)
+
+_SPACES=re.compile(r'\s+')
+_TO_COLLAPSE=re.compile(r'^\s|\s\s|[^\S ]')
+
+def _string(text):
+    # what the grako path does to a string: whitespace collapsed
+    # (and then skipped before the pattern), \\ and \" replaced by
+    # html entities, later unescaped by OcrBlock
+    if _TO_COLLAPSE.search(text):
+        text=_SPACES.sub(' ',text).lstrip(' ')
+    if '\\' in text:
+        text=text.replace('\\\\','&#92;').replace('\\"','&#34;')
+    return text
+
+def block(label,xmin,ymin,xmax,ymax,content):
+    """The OcrBlock parse() builds: ''content'' is the list of the
+    children, or the text of the string as written in djvused."""
+    if type(content) is str: content=_string(content)
+    return OcrBlock(label,xmin,ymin,xmax,ymax,content)
+
+def parse(text):
+    """Parse ''text'' and return an OcrGrammar. Raise ParseError on
+    malformed input."""
+    rules=[]
+    # frames: [ label, xmin, ymin, xmax, ymax, children, text ]
+    stack=[]
+    # coordinates repeat a lot on a page: share one int for each value
+    ints={}
+    def integer(digits):
+        value=ints.get(digits)
+        if value is None: value=ints[digits]=int(digits)
+        return value
+    match=_TOKEN.match
+    pos=0
+    while True:
+        m=match(text,pos)
+        if m is None: break
+        token=m.lastindex
+        if token==5:
+            if stack and stack[-1][6] is not None: break
+            stack.append([ m.group(1), integer(m.group(2)), integer(m.group(3)),
+                           integer(m.group(4)), integer(m.group(5)), [], None ])
+            pos=m.end()
+            continue
+        if not stack: break
+        frame=stack[-1]
+        if token==7:
+            if frame[5] or (frame[6] is not None): break
+            frame[6]=_string(m.group(7))
+            pos=m.end()
+            continue
+        if frame[6] is not None:
+            content=frame[6]
+        elif frame[5]:
+            content=frame[5]
+        else:
+            break
+        pos=m.end()
+        stack.pop()
+        block=OcrBlock(frame[0],frame[1],frame[2],frame[3],frame[4],content)
+        if stack:
+            stack[-1][5].append(block)
+        else:
+            rules.append(block)
+    if stack or (not rules) or text[pos:].strip():
+        raise ParseError("unexpected input at char %d: %s" % (pos,text[pos:pos+40]))
+    return OcrGrammar(rules)
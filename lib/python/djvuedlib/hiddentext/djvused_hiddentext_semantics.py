@@ -1,27 +1,58 @@
 # -*- coding: utf-8 -*-
 
 import html
+import io
+import sys
+
+# leaves share the same (immutable) children: see _children_list()
+_NO_CHILDREN=()
+
+def _position(siblings,obj):
+    """Index of ''obj'' in ''siblings'' (ValueError if missing). The
+    position cached in obj._pos is checked, and when stale (after an
+    insert or a remove) all the siblings are renumbered."""
+    pos=obj._pos
+    if pos<len(siblings) and siblings[pos] is obj: return pos
+    for n,sib in enumerate(siblings):
+        sib._pos=n
+    pos=obj._pos
+    if pos<len(siblings) and siblings[pos] is obj: return pos
+    raise ValueError("not in list")
 
 class OcrBlock(object):
+    """A rule of the hidden text. There are tens of thousands of them
+    on a page, so: no __dict__, level strings shared, no children
+    list for leaves."""
+
     levels=['page','column','region','para','line','word','char']
+    _interned_levels={ l: l for l in levels }
+
+    __slots__=("parent","_pos","_level","_xmin","_ymin","_xmax","_ymax","text","children")
 
     def __init__(self,level,xmin,ymin,xmax,ymax,content):
         self.parent=None
-        self._level=level
+        self._pos=0
+        self._level=self._interned_levels.get(level,level)
         self._xmin=xmin
         self._ymin=ymin
         self._xmax=xmax
         self._ymax=ymax
 
         if type(content) is str:
-            self.text=html.unescape(content)
-            self.children=[]
+            self.text=sys.intern(html.unescape(content))
+            self.children=_NO_CHILDREN
         else:
             self.text=""
             self.children=content
             for ch in self.children:
                 ch.parent=self
 
+    def _children_list(self):
+        # a leaf gets its own list when children are added
+        if type(self.children) is not list:
+            self.children=list(self.children)
+        return self.children
+
     def _get_xmin(self): return self._xmin
     def _get_ymin(self): return self._ymin
     def _get_xmax(self): return self._xmax
@@ -105,16 +136,30 @@ class OcrBlock(object):
 
     def __repr__(self): return self.__str__()
 
-    def out_tree(self,indent=""):
-        S="%s(%s %d %d %d %d" % (indent,self.level,self.xmin,self.ymin,self.xmax,self.ymax)
+    def write_tree(self,fd,indent="",compact=False):
+        """Write the rule in djvused format on file object ''fd''. In
+        compact mode the rule takes a single line, without
+        indentation and final newline."""
+        if compact: 
+            indent=""
+            sep=""
+        else:
+            sep="\n"
         if not self.children:
-            S+=' "%s")\n' % self.text.replace('"','\\"')
-            return S
-        S+="\n"
+            fd.write('%s(%s %d %d %d %d "%s")%s' % (indent,self.level,self.xmin,self.ymin,self.xmax,self.ymax,
+                                                    self.text.replace('"','\\"'),sep))
+            return
+        fd.write("%s(%s %d %d %d %d%s" % (indent,self.level,self.xmin,self.ymin,self.xmax,self.ymax,sep))
+        sub_indent=indent+"    "
         for ch in self.children:
-            S+=ch.out_tree(indent=indent+"    ")
-        S+="%s)\n" % indent
-        return S
+            if compact: fd.write(" ")
+            ch.write_tree(fd,indent=sub_indent,compact=compact)
+        fd.write("%s)%s" % (indent,sep))
+
+    def out_tree(self,indent="",compact=False):
+        fd=io.StringIO()
+        self.write_tree(fd,indent=indent,compact=compact)
+        return fd.getvalue()
 
     def _bg_color(self):
         return (255,255,128,128)
@@ -151,8 +196,9 @@ class OcrBlock(object):
         return ret
 
     def remove_rules(self,ind,count):
+        children=self._children_list()
         for c in range(count):
-            self.children.pop(ind)
+            children.pop(ind)
 
     def sub_rule_levels(self):
         return self.levels[1+self.levels.index(self.level):]
@@ -173,7 +219,7 @@ class OcrBlock(object):
         ok_levels=self.sub_rule_levels()
         if obj.level not in ok_levels:
             obj.level=ok_levels[0]
-        self.children.insert(ind,obj)
+        self._children_list().insert(ind,obj)
         obj.parent=self
         self._xmin=min(self._xmin,obj._xmin)
         self._ymin=min(self._ymin,obj._ymin)
@@ -184,7 +230,7 @@ class OcrBlock(object):
         ok_levels=self.sub_rule_levels()
         if obj.level not in ok_levels:
             obj.level=ok_levels[0]
-        self.children.append(obj)
+        self._children_list().append(obj)
         obj.parent=self
         self._xmin=min(self._xmin,obj._xmin)
         self._ymin=min(self._ymin,obj._ymin)
@@ -192,7 +238,7 @@ class OcrBlock(object):
         self._ymax=max(self._ymax,obj._ymax)
 
     def index(self,child):
-        return self.children.index(child)
+        return _position(self.children,child)
 
     def count_children(self):
         return len(self.children)
@@ -202,7 +248,7 @@ class OcrBlock(object):
         return self.children[ind]
 
     def split_rule(self,obj,splitted):
-        ind=self.children.index(obj)
+        ind=_position(self.children,obj)
         words=splitted[1:]
         words.reverse()
         for w in words:
@@ -212,7 +258,7 @@ class OcrBlock(object):
         obj.text=splitted[0]
 
     def pop_rule(self,obj): 
-        ind=self.children.index(obj)
+        ind=_position(self.children,obj)
         return self.children.pop(ind)
 
     def move_left(self,obj): 
@@ -221,37 +267,39 @@ class OcrBlock(object):
         self.parent.insert_rule(p_ind+1,obj)
 
     def move_up(self,obj):
-        ind=self.children.index(obj)
+        ind=_position(self.children,obj)
         if ind==0: return
         self.children.pop(ind)
         self.children.insert(ind-1,obj)
+        obj._pos,self.children[ind]._pos=ind-1,ind
 
     def move_down(self,obj):
-        ind=self.children.index(obj)
+        ind=_position(self.children,obj)
         if ind==len(self.children)-1: return
         self.children.pop(ind)
         self.children.insert(ind+1,obj)
+        obj._pos,self.children[ind]._pos=ind+1,ind
 
     def move_right(self,obj):
-        ind=self.children.index(obj)
+        ind=_position(self.children,obj)
         if ind==0: return
         self.children.pop(ind)
         self.children[ind-1].append_rule(obj)
 
     def merge_below_rule(self,obj):
-        ind=self.children.index(obj)
+        ind=_position(self.children,obj)
         if ind==len(self.children)-1: return
         obj.concatenate_after(self.children[ind+1])
         self.children.pop(ind+1)
 
     def merge_above_rule(self,obj):
-        ind=self.children.index(obj)
+        ind=_position(self.children,obj)
         if ind==0: return
         obj.concatenate_before(self.children[ind-1])
         self.children.pop(ind-1)
 
     def duplicate_rule(self,obj):
-        ind=self.children.index(obj)
+        ind=_position(self.children,obj)
         dup=obj.copy()
         self.children.insert(ind+1,dup)
 
@@ -269,7 +317,7 @@ class OcrBlock(object):
                 self.level=other.level
         self.text+=other.text
         if other.children:
-            self.children+=[ ch.copy(parent=self) for ch in other.children ]
+            self._children_list().extend([ ch.copy(parent=self) for ch in other.children ])
         self._xmin=min(self._xmin,other._xmin)
         self._ymin=min(self._ymin,other._ymin)
         self._xmax=max(self._xmax,other._xmax)
@@ -281,7 +329,7 @@ class OcrBlock(object):
                 self.level=other.level
         self.text=other.text+self.text
         if other.children:
-            self.children=[ ch.copy(parent=self) for ch in other.children ]+self.children
+            self.children=[ ch.copy(parent=self) for ch in other.children ]+list(self.children)
         self._xmin=min(self._xmin,other._xmin)
         self._ymin=min(self._ymin,other._ymin)
         self._xmax=max(self._xmax,other._xmax)
@@ -330,7 +378,98 @@ class OcrBlock(object):
         self._xmin+=val
         self._xmax+=val
 
+class BlockIndex(object):
+    """Uniform grid over the boxes of the blocks of a page: each block
+    is listed in every cell its box overlaps, so that a query only
+    looks at the blocks of a few cells."""
+
+    cell_size=128
+
+    def __init__(self,rules=()):
+        self._cells={}
+        # block -> box it is listed with
+        self._boxes={}
+        for rule in rules:
+            self.add_tree(rule)
+
+    def _cells_of(self,xmin,ymin,xmax,ymax):
+        s=self.cell_size
+        for cx in range(min(xmin,xmax)//s,max(xmin,xmax)//s+1):
+            for cy in range(min(ymin,ymax)//s,max(ymin,ymax)//s+1):
+                yield cx,cy
+
+    def _unlist(self,block):
+        box=self._boxes.pop(block,None)
+        if box is None: return
+        for cell in self._cells_of(*box):
+            blocks=self._cells.get(cell)
+            if blocks is None: continue
+            blocks.discard(block)
+            if not blocks: del self._cells[cell]
+
+    def update(self,block):
+        """List ''block'' with its current box."""
+        box=(block._xmin,block._ymin,block._xmax,block._ymax)
+        old=self._boxes.get(block)
+        if old==box: return
+        if old is not None: self._unlist(block)
+        self._boxes[block]=box
+        for cell in self._cells_of(*box):
+            blocks=self._cells.get(cell)
+            if blocks is None: blocks=self._cells[cell]=set()
+            blocks.add(block)
+
+    def update_ancestors(self,block):
+        block=block.parent
+        while block is not None:
+            self.update(block)
+            block=block.parent
+
+    def add_tree(self,block):
+        stack=[block]
+        while stack:
+            block=stack.pop()
+            self.update(block)
+            stack.extend(block.children)
+
+    def remove_tree(self,block):
+        stack=[block]
+        while stack:
+            block=stack.pop()
+            self._unlist(block)
+            stack.extend(block.children)
+
+    def containing(self,xmin,ymin,xmax,ymax):
+        """Blocks whose box contains the rectangle (a point if
+        ''xmin''==''xmax'' and ''ymin''==''ymax'')."""
+        s=self.cell_size
+        blocks=self._cells.get((xmin//s,ymin//s),())
+        return [ b for b in blocks
+                 if b._xmin<=xmin and b._ymin<=ymin and b._xmax>=xmax and b._ymax>=ymax ]
+
+    def inside(self,xmin,ymin,xmax,ymax):
+        """Blocks whose box is inside the rectangle."""
+        found=set()
+        for cell in self._cells_of(xmin,ymin,xmax,ymax):
+            blocks=self._cells.get(cell)
+            if blocks: found.update(blocks)
+        return [ b for b in found
+                 if b._xmin>=xmin and b._ymin>=ymin and b._xmax<=xmax and b._ymax<=ymax ]
+
+def _nesting(block):
+    # depth, then larger boxes first
+    depth=0
+    area=block._w*block._h
+    while block.parent is not None:
+        depth+=1
+        block=block.parent
+    return depth,-area
+
 class OcrGrammar(object):
+    # built on the first spatial query, then kept up to date by the
+    # operations below
+    _block_index=None
+
     def __init__(self,ast):
         self.ast=ast
         self.rules=[]
@@ -340,11 +479,70 @@ class OcrGrammar(object):
             else:
                 self.rules.append(rule)
 
-    def out_tree(self):
-        S=""
+    def write_tree(self,fd,compact=False):
+        """Write all the rules on file object ''fd'', one line each in
+        compact mode."""
         for r in self.rules:
-            S+=r.out_tree()
-        return S
+            r.write_tree(fd,compact=compact)
+            if compact: fd.write("\n")
+
+    def out_tree(self,compact=False):
+        fd=io.StringIO()
+        self.write_tree(fd,compact=compact)
+        return fd.getvalue()
+
+    def __getstate__(self):
+        state=self.__dict__.copy()
+        state.pop("_block_index",None)
+        return state
+
+    @property
+    def block_index(self):
+        if self._block_index is None:
+            self._block_index=BlockIndex(self.rules)
+        return self._block_index
+
+    def _siblings(self,obj):
+        return self._children(obj.parent)
+
+    def _reindex(self,obj,siblings=None):
+        """Update the index after a change of ''obj'' (and of its
+        children); ''siblings'', the siblings of ''obj'' before the
+        change, to account for added or removed siblings."""
+        index=self._block_index
+        if index is None: return
+        if siblings is not None:
+            before=set(siblings)
+            after=set(self._siblings(obj))
+            for block in before-after: index.remove_tree(block)
+            for block in after-before: index.add_tree(block)
+        index.add_tree(obj)
+        index.update_ancestors(obj)
+
+    def reset_index(self):
+        """Drop the index, rebuilt on the next query."""
+        self._block_index=None
+
+    def reindex_rule(self,obj):
+        """To call after ''obj'' has been changed directly, not by an
+        operation of OcrGrammar."""
+        self._reindex(obj)
+
+    def rules_at(self,x,y):
+        """Rules containing point (''x'',''y''), innermost first."""
+        return self.rules_containing(x,y,x,y)
+
+    def rules_containing(self,xmin,ymin,xmax,ymax):
+        """Rules containing the rectangle, innermost first."""
+        rules=self.block_index.containing(xmin,ymin,xmax,ymax)
+        rules.sort(key=_nesting,reverse=True)
+        return rules
+
+    def rules_inside(self,xmin,ymin,xmax,ymax):
+        """Rules inside the rectangle, outermost first."""
+        rules=self.block_index.inside(xmin,ymin,xmax,ymax)
+        rules.sort(key=_nesting)
+        return rules
 
     def _delist(self,L):
         if type(L)!=list:
@@ -364,19 +562,33 @@ class OcrGrammar(object):
             block=OcrBlock("page",0,0,0,0,"")
             for c in range(count):
                 self.rules.insert(ind,block.copy())
+            self._reindex_children(parent,ind,count)
             return
         parent.insert_rules(ind,count)
+        self._reindex_children(parent,ind,count)
 
     def remove_rules(self,parent,ind,count):
+        removed=self._children(parent)[ind:ind+count]
         if parent is None:
             for c in range(count):
                 self.rules.pop(ind)
-            return
-        parent.remove_rules(ind,count) 
+        else:
+            parent.remove_rules(ind,count) 
+        if self._block_index is not None:
+            for block in removed:
+                self._block_index.remove_tree(block)
+
+    def _children(self,parent):
+        if parent is None: return self.rules
+        return parent.children
+
+    def _reindex_children(self,parent,ind,count):
+        for block in self._children(parent)[ind:ind+count]:
+            self._reindex(block)
 
     def index(self,obj):
         if obj.parent is None:
-            return self.rules.index(obj)
+            return _position(self.rules,obj)
         return obj.parent.index(obj)
 
     def count_children(self,obj):
@@ -391,37 +603,57 @@ class OcrGrammar(object):
         return parent.get_rule(ind)
 
     def duplicate_rule(self,obj):
+        siblings=list(self._siblings(obj))
+        self._duplicate_rule(obj)
+        self._reindex(obj,siblings)
+
+    def _duplicate_rule(self,obj):
         if obj.parent is not None:
             obj.parent.duplicate_rule(obj)
             return
-        ind=self.rules.index(obj)
+        ind=_position(self.rules,obj)
         dup=obj.copy()
         self.rules.insert(ind+1,dup)
 
     def merge_below_rule(self,obj):
+        siblings=list(self._siblings(obj))
+        self._merge_below_rule(obj)
+        self._reindex(obj,siblings)
+
+    def _merge_below_rule(self,obj):
         if obj.parent is not None:
             obj.parent.merge_below_rule(obj)
             return
-        ind=self.rules.index(obj)
+        ind=_position(self.rules,obj)
         if ind==len(self.rules)-1: return
         obj.concatenate_after(self.rules[ind+1])
         self.rules.pop(ind+1)
 
     def merge_above_rule(self,obj):
+        siblings=list(self._siblings(obj))
+        self._merge_above_rule(obj)
+        self._reindex(obj,siblings)
+
+    def _merge_above_rule(self,obj):
         if obj.parent is not None:
             obj.parent.merge_below_rule(obj)
             return
-        ind=self.rules.index(obj)
+        ind=_position(self.rules,obj)
         if ind==0: return
         obj.concatenate_before(self.rules[ind-1])
         self.rules.pop(ind-1)
 
     def split_rule(self,obj,splitted):
+        siblings=list(self._siblings(obj))
+        self._split_rule(obj,splitted)
+        self._reindex(obj,siblings)
+
+    def _split_rule(self,obj,splitted):
         if obj.children: return
         if obj.parent is not None:
             obj.parent.split_rule(obj,splitted)
             return
-        ind=self.rules.index(obj)
+        ind=_position(self.rules,obj)
         words=splitted[1:]
         words.reverse()
         for w in words:
@@ -432,55 +664,71 @@ class OcrGrammar(object):
 
     def shift_down_rule(self,obj,val):
         obj.shift_down(val)
+        self._reindex(obj)
 
     def shift_up_rule(self,obj,val):
         obj.shift_up(val)
+        self._reindex(obj)
 
     def shift_right_rule(self,obj,val):
         obj.shift_right(val)
+        self._reindex(obj)
 
     def shift_left_rule(self,obj,val):
         obj.shift_left(val)
+        self._reindex(obj)
 
     def create_rule(self,parent,level,xmin,ymin,xmax,ymax,text):
         if parent is None:
             block=OcrBlock(level,xmin,ymin,xmax,ymax,text)
             self.rules.insert(0,block)
-            return
-        parent.create_rule(level,xmin,ymin,xmax,ymax,text)
+        else:
+            parent.create_rule(level,xmin,ymin,xmax,ymax,text)
+        self._reindex(self._children(parent)[0])
 
     def move_up(self,obj): 
         if obj.parent is not None:
             obj.parent.move_up(obj)
             return
-        ind=self.rules.index(obj)
+        ind=_position(self.rules,obj)
         if ind==0: return
         self.rules.pop(ind)
         self.rules.insert(ind-1,obj)
+        obj._pos,self.rules[ind]._pos=ind-1,ind
 
     def move_down(self,obj): 
         if obj.parent is not None:
             obj.parent.move_down(obj)
             return
-        ind=self.rules.index(obj)
+        ind=_position(self.rules,obj)
         if ind==len(self.rules)-1: return
         self.rules.pop(ind)
         self.rules.insert(ind+1,obj)
+        obj._pos,self.rules[ind]._pos=ind+1,ind
 
     def move_left(self,obj): 
+        self._move_left(obj)
+        self._reindex(obj)
+
+    def _move_left(self,obj): 
         if obj.parent is None: return
         if obj.parent.parent is not None:
             obj.parent.move_left(obj)
             return
-        p_ind=self.rules.index(obj.parent)
+        p_ind=_position(self.rules,obj.parent)
         obj.parent.pop_rule(obj)
         self.rules.insert(p_ind+1,obj)
+        obj.parent=None
 
     def move_right(self,obj): 
+        self._move_right(obj)
+        self._reindex(obj)
+
+    def _move_right(self,obj): 
         if obj.parent is not None:
             obj.parent.move_right(obj)
             return
-        ind=self.rules.index(obj)
+        ind=_position(self.rules,obj)
         if ind==0: return
         self.rules.pop(ind)
         self.rules[ind-1].append_rule(obj)
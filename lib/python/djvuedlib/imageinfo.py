@@ -0,0 +1,212 @@
+"""
+Image headers (dpi, depth, width, height, format) and a persistent
+cache of them.
+"""
+
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import os.path
+import struct
+import sys
+import threading
+
+def ping(path):
+    """Read the header of image ''path'': directly for plain tiff and
+    pnm files, with ImageMagick otherwise."""
+    header=read_header(path)
+    if header is not None: return header
+    import wand.image
+    with wand.image.Image.ping(filename=path) as img:
+        return (int(img.resolution[0]),img.depth,img.width,img.height,img.format)
+
+def read_header(path):
+    """Read the header of a tiff or pnm image without ImageMagick,
+    giving the same values. Return None if the file needs
+    ImageMagick."""
+    try:
+        with open(path,"rb") as fd:
+            magic=fd.read(4)
+            if magic[:2] in [ b"II", b"MM" ]: return _read_tiff(fd,magic)
+            if magic[:1]==b"P": return _read_pnm(fd,magic)
+    except (OSError,ValueError,struct.error):
+        return None
+    return None
+
+# tiff field types: size, struct format
+_TIFF_TYPES={ 1: (1,"B"), 3: (2,"H"), 4: (4,"I"), 5: (8,"II") }
+
+def _read_tiff(fd,magic):
+    order="<" if magic[:2]==b"II" else ">"
+    if struct.unpack(order+"H",magic[2:])[0]!=42: return None # BigTIFF
+    fd.seek(4)
+    ifd_offset=struct.unpack(order+"I",fd.read(4))[0]
+    fd.seek(ifd_offset)
+    num=struct.unpack(order+"H",fd.read(2))[0]
+    data=fd.read(12*num)
+    tags={}
+    for n in range(num):
+        tag,ftype,count=struct.unpack(order+"HHI",data[12*n:12*n+8])
+        if tag not in [ 256, 257, 258, 277, 282, 296 ]: continue
+        if ftype not in _TIFF_TYPES: return None
+        size,fmt=_TIFF_TYPES[ftype]
+        raw=data[12*n+8:12*n+12]
+        if size*count>4:
+            fd.seek(struct.unpack(order+"I",raw)[0])
+            raw=fd.read(size*count)
+        tags[tag]=struct.unpack(order+fmt*count,raw[:size*count])
+    if (256 not in tags) or (257 not in tags) or (282 not in tags): return None
+    if tags.get(296,(2,))[0]!=2: return None # resolution not in inches
+    num,den=tags[282][:2]
+    if not den: return None
+    depth=tags.get(258,(1,))[0]
+    return (int(num/den),depth,tags[256][0],tags[257][0],"TIFF")
+
+_PNM_FORMATS={ b"P1": "PBM", b"P4": "PBM", b"P2": "PGM", b"P5": "PGM", b"P3": "PPM", b"P6": "PPM" }
+
+def _read_pnm(fd,magic):
+    if magic[:2] not in _PNM_FORMATS: return None
+    data=magic[2:]+fd.read(1024)
+    fields=[]
+    for r in data.split(b"\n"):
+        fields+=r.split(b"#")[0].split()
+        if len(fields)>=4: break
+    bitmap=magic[:2] in [ b"P1", b"P4" ]
+    if len(fields)<(2 if bitmap else 3): return None
+    width,height=int(fields[0]),int(fields[1])
+    depth=1 if bitmap else int(fields[2]).bit_length()
+    # no resolution in pnm: ImageMagick's default
+    return (72,depth,width,height,_PNM_FORMATS[magic[:2]])
+
+def _safe_ping(path):
+    try:
+        return ping(path),None
+    except Exception as e:
+        return None,str(e)
+
+def missing_paths(cache,paths):
+    """The paths (with their stat) of ''paths'' missing from ''cache''
+    or stale."""
+    ret=[]
+    for path in paths:
+        try:
+            st=os.stat(path)
+        except OSError:
+            continue
+        if cache.lookup(path,st) is None: ret.append((path,st))
+    return ret
+
+def _mp_context():
+    # the caller is a Qt process with threads running: its workers are
+    # not forked from it
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+def probe(cache,paths,emit_status=None,max_workers=None):
+    """Read the headers of the images in ''paths'' missing from
+    ''cache''. Those needing ImageMagick are read in parallel with a
+    process pool (''max_workers'' defaults to the number of cpus),
+    started only if there are any. Results are merged in the order
+    of ''paths''; progress is reported to ''emit_status''."""
+    missing=[]
+    for path,st in missing_paths(cache,paths):
+        # plain headers are read here, faster than starting a worker
+        header=read_header(path)
+        if header is not None:
+            cache.set(path,header,st)
+            continue
+        missing.append((path,st))
+    if not missing: return
+    if max_workers is None: max_workers=os.cpu_count() or 1
+    max_workers=min(max_workers,len(missing))
+    total=len(missing)
+    step=max(1,total//100)
+
+    def merge(results):
+        for n,((path,st),(header,error)) in enumerate(zip(missing,results)):
+            if error is not None:
+                print("wrn: %s: %s" % (path,error), file=sys.stderr)
+            else:
+                cache.set(path,header,st)
+            if (emit_status is not None) and ((n+1)%step==0 or n+1==total):
+                emit_status("Reading image headers: %d/%d" % (n+1,total))
+
+    paths=[ path for path,st in missing ]
+    if max_workers==1:
+        merge(map(_safe_ping,paths))
+        return
+    chunksize=max(1,total//(4*max_workers))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers,mp_context=_mp_context()) as executor:
+        merge(executor.map(_safe_ping,paths,chunksize=chunksize))
+
+class ImageInfoCache(object):
+    """Headers of the images of a project, kept in json file ''fpath''.
+
+    An entry is valid while size and modification time (in ns) of the
+    image are unchanged; stale entries are refreshed on access, so an
+    unchanged image is never decoded twice. Paths are stored relative
+    to the cache directory.
+
+    """
+
+    fname=".djvueditor_imageinfo.json"
+
+    def __init__(self,fpath):
+        self._fpath=fpath
+        self._base_dir=os.path.dirname(os.path.abspath(fpath))
+        self._lock=threading.Lock()
+        self._entries={}
+        self._changed=False
+        if not os.path.exists(fpath): return
+        try:
+            with open(fpath,"r") as fd:
+                self._entries=json.load(fd)
+        except (OSError,ValueError) as e:
+            print("wrn: %s: %s, ignored" % (fpath,e), file=sys.stderr)
+
+    def _key(self,path):
+        return os.path.relpath(os.path.abspath(path),self._base_dir)
+
+    def lookup(self,path,st=None):
+        """Cached header of ''path'', or None if missing or stale."""
+        if st is None: st=os.stat(path)
+        with self._lock:
+            entry=self._entries.get(self._key(path))
+        if entry is None: return None
+        if (entry[0]!=st.st_size) or (entry[1]!=st.st_mtime_ns): return None
+        return tuple(entry[2:])
+
+    def set(self,path,header,st=None):
+        if st is None: st=os.stat(path)
+        with self._lock:
+            self._entries[self._key(path)]=[st.st_size,st.st_mtime_ns]+list(header)
+            self._changed=True
+
+    def discard(self,path):
+        with self._lock:
+            if self._entries.pop(self._key(path),None) is not None:
+                self._changed=True
+
+    def get(self,path):
+        """Header of ''path'', read from the image only on a cache miss."""
+        st=os.stat(path)
+        header=self.lookup(path,st)
+        if header is not None: return header
+        header=ping(path)
+        self.set(path,header,st)
+        return header
+
+    def save(self):
+        with self._lock:
+            if not self._changed: return
+            data=json.dumps(self._entries)
+            self._changed=False
+        tmp_path=self._fpath+".tmp"
+        try:
+            with open(tmp_path,"w") as fd:
+                fd.write(data)
+            os.replace(tmp_path,self._fpath)
+        except OSError as e:
+            print("wrn: %s: %s" % (self._fpath,e), file=sys.stderr)
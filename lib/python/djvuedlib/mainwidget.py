@@ -3,6 +3,9 @@
 import os.path
 import re
 import datetime
+import collections
+import concurrent.futures
+import threading
 
 import PySide2.QtWidgets as qtwidgets
 import PySide2.QtCore as qtcore
@@ -137,6 +140,8 @@ class ImageWidget(qtwidgets.QWidget):
     class RulersWidget(LayerWidget):
         firstPointClicked = qtcore.Signal(int,int)
         secondPointClicked = qtcore.Signal(int,int)
+        # ctrl+click: no mark
+        pointSelected = qtcore.Signal(int,int)
 
         def __init__(self,size,margin_size):
             super().__init__(size,margin_size)
@@ -166,6 +171,10 @@ class ImageWidget(qtwidgets.QWidget):
             if Y<Y0: return
             if Y>Y0+H: return
 
+            if event.modifiers() & qtcore.Qt.ControlModifier:
+                self.pointSelected.emit(X-X0,H-Y+Y0)
+                return
+
             if event.button() == qtcore.Qt.RightButton:
                 self._marks=[]
                 return
@@ -252,7 +261,10 @@ class ImageWidget(qtwidgets.QWidget):
 
             
 
-    def __init__(self,path):
+    ruleRequested = qtcore.Signal(int,int)
+    areaChanged = qtcore.Signal(int,int,int,int)
+
+    def __init__(self,path,image=None):
         qtwidgets.QWidget.__init__(self)
         self._path=path
 
@@ -260,7 +272,10 @@ class ImageWidget(qtwidgets.QWidget):
 
         self._factor_label=qtwidgets.QLabel()
 
-        pixmap=qtgui.QPixmap(self._path)
+        if image is not None:
+            pixmap=qtgui.QPixmap.fromImage(image)
+        else:
+            pixmap=qtgui.QPixmap(self._path)
         self._pixmap_size=pixmap.size()
         self._margin_size=qtcore.QSize(100,100)
 
@@ -332,6 +347,7 @@ class ImageWidget(qtwidgets.QWidget):
 
         self._rulers.firstPointClicked.connect(self._first_point_clicked)
         self._rulers.secondPointClicked.connect(self._second_point_clicked)
+        self._rulers.pointSelected.connect(self.ruleRequested.emit)
 
     def _first_point_clicked(self,x,y):
         self._first_x_label.setText(str(x))
@@ -343,6 +359,9 @@ class ImageWidget(qtwidgets.QWidget):
         self._second_y_label.setText(str(y))
         self._second_c_label.setText(" , ")
         self._second_p_label.setText(" – ")
+        first,second=self.get_points()
+        if first is None: return
+        self.areaChanged.emit(min(first[0],x),min(first[1],y),max(first[0],x),max(first[1],y))
 
     def get_points(self):
         x1=self._first_x_label.text()
@@ -376,6 +395,12 @@ class ImageWidget(qtwidgets.QWidget):
     def highlight_rule(self,rule):
         self._highlight.highlight(rule.highlight_rects())
 
+    def highlight_rules(self,rules):
+        rects=[]
+        for rule in rules:
+            rects+=rule.highlight_rects()
+        self._highlight.highlight(rects)
+
     def fit(self):
         max_size=self._scroll.viewport().size()
 
@@ -409,6 +434,7 @@ class ImageWidget(qtwidgets.QWidget):
 class OcrWidget(qtwidgets.QTreeView):
     ruleSelected = qtcore.Signal(object)
     outlineRequested = qtcore.Signal(object)
+    textEdited = qtcore.Signal()
 
     class ImportAreaForm(qtwidgets.QFormLayout):
         def __init__(self,levels):
@@ -431,14 +457,11 @@ class OcrWidget(qtwidgets.QTreeView):
         self._page=page
         qtwidgets.QTreeView.__init__(self)
         self._model=models.OcrModel(page)
-        self.setModel(self._model)
         self.setAlternatingRowColors(True)
-        self.expandAll()
         self.setSelectionMode(self.SingleSelection)
         self.setSelectionBehavior(self.SelectRows)
 
         self._model.dataChanged.connect(self._data_changed)
-        self.selectionModel().selectionChanged.connect(self._selection_changed)
 
         self.setContextMenuPolicy(qtcore.Qt.CustomContextMenu)
         self.customContextMenuRequested.connect(self.rule_menu_open)
@@ -461,6 +484,8 @@ class OcrWidget(qtwidgets.QTreeView):
             "save": qtwidgets.QShortcut(qtgui.QKeySequence(qtcore.Qt.Key_S),self),
             "import_area": qtwidgets.QShortcut(qtgui.QKeySequence(qtcore.Qt.Key_A),self),
             "in_outline": qtwidgets.QShortcut(qtgui.QKeySequence(qtcore.Qt.Key_O),self),
+            "undo": qtwidgets.QShortcut(qtgui.QKeySequence.Undo,self),
+            "redo": qtwidgets.QShortcut(qtgui.QKeySequence.Redo,self),
         }
         for k in self.shortcuts:
             self.shortcuts[k].setContext(qtcore.Qt.WidgetWithChildrenShortcut)
@@ -473,54 +498,95 @@ class OcrWidget(qtwidgets.QTreeView):
         self.shortcuts["accentize"].activated.connect(self._accentize_selected_rule)
         self.shortcuts["fix_apostrophes"].activated.connect(self._fix_apostrophes_selected_rule)
         self.shortcuts["in_outline"].activated.connect(self._insert_in_outline)
+        self.shortcuts["undo"].activated.connect(self.undo)
+        self.shortcuts["redo"].activated.connect(self.redo)
+
+        self._model.dataChanged.connect(lambda *args: self.textEdited.emit())
+        self._model.layoutChanged.connect(lambda *args: self.textEdited.emit())
+        self._model.modelReset.connect(self.textEdited.emit)
+
+    def _set_model(self):
+        # the model is set when the tree is first shown: only then the
+        # text of the page needs to be parsed
+        if self.model() is not None: return
+        self.setModel(self._model)
+        self.expandAll()
+        self.selectionModel().selectionChanged.connect(self._selection_changed)
+
+    def showEvent(self,event):
+        self._set_model()
+        qtwidgets.QTreeView.showEvent(self,event)
 
     def refresh(self):
         self._model.layoutChanged.emit()
 
+    def undo(self):
+        if self._model.undo() is None: return
+        self.expandAll()
+
+    def redo(self):
+        if self._model.redo() is None: return
+        self.expandAll()
+
     def _delete_selected_rule(self):
-        index=self.selectionModel().currentIndex()
+        index=self.currentIndex()
         if not index.isValid(): return
         self._model.removeRow(index.row(),parent=self._model.parent(index))
 
     def _crop_to_children_selected_rule(self):
-        index=self.selectionModel().currentIndex()
+        index=self.currentIndex()
         if not index.isValid(): return
         self._model.crop_to_children(index)
 
     def _insert_in_outline(self,index=None):
         if index is None:
-            index=self.selectionModel().currentIndex()
+            index=self.currentIndex()
         if not index.isValid(): return
         self.outlineRequested.emit(index.internalPointer())
 
     def _lower_selected_rule(self):
-        index=self.selectionModel().currentIndex()
+        index=self.currentIndex()
         if not index.isValid(): return
         self._model.lower_rule(index)
 
     def _upper_selected_rule(self):
-        index=self.selectionModel().currentIndex()
+        index=self.currentIndex()
         if not index.isValid(): return
         self._model.upper_rule(index)
 
     def _capitalize_selected_rule(self):
-        index=self.selectionModel().currentIndex()
+        index=self.currentIndex()
         if not index.isValid(): return
         self._model.capitalize_rule(index)
 
     def _accentize_selected_rule(self):
-        index=self.selectionModel().currentIndex()
+        index=self.currentIndex()
         if not index.isValid(): return
         self._model.accentize_rule(index)
 
     def _fix_apostrophes_selected_rule(self):
-        index=self.selectionModel().currentIndex()
+        index=self.currentIndex()
         if not index.isValid(): return
         self._model.fix_apostrophes_rule(index)
 
+    def select_rule(self,rule):
+        self._set_model()
+        row=self._model._index(rule)
+        if row is None: return
+        index=self._model.createIndex(row,0,rule)
+        self.setCurrentIndex(index)
+        self.scrollTo(index)
+
     def import_rule(self,xmin,ymin,xmax,ymax):
-        index=self.selectionModel().currentIndex()
-        if not index.isValid(): return
+        index=self.currentIndex()
+        if not index.isValid(): 
+            # no selection: the innermost rule around the area
+            rules=self._page.text_rules_containing(xmin,ymin,xmax,ymax)
+            rules=[ r for r in rules or [] if r.sub_rule_levels() ]
+            if not rules: return
+            self.select_rule(rules[0])
+            index=self.currentIndex()
+            if not index.isValid(): return
         obj=index.internalPointer()
         levels=obj.sub_rule_levels()
         if not levels: return
@@ -532,28 +598,28 @@ class OcrWidget(qtwidgets.QTreeView):
 
     def move_up(self,index=None):
         if index is None:
-            index=self.selectionModel().currentIndex()
+            index=self.currentIndex()
         if not index.isValid(): return
         new_index=self._model.move_up(index)
         self.selectionModel().select(new_index,qtcore.QItemSelectionModel.Clear | qtcore.QItemSelectionModel.SelectCurrent | qtcore.QItemSelectionModel.Rows)
 
     def move_down(self,index=None):
         if index is None:
-            index=self.selectionModel().currentIndex()
+            index=self.currentIndex()
         if not index.isValid(): return
         new_index=self._model.move_down(index)
         self.selectionModel().select(new_index,qtcore.QItemSelectionModel.Clear | qtcore.QItemSelectionModel.SelectCurrent | qtcore.QItemSelectionModel.Rows)
 
     def move_left(self,index=None):
         if index is None:
-            index=self.selectionModel().currentIndex()
+            index=self.currentIndex()
         if not index.isValid(): return
         new_index=self._model.move_left(index)
         self.selectionModel().select(new_index,qtcore.QItemSelectionModel.Clear | qtcore.QItemSelectionModel.SelectCurrent | qtcore.QItemSelectionModel.Rows)
 
     def move_right(self,index=None):
         if index is None:
-            index=self.selectionModel().currentIndex()
+            index=self.currentIndex()
         if not index.isValid(): return
         new_index=self._model.move_right(index)
         self.selectionModel().select(new_index,qtcore.QItemSelectionModel.Clear | qtcore.QItemSelectionModel.SelectCurrent | qtcore.QItemSelectionModel.Rows)
@@ -650,7 +716,7 @@ class OcrWidget(qtwidgets.QTreeView):
         
     def _select(self,index=None):
         if index is None:
-            index=self.selectionModel().currentIndex()
+            index=self.currentIndex()
         if not index.isValid(): return
         rule=index.internalPointer()
         self.ruleSelected.emit(rule)
@@ -665,6 +731,8 @@ class OcrWidget(qtwidgets.QTreeView):
         self._select(index)
 
 class PageWidget(qtwidgets.QSplitter):
+    # ms without edits before the text is saved
+    save_delay=2000
     labelChanged = qtcore.Signal(object)
 
     class PageToolBar(qtwidgets.QToolBar):
@@ -725,13 +793,29 @@ class PageWidget(qtwidgets.QSplitter):
 
     
 
-    def __init__(self,app,page):
+    def __init__(self,app,page,prefetcher=None):
         self._app=app
         self._page=page
+        self._prefetcher=prefetcher
+        self._built=False
+        self._editable=True
         qtwidgets.QSplitter.__init__(self)
 
+    def showEvent(self,event):
+        self._build()
+        qtwidgets.QSplitter.showEvent(self,event)
+
+    def _build(self):
+        # the content is built when the page is first shown
+        if self._built: return
+        self._built=True
+        page=self._page
+        image=None
+        if self._prefetcher is not None:
+            image=self._prefetcher.take(page)
+
         ### Left
-        self._image=ImageWidget(self._page.path)
+        self._image=ImageWidget(self._page.path,image=image)
         self._image.setFont(self._app.main_font(size=12))
         
         self.addWidget(self._image)
@@ -761,6 +845,14 @@ class PageWidget(qtwidgets.QSplitter):
         self._ocr_widget.ruleSelected.connect(lambda rule: self._image.highlight_rule(rule))
         self._ocr_widget.outlineRequested.connect(self._insert_in_outline)
 
+        self._save_timer=qtcore.QTimer(self)
+        self._save_timer.setSingleShot(True)
+        self._save_timer.setInterval(self.save_delay)
+        self._save_timer.timeout.connect(self.save_text)
+        self._ocr_widget.textEdited.connect(self._save_timer.start)
+        self._image.ruleRequested.connect(self._select_rule_at)
+        self._image.areaChanged.connect(self._area_changed)
+
         #h_layout.addWidget(toolbar,stretch=0)
         h_layout.addStretch(stretch=1)
 
@@ -782,7 +874,9 @@ class PageWidget(qtwidgets.QSplitter):
 
         right_widget=qtwidgets.QWidget()
         right_widget.setLayout(v_layout)
+        right_widget.setEnabled(self._editable)
         self.addWidget(right_widget)
+        self._right_widget=right_widget
 
         self.shortcuts = {
             "save": qtwidgets.QShortcut(qtgui.QKeySequence(qtcore.Qt.Key_S),self),
@@ -794,17 +888,54 @@ class PageWidget(qtwidgets.QSplitter):
         self.shortcuts["save"].activated.connect(self._save_text)
         self.shortcuts["import_area"].activated.connect(self._import_area)
 
+        self._image.show()
+        right_widget.show()
+
     def _ocr(self): pass
 
+    def set_editable(self,editable):
+        """Allow or not the changes of the page (text and title)."""
+        self._editable=editable
+        if self._built: self._right_widget.setEnabled(editable)
+
+    def refresh_text(self):
+        """Show the text of the page again, after it has been replaced
+        (by the OCR)."""
+        if not self._built: return
+        self._ocr_widget.refresh()
+        if self._page.text is not None:
+            self._ocr_area.setPlainText(self._page.text)
+
+    def _select_rule_at(self,x,y):
+        rules=self._page.text_rules_at(x,y)
+        if not rules: return
+        self._ocr_widget.select_rule(rules[0])
+
+    def _area_changed(self,xmin,ymin,xmax,ymax):
+        rules=self._page.text_rules_inside(xmin,ymin,xmax,ymax)
+        if rules is None: return
+        # outermost first: their children are highlighted with them
+        found=set(rules)
+        self._image.highlight_rules([ r for r in rules if r.parent not in found ])
+
     def update_page_number(self):
+        if not self._built: return
         self._title_widget.setText(self._page.title)
 
     @property
     def page_number(self):
         return self._page.title
 
+    def save_text(self):
+        """Write the text of the page, if changed: on idle, on page
+        switch and on explicit save."""
+        if self._built: self._save_timer.stop()
+        if not self._page.save_text_structure(): return False
+        if self._built: self._ocr_area.setPlainText(self._page.text)
+        return True
+
     def _save_text(self): 
-        self._page.save_text_structure()
+        self.save_text()
         self._ocr_area.setPlainText(self._page.text)
         self._app.emit_status("%s saved" % str(self._page))
 
@@ -856,6 +987,7 @@ class PageWidget(qtwidgets.QSplitter):
         return str(self._page)
 
     def _import_area(self):
+        if not self._editable: return
         first,second=self._image.get_points()
         if first is None: return
         if second is None: return
@@ -865,6 +997,122 @@ class PageWidget(qtwidgets.QSplitter):
         ymax=max(first[1],second[1])
         self._ocr_widget.import_rule(xmin,ymin,xmax,ymax)
 
+class PagePrefetcher(object):
+    """Loads in background the decoded image and the parsed text of
+    the pages around the current one.
+
+    Images, with the text parsed for them, are kept in a LRU cache of
+    at most ''max_bytes'' and handed over to the PageWidget with
+    take(); the text of an image dropped from the cache is released
+    (see Page.release_text_structure()). A text parsed before (by a
+    PageWidget) is not counted, nor released. Each job is tagged
+    with the generation that started it: a new prefetch() (or
+    cancel()) cancels the queued jobs no longer wanted, and running
+    ones drop their result.
+
+    """
+
+    neighbours=2
+    max_bytes=512*1024*1024
+    # estimated size of a parsed block: OcrBlock, text and children list
+    block_bytes=256
+
+    def __init__(self,max_workers=2):
+        self._executor=concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self._lock=threading.Lock()
+        self._generation=0
+        self._jobs={} # path -> (generation,future)
+        self._images=collections.OrderedDict() # path -> (image,page,bytes of the text)
+        self._bytes=0
+
+    def cancel(self):
+        with self._lock:
+            self._generation+=1
+            for generation,future in self._jobs.values():
+                future.cancel()
+            self._jobs={}
+
+    def clear(self):
+        self.cancel()
+        with self._lock:
+            while self._images:
+                self._drop(next(iter(self._images)))
+
+    def discard(self,paths):
+        """Forget what is loaded, or being loaded, of the pages of
+        ''paths'' (changed or removed files)."""
+        with self._lock:
+            for path in paths:
+                if path in self._jobs: self._jobs.pop(path)[1].cancel()
+                if path in self._images: self._drop(path)
+
+    def prefetch(self,pages,current):
+        """Start loading the neighbours of page number ''current''."""
+        wanted=collections.OrderedDict()
+        for d in range(1,self.neighbours+1):
+            for ind in [ current+d, current-d ]:
+                if 0<=ind<len(pages): wanted[pages[ind].path]=pages[ind]
+        with self._lock:
+            self._generation+=1
+            for path in list(self._jobs):
+                if path in wanted: continue
+                self._jobs.pop(path)[1].cancel()
+            for path,page in wanted.items():
+                if path in self._images: 
+                    self._images.move_to_end(path)
+                    continue
+                if path in self._jobs: continue
+                future=self._executor.submit(self._load,page,self._generation)
+                self._jobs[path]=(self._generation,future)
+
+    def _stale(self,path,generation):
+        with self._lock:
+            return self._jobs.get(path,(None,))[0]!=generation
+
+    def _text_bytes(self,structure):
+        if structure is None: return 0
+        count=0
+        stack=list(structure.rules)
+        while stack:
+            block=stack.pop()
+            count+=1
+            stack.extend(block.children)
+        return count*self.block_bytes
+
+    def _drop(self,path):
+        # with the lock held: a page taken meanwhile keeps its text
+        image,page,text_bytes=self._images.pop(path)
+        self._bytes-=image.sizeInBytes()+text_bytes
+        if text_bytes: page.release_text_structure()
+
+    def _load(self,page,generation):
+        if self._stale(page.path,generation): return
+        image=qtgui.QImage(page.path)
+        if self._stale(page.path,generation): return
+        parsed=page.text_structure_loaded
+        text_bytes=0 if parsed else self._text_bytes(page.text_structure)
+        with self._lock:
+            if self._jobs.get(page.path,(None,))[0]!=generation: return
+            del self._jobs[page.path]
+            if image.isNull(): return
+            self._images[page.path]=(image,page,text_bytes)
+            self._bytes+=image.sizeInBytes()+text_bytes
+            while (self._bytes>self.max_bytes) and (len(self._images)>1):
+                self._drop(next(iter(self._images)))
+
+    def take(self,page):
+        """Prefetched image of ''page'' (removed from the cache, its
+        text is the PageWidget's now), or None: in this case the
+        pending jobs are cancelled, to leave the cpu to the current
+        page."""
+        with self._lock:
+            if page.path in self._images:
+                image,page,text_bytes=self._images.pop(page.path)
+                self._bytes-=image.sizeInBytes()+text_bytes
+                return image
+        self.cancel()
+        return None
+
 class ProjectWidget(qtwidgets.QWidget):
 
     def __init__(self,app):
@@ -874,11 +1122,14 @@ class ProjectWidget(qtwidgets.QWidget):
 
         v_layout = qtwidgets.QVBoxLayout()
 
-        buttons=widgets.HButtonBar([ 
+        self._buttons=widgets.HButtonBar([ 
+            ("Rescan",self._rescan),
             ("Apply OCR",self._apply_ocr),
+            ("Cancel OCR",self._cancel_ocr),
             ("Create Djvu",self._djvubind),
         ])
-        v_layout.addWidget(buttons,stretch=0)
+        self._buttons.buttons["Cancel OCR"].setEnabled(False)
+        v_layout.addWidget(self._buttons,stretch=0)
 
         self.cover_front=widgets.OpenFileWidget()
         self.cover_back=widgets.OpenFileWidget()
@@ -891,6 +1142,9 @@ class ProjectWidget(qtwidgets.QWidget):
 
         self.tab=qtwidgets.QTabWidget()
         v_layout.addWidget(self.tab,stretch=1)
+        self.prefetcher=PagePrefetcher()
+        self._current_widget=None
+        self.tab.currentChanged.connect(self._current_changed)
 
         self.setLayout(v_layout)
 
@@ -922,11 +1176,11 @@ class ProjectWidget(qtwidgets.QWidget):
                 break
 
     def set_project(self,project): 
+        self.prefetcher.clear()
+        self._current_widget=None
         self.tab.clear() # GC non cancella le pagine, le rimuove e basta
         for page in self._app.project.pages:
-            widget=PageWidget(self._app,page)
-            self.tab.addTab(widget,widget.label)
-            widget.labelChanged.connect(self._page_label_changed)
+            self._add_page_widget(self.tab.count(),page)
         
         #widget=CoverWidget()
         #self.tab.insertTab(0,widget,widget.label)
@@ -946,8 +1200,82 @@ class ProjectWidget(qtwidgets.QWidget):
         self.cover_back.field.textChanged.connect(self._cover_back_changed)
 
 
+    def _page_widget(self,page):
+        for ind in range(self.tab.count()):
+            widget=self.tab.widget(ind)
+            if widget._page is page: return ind,widget
+        return -1,None
+
+    def _current_changed(self,ind):
+        if self._current_widget is not None:
+            self._current_widget.save_text()
+        self._current_widget=self.tab.widget(ind) if ind>=0 else None
+        if ind<0 or self._app.project is None: return
+        self.prefetcher.prefetch(self._app.project.pages,ind)
+
+    def _add_page_widget(self,ind,page):
+        widget=PageWidget(self._app,page,prefetcher=self.prefetcher)
+        if self._app.project is not None:
+            widget.set_editable(not self._app.project.ocr_running)
+        self.tab.insertTab(ind,widget,widget.label)
+        widget.labelChanged.connect(self._page_label_changed)
+
+    def apply_changes(self,changes):
+        """Update tabs after a Project.rescan(): only tabs of removed,
+        added and changed pages are touched."""
+        # what was loaded of these files is out of date
+        self.prefetcher.discard([ page.path for ind,page in changes.removed ]+
+                                [ page.path for page in changes.changed ])
+        for page in [ page for ind,page in changes.removed ]+changes.changed:
+            ind,widget=self._page_widget(page)
+            if widget is None: continue
+            self.tab.removeTab(ind)
+            widget.deleteLater()
+            if page in changes.changed:
+                self._add_page_widget(ind,page)
+        for ind,page in changes.added:
+            self._add_page_widget(ind,page)
+
+    def _rescan(self):
+        changes=self._app.project.rescan()
+        self._app.models["page_numbering"].apply_changes(changes)
+        if changes.outline:
+            self._app.models["outline"].layoutChanged.emit()
+        self.apply_changes(changes)
+        self._app.emit_status("Rescan: %d added, %d removed, %d changed" % 
+                              (len(changes.added),len(changes.removed),len(changes.changed)))
+
+    def _set_ocr_running(self,running):
+        """The OCR runs in the gui thread, processing events: meanwhile
+        the project is not rescanned, bound or closed, and its pages
+        are not edited."""
+        for label in [ "Rescan", "Apply OCR", "Create Djvu" ]:
+            self._buttons.buttons[label].setEnabled(not running)
+        self._buttons.buttons["Cancel OCR"].setEnabled(running)
+        self.cover_front.setEnabled(not running)
+        self.cover_back.setEnabled(not running)
+        for w in self.tab.findChildren(PageWidget):
+            w.set_editable(not running)
+        self._app.set_ocr_running(running)
+
     def _apply_ocr(self):
-        self._app.project.apply_ocr()
+        project=self._app.project
+        self._set_ocr_running(True)
+        try:
+            results=project.apply_ocr()
+        finally:
+            self._set_ocr_running(False)
+        for res in results:
+            if not res.ok: continue
+            ind,widget=self._page_widget(res.page)
+            if widget is not None: widget.refresh_text()
+        errors=[ res for res in results if not res.ok ]
+        self._app.emit_status("OCR: %d pages, %d errors" % (len(results),len(errors)))
+        if self._app.quit_requested: self._app.quit()
+
+    def _cancel_ocr(self):
+        # the project processes events while waiting for the OCR
+        self._app.project.cancel_ocr()
         
     def _djvubind(self): 
         dialog = qtwidgets.QFileDialog(self._app.window)
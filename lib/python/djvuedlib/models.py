@@ -5,6 +5,7 @@ import PySide2.QtCore as qtcore
 import PySide2.QtGui as qtgui
 import PySide2.QtNetwork as qtnetwork
 
+import bisect
 import os.path
 import collections
 import re
@@ -73,10 +74,38 @@ class PageNumberingModel(ProjectTableModel):
     _section="Pages"
     _columns=["page","title"]
 
+    def __init__(self, *args, **kwargs):
+        ProjectTableModel.__init__(self,*args, **kwargs)
+        self._keys=[]
+
+    def set_project(self,project): 
+        # the same order as the pages (and their tabs)
+        self._keys=[] if project is None else sorted(project["Pages"].keys())
+        ProjectTableModel.set_project(self,project)
+
+    def rowCount(self, index):
+        if self._project is None: return 0
+        return len(self._keys)
+
+    def apply_changes(self,changes):
+        """Update rows after a Project.rescan()."""
+        removed=set([ page.path for ind,page in changes.removed ])
+        for row in reversed(range(len(self._keys))):
+            if self._keys[row] not in removed: continue
+            self.beginRemoveRows(qtcore.QModelIndex(),row,row)
+            del self._keys[row]
+            self.endRemoveRows()
+        known=set(self._keys)
+        for key in sorted([ k for k in self._project["Pages"].keys() if k not in known ]):
+            row=bisect.bisect_left(self._keys,key)
+            self.beginInsertRows(qtcore.QModelIndex(),row,row)
+            self._keys.insert(row,key)
+            self.endInsertRows()
+
     def data(self, index, role):
         if self._project is None: return None
         if role not in [ qtcore.Qt.DisplayRole, qtcore.Qt.EditRole ]: return None
-        keys=list(self._project["Pages"].keys())
+        keys=self._keys
         col=index.column()
         if col==0: return os.path.basename(keys[index.row()])
         return self._project["Pages"][keys[index.row()]]
@@ -85,7 +114,7 @@ class PageNumberingModel(ProjectTableModel):
         if role not in [ qtcore.Qt.DisplayRole, qtcore.Qt.EditRole ]: return False
         col=index.column()
         if col==0: return False
-        keys=list(self._project["Pages"].keys())
+        keys=self._keys
         col=index.column()
         self._set_page_num(keys[index.row()],value)
         self.dataChanged.emit(index, index)
@@ -102,7 +131,7 @@ class PageNumberingModel(ProjectTableModel):
         self._project.pages_by_path[path].title=value
 
     def number_from(self,index,start,numtype): 
-        keys=list(self._project["Pages"].keys())
+        keys=self._keys
         if numtype=="roman upper":
             sequence=abstracts.SequenceRoman(start,lower=False)
         elif numtype=="roman lower":
@@ -110,29 +139,31 @@ class PageNumberingModel(ProjectTableModel):
         else:
             sequence=abstracts.SequenceStr(start)
         row=index.row()
-        while row < len(self._project["Pages"]):
-            seq=sequence()
-            key=keys[row]
-            self._set_page_num(key,seq)
-            #self._project["Pages"][key]=seq
-            row+=1
+        with self._project.transaction():
+            while row < len(keys):
+                seq=sequence()
+                key=keys[row]
+                self._set_page_num(key,seq)
+                #self._project["Pages"][key]=seq
+                row+=1
         self.dataChanged.emit(index, index)
         self.pageNumberChanged.emit()
 
     def number(self,indexes,start,numtype):
-        keys=list(self._project["Pages"].keys())
+        keys=self._keys
         if numtype=="roman upper":
             sequence=abstracts.SequenceRoman(start,lower=False)
         elif numtype=="roman lower":
             sequence=abstracts.SequenceRoman(start)
         else:
             sequence=abstracts.SequenceStr(start)
-        for index in indexes:
-            seq=sequence()
-            row=index.row()
-            key=keys[row]
-            self._set_page_num(key,seq)
-            #self._project["Pages"][key]=seq
+        with self._project.transaction():
+            for index in indexes:
+                seq=sequence()
+                row=index.row()
+                key=keys[row]
+                self._set_page_num(key,seq)
+                #self._project["Pages"][key]=seq
         self.dataChanged.emit(index, index)
         self.pageNumberChanged.emit()
 
@@ -360,6 +391,21 @@ class OcrModel(BaseItemModel):
         self.crop_to_children=self.ChangeAction(self,self._crop_to_children)
 
     def _is_empty(self): return self._page is None
+
+    def undo(self):
+        """Undo the last change of the page text; the tree is reset,
+        since undone rules may have been removed."""
+        self.beginResetModel()
+        command=self._page.undo_text()
+        self.endResetModel()
+        return command
+
+    def redo(self):
+        self.beginResetModel()
+        command=self._page.redo_text()
+        self.endResetModel()
+        return command
+
     def _count_children(self,obj): return self._page.count_children_text_rule(obj)
     def _get_child(self,parent_obj,ind): return self._page.get_text_rule(parent_obj,ind)
     # def _child_parent(self,child): return child.parent
@@ -410,21 +456,19 @@ class OcrModel(BaseItemModel):
         col=index.column()
         obj=index.internalPointer()
         if col==0:
-            obj.level=value
+            self._page.set_text_rule(obj,level=value)
             self.dataChanged.emit(index, index)
             return True
         if col==5:
             if obj.children: return False
-            obj.text=value
+            self._page.set_text_rule(obj,text=value)
             self.dataChanged.emit(index, index)
             return True
         try:
-            if col==1: obj.xmin=int(value)
-            if col==2: obj.ymin=int(value)
-            if col==3: obj.xmax=int(value)
-            if col==4: obj.ymax=int(value)
+            value=int(value)
         except ValueError as e:
             return False
+        self._page.set_text_rule(obj,**{ self._columns[col]: value })
         self.dataChanged.emit(index, index)
         return True
 
@@ -445,23 +489,23 @@ class OcrModel(BaseItemModel):
     def _merge_above_rule(self,obj): self._page.merge_above_text_rule(obj)
     def _merge_below_rule(self,obj): self._page.merge_below_text_rule(obj)
 
-    def _crop_to_children(self,obj): obj.crop_to_children()
+    def _crop_to_children(self,obj): self._page.crop_text_rule(obj)
 
     def _upper_rule(self,obj):
         if obj.children: return
-        obj.text=obj.text.upper()
+        self._page.set_text_rule(obj,text=obj.text.upper())
 
     def _lower_rule(self,obj):
         if obj.children: return
-        obj.text=obj.text.lower()
+        self._page.set_text_rule(obj,text=obj.text.lower())
 
     def _capitalize_rule(self,obj):
         if obj.children: return
-        obj.text=obj.text.capitalize()
+        self._page.set_text_rule(obj,text=obj.text.capitalize())
 
     def _accentize_rule(self,obj):
         if obj.children: return
-        obj.text=self._accentize(obj.text)
+        self._page.set_text_rule(obj,text=self._accentize(obj.text))
 
     def _accentize(self,txt):
         commas=""
@@ -494,7 +538,7 @@ class OcrModel(BaseItemModel):
 
     def _fix_apostrophes_rule(self,obj):
         if obj.children: return
-        obj.text=self._fix_apostrophes(obj.text)
+        self._page.set_text_rule(obj,text=self._fix_apostrophes(obj.text))
 
     def _fix_apostrophes(self,txt):
         txt=txt.replace("’","'")
@@ -18,17 +18,30 @@
 Perform OCR operations using various engines.
 """
 
+import collections
+import concurrent.futures
 import difflib
+import importlib.util
 import os
 import re
+import resource
+import shlex
 import shutil
+import signal
 import subprocess
 import sys
+import tempfile
+import threading
+import time
 
 from html.parser import HTMLParser
 
 from djvubind import utils
 
+from . import cache
+from . import hiddentext
+from . import imageinfo
+
 class BoundingBox(object):
     """
     A rectangular portion of an image that contains something of value, such as
@@ -128,54 +141,127 @@ class djvuPageBox(BoundingBox):
         lines = '\n  '.join([x.encode() for x in self.children])
         return page+'\n  '+lines+')'
 
+# A word of a page, its text escaped for djvused and its line number
+# (words of the same line are next to each other).
+OcrWord = collections.namedtuple("OcrWord", ["text", "xmin", "ymin", "xmax", "ymax", "line"])
+
+def escape_word(text):
+    """
+    Escapes the characters djvused needs escaped in a word.
+    """
+    return text.replace('\\', '\\\\').replace('"', '\\"').replace("'", "\\'")
+
 class TesseractParser(HTMLParser):
+    """
+    Words (OcrWord) of a hocr document, in one pass: the text of an
+    ocrx_word span is collected up to its end tag.
+    """
+
     def __init__(self):
-        HTMLParser.__init__(self)
-        self.boxing = []
+        # the entities are put back as they were, to be replaced like
+        # in the rest of djvubind
+        HTMLParser.__init__(self, convert_charrefs=False)
+        self.words = []
         self.version = 'tesseract'
-        self.data = ''
+        self._line = 0
+        self._word = None
 
     def parse(self, data):
-        self.data = data
         self.feed(data)
+        self.close()
 
     def handle_starttag(self, tag, attrs):
         if (tag == 'br') or (tag == 'p'):
-            if (len(self.boxing) > 0):
-                self.boxing.append('newline')
+            if (len(self.words) > 0):
+                self._line += 1
             return
-        if tag != "span": return
+        if (tag != 'span') or (self._word is not None): return
         if not (('class', 'ocrx_word') in attrs): return
-        #elif (tag == 'span') and (('class', 'ocrx_word') in attrs):
-        # Get the whole element, not just the tag.
-        element = {}
-        element['complete'] = re.search('{0}(.*?)</span>'.format(self.get_starttag_text()), self.data).group(0)
-        element['text'] = re.search('\'>(.*?)</span', element['complete']).group(1)
-        element['text'] = re.sub('<[\w\/\.]*>', '', element['text'])
-        element['text'] = utils.replace_html_codes(element['text'])
-        element['positions'] = re.search('bbox ([0-9\s]*)', element['complete']).group(1)
-        element['positions'] = [int(item) for item in element['positions'].split()]
-
-        i = 0
-        for char in element['text']:
-            if element['positions'][i:i+4] == []:
-                continue
-            section = element['positions'][i:i+4]
-            positions = {'char':char, 'xmin':section[0], 'ymin':section[1], 'xmax':section[2], 'ymax':section[3]}
-            #i = i+4
+        positions = re.search(r'bbox ([0-9\s]*)', self.get_starttag_text()).group(1)
+        self._word = ([int(item) for item in positions.split()], [])
 
-            # A word break is indicated by a space (go figure).
-            if (char == ' '):
-                self.boxing.append('space')
-                continue
+    def handle_endtag(self, tag):
+        if (tag == 'span') and (self._word is not None):
+            self._add_word(*self._word)
+            self._word = None
+
+    def handle_data(self, data):
+        if self._word is not None:
+            self._word[1].append(data)
 
-            # Escape special characters
-            subst = {'"': '\\"', "'":"\\'", '\\': '\\\\'}
-            if positions['char'] in subst.keys():
-                positions['char'] = subst[positions['char']]
-            self.boxing.append(positions)
+    def handle_entityref(self, name):
+        self.handle_data('&{0};'.format(name))
 
-        self.boxing.append('space')
+    def handle_charref(self, name):
+        self.handle_data('&#{0};'.format(name))
+
+    def _add_word(self, positions, text):
+        if positions == []:
+            return
+        text = escape_word(utils.replace_html_codes(''.join(text)))
+        # A word break is indicated by a space (go figure).
+        for part in text.split(' '):
+            if part:
+                self.words.append(OcrWord(part, positions[0], positions[1], positions[2], positions[3],
+                                          self._line))
+
+class OcrError(Exception): pass
+class OcrTimeout(OcrError): pass
+class OcrCancelled(OcrError): pass
+
+class OcrJob(object):
+    """
+    Limits for the OCR of a page: environment of the engine process,
+    timeout in seconds (None: no limit) and cancellation event. After
+    the run cpu_time holds the cpu time used by the engine.
+    """
+
+    def __init__(self, env=None, timeout=None, cancelled=None):
+        self.env = env
+        self.timeout = timeout
+        self.cancelled = cancelled
+        self.cpu_time = 0.0
+
+def run_process(args, job=None, poll_interval=0.1):
+    """
+    Run the command ''args'' within the limits of ''job'', killing it on
+    timeout or cancellation.
+
+        Raises:
+            * OcrTimeout, OcrCancelled: the process has been killed.
+            * OcrError: the process exited with bad status.
+    """
+
+    if job is None:
+        job = OcrJob()
+    with tempfile.TemporaryFile() as errors:
+        # own process group: the kill reaches also its children
+        proc = subprocess.Popen(args, env=job.env, stdout=subprocess.DEVNULL, stderr=errors,
+                                start_new_session=True)
+        deadline = None if job.timeout is None else time.monotonic()+job.timeout
+        failure = None
+        while True:
+            # wait4(), unlike Popen.wait(), gives the resources used
+            pid, status, usage = os.wait4(proc.pid, os.WNOHANG)
+            if pid != 0:
+                break
+            if (job.cancelled is not None) and job.cancelled.is_set():
+                failure = OcrCancelled('{0}: cancelled'.format(args[0]))
+            elif (deadline is not None) and (time.monotonic() > deadline):
+                failure = OcrTimeout('{0}: timeout after {1}s'.format(args[0], job.timeout))
+            if failure is not None:
+                os.killpg(proc.pid, signal.SIGKILL)
+                pid, status, usage = os.wait4(proc.pid, 0)
+                break
+            time.sleep(poll_interval)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        job.cpu_time += usage.ru_utime+usage.ru_stime
+        if failure is not None:
+            raise failure
+        if proc.returncode != 0:
+            errors.seek(0)
+            msg = errors.read().decode(errors='replace').strip().split('\n')[-1]
+            raise OcrError('{0} exited with status {1}: {2}'.format(args[0], proc.returncode, msg))
 
 class Tesseract(object):
     """
@@ -195,6 +281,8 @@ class Tesseract(object):
 
         version = version.split('\\n')[0]
         version = version.split()[-1]
+        # the results of another release are not reused (see cache.OcrResultCache)
+        self.engine_id = 'tesseract {0}'.format(version)
         version = version.split('.')[0]
 
         self.version = int(version)
@@ -211,102 +299,92 @@ class Tesseract(object):
         textfile.
         """
 
+        if not boxdata:
+            return []
+
         # Convert the boxing information into a plain text string with no bounding information.
-        boxtext = ''
-        for entry in boxdata:
-            boxtext = boxtext + entry['char']
+        boxtext = ''.join([entry['char'] for entry in boxdata])
         # Remove spacing and newlines from the readable text because the boxing data doesn't have those.
         text = text.replace(' ', '')
         text = text.replace('\n', '')
 
-        # Figure out what changes are needed, but don't do them immediately since it would
-        # change the boxdata index and screw up the next action.
+        # One pass over the changes, the result goes in a new list: boxdata keeps the
+        # indexes of the opcodes.
         diff = difflib.SequenceMatcher(None, boxtext, text)
-        queu = []
+        result = []
         for action, a_start, a_end, b_start, b_end in diff.get_opcodes():
-            entry = boxdata[a_start]
-            item = {'action':action, 'target':entry, 'boxtext':boxtext[a_start:a_end], 'text':text[b_start:b_end]}
-            queu.append(item)
-
-        # Make necessary changes
-        for change in queu:
-            if (change['action'] == 'replace'):
-                if (len(change['boxtext']) == 1) and (len(change['text']) == 1):
-                    index = boxdata.index(change['target'])
-                    boxdata[index]['char'] = change['text']
-                elif (len(change['boxtext']) > 1) and (len(change['text']) == 1):
-                    # Combine the boxing data
-                    index = boxdata.index(change['target'])
-                    new = {'char':'', 'xmin':0, 'ymin':0, 'xmax':0, 'ymax':0}
-                    new['char'] = change['text']
-                    new['xmin'] = min([x['xmin'] for x in boxdata[index:index+len(change['boxtext'])]])
-                    new['ymin'] = min([x['ymin'] for x in boxdata[index:index+len(change['boxtext'])]])
-                    new['xmax'] = min([x['xmax'] for x in boxdata[index:index+len(change['boxtext'])]])
-                    new['ymax'] = min([x['ymax'] for x in boxdata[index:index+len(change['boxtext'])]])
-                    del(boxdata[index:index+len(change['boxtext'])])
-                    boxdata.insert(index, new)
-                elif (len(change['boxtext']) == 1) and (len(change['text']) > 1):
-                    # Use the same boxing data.  Will djvused complain that character
-                    # boxes overlap?
-                    index = boxdata.index(change['target'])
-                    del(boxdata[index])
-                    i = 0
-                    for char in list(change['text']):
-                        new = {'char':char, 'xmin':change['target']['xmin'], 'ymin':change['target']['ymin'], 'xmax':change['target']['xmax'], 'ymax':change['target']['ymax']}
-                        boxdata.insert(index+i, new)
-                        i = i + 1
-                elif (len(change['boxtext']) > 1) and (len(change['text']) > 1):
-                    if (len(change['boxtext']) == len(change['text'])):
-                        index = boxdata.index(change['target'])
-                        for char in list(change['text']):
-                            boxdata[index]['char'] = char
-                            index = index + 1
-                    else:
-                        # Delete the boxdata and replace with the plain text data
-                        index = boxdata.index(change['target'])
-                        deletions = boxdata[index:index+len(change['boxtext'])]
-                        for target in deletions:
-                            boxdata.remove(target)
-
-                        i = 0
-                        for char in list(change['text']):
-                            new = {'char':char, 'xmin':change['target']['xmin'], 'ymin':change['target']['ymin'], 'xmax':change['target']['xmax'], 'ymax':change['target']['ymax']}
-                            boxdata.insert(index+i, new)
-                            i = i + 1
-            elif (change['action'] == 'delete'):
-                index = boxdata.index(change['target'])
-                deletions = boxdata[index:index+len(change['boxtext'])]
-                for target in deletions:
-                    boxdata.remove(target)
-            elif (change['action'] == 'insert'):
-                # *Don't* use the boundaries of previous and next characters to guess at a boundary
-                # box.  Things would be ugly if the next character happened to be on a new line.
-                # Just duplicate the boundaries of the previous character
-                index = boxdata.index(change['target'])
-                i = 0
-                for char in list(change['text']):
-                    new = {'char':char, 'xmin':change['target']['xmin'], 'ymin':change['target']['ymin'], 'xmax':change['target']['xmax'], 'ymax':change['target']['ymax']}
-                    boxdata.insert(index+i, new)
-                    i = i + 1
-
-        return boxdata
-
-    def analyze(self, page):
+            chars = text[b_start:b_end]
+            if (action == 'equal'):
+                result.extend(boxdata[a_start:a_end])
+                continue
+            if (action == 'delete'):
+                continue
+            # *Don't* use the boundaries of previous and next characters to guess at a boundary
+            # box for new characters.  Things would be ugly if the next character happened to be
+            # on a new line.  Just duplicate the boundaries of the first replaced character (or
+            # the next one for an insertion, the last one at the end).
+            if a_start < len(boxdata):
+                target = boxdata[a_start]
+            else:
+                target = boxdata[-1]
+            if (action == 'replace') and (a_end-a_start == len(chars)):
+                for entry, char in zip(boxdata[a_start:a_end], chars):
+                    result.append(dict(entry, char=char))
+            elif (action == 'replace') and (len(chars) == 1):
+                # Combine the boxing data
+                replaced = boxdata[a_start:a_end]
+                result.append({'char':chars,
+                               'xmin':min([x['xmin'] for x in replaced]),
+                               'ymin':min([x['ymin'] for x in replaced]),
+                               'xmax':min([x['xmax'] for x in replaced]),
+                               'ymax':min([x['ymax'] for x in replaced])})
+            else:
+                # Use the same boxing data.  Will djvused complain that character
+                # boxes overlap?
+                for char in chars:
+                    result.append({'char':char, 'xmin':target['xmin'], 'ymin':target['ymin'], 'xmax':target['xmax'], 'ymax':target['ymax']})
+
+        return result
+
+    def close(self):
         """
-        Performs OCR analysis on the image and returns a djvuPageBox object.
+        Releases what the engine keeps between pages (nothing here).
+        """
+        pass
+
+    def _make_hocr(self, page, job):
+        """
+        Writes the hocr output of the page in its basepath.hocr.
+        """
+        basename = page.basepath
+        tesseractpath = utils.get_executable_path('tesseract')
+        args = [tesseractpath, page.path, basename] + shlex.split(self.options) + ['hocr']
+        try:
+            run_process(args, job)
+        except OcrError:
+            # a partial output would be taken for a good one next time
+            if os.path.exists(basename+".hocr"):
+                os.remove(basename+".hocr")
+            raise
+
+    def analyze(self, page, job=None):
+        """
+        Performs OCR analysis on the image and returns its words (OcrWord).
+        Tesseract runs within the limits of ''job'' (see OcrJob), unless
+        the shared cache already has the result for this image content.
         """
-        filename=page.path
 
         #if self.version >= 3:
         #basename = os.path.split(filename)[1].split('.')[0]
         basename=page.basepath
-        tesseractpath = utils.get_executable_path('tesseract')
 
-        if not os.path.exists(basename+".hocr"):
-            utils.execute('{0} "{1}" "{2}" {3} hocr'.format(tesseractpath, filename, basename, self.options))
-
-        with open('{0}.hocr'.format(basename), 'r') as handle:
-            text = handle.read()
+        key = cache.ocr_results.key(page.path, self.engine_id, self.options)
+        text = cache.ocr_results.get(key)
+        if text is None:
+            self._make_hocr(page, job)
+            with open('{0}.hocr'.format(basename), 'r') as handle:
+                text = handle.read()
+            cache.ocr_results.put(key, text)
 
         # Clean up excess files.
         #os.remove(basename+'.hocr')
@@ -319,46 +397,417 @@ class Tesseract(object):
         #height = int(utils.execute('identify -format %H "{0}"'.format(filename), capture=True))
         height=page.height
 
-        for entry in parser.boxing:
-            if entry not in ['space', 'newline']:
-                ymin, ymax = entry['ymin'], entry['ymax']
-                entry['ymin'] = height - ymax
-                entry['ymax'] = height - ymin
+        return [word._replace(ymin=height-word.ymax, ymax=height-word.ymin) for word in parser.words]
 
-        return parser.boxing
+def _tesserocr_worker(conn, env, init_args, variables):
+    """
+    Main loop of an engine process of PersistentTesseract: answers
+    (engine id, error) once tesserocr is loaded, then reads image
+    paths from ''conn'' until None and answers (hocr, error, cpu time)
+    for each of them.
+    """
+
+    # before tesserocr, and the OpenMP runtime with it, is loaded: it
+    # reads OMP_THREAD_LIMIT only once
+    os.environ.update(env)
+    try:
+        import tesserocr
+        release = tesserocr.tesseract_version().split()[1]
+        api = tesserocr.PyTessBaseAPI(**init_args)
+        for name, value in variables:
+            if not api.SetVariable(name, value):
+                raise ValueError('unknown tesseract variable {0}'.format(name))
+    except Exception as e:
+        conn.send((None, '{0}: {1}'.format(type(e).__name__, e)))
+        return
+    conn.send(('tesserocr {0} {1}'.format(tesserocr.__version__, release), None))
+    while True:
+        path = conn.recv()
+        if path is None:
+            break
+        start = resource.getrusage(resource.RUSAGE_SELF)
+        try:
+            api.SetImageFile(path)
+            result = (api.GetHOCRText(0), None)
+        except Exception as e:
+            result = (None, '{0}: {1}'.format(type(e).__name__, e))
+        end = resource.getrusage(resource.RUSAGE_SELF)
+        conn.send(result + (end.ru_utime+end.ru_stime-start.ru_utime-start.ru_stime,))
+    api.End()
+
+class _EngineProcess(object):
+    """
+    A process of PersistentTesseract, talking through a pipe. It is
+    not forked from the caller, a Qt process with threads running (see
+    imageinfo._mp_context()).
+    """
+
+    def __init__(self, env, init_args, variables):
+        context = imageinfo._mp_context()
+        self._conn, child = context.Pipe()
+        self._proc = context.Process(target=_tesserocr_worker,
+                                     args=(child, env, init_args, variables), daemon=True)
+        self._proc.start()
+        child.close()
+        self.engine_id = None
 
+    def _receive(self, job, deadline, request=None, poll_interval=0.1):
+        """
+        Sends ''request'' (if any) and returns the answer of the process.
+        The process is killed on timeout or cancellation of ''job'' and
+        when it dies.
+        """
+
+        failure = None
+        try:
+            if request is not None:
+                self._conn.send(request)
+            while not self._conn.poll(poll_interval):
+                if (job.cancelled is not None) and job.cancelled.is_set():
+                    failure = OcrCancelled('tesserocr: cancelled')
+                elif (deadline is not None) and (time.monotonic() > deadline):
+                    failure = OcrTimeout('tesserocr: timeout after {0}s'.format(job.timeout))
+                elif not self._proc.is_alive():
+                    break
+                if failure is not None:
+                    break
+            else:
+                return self._conn.recv()
+        except (EOFError, OSError):
+            pass
+        if failure is None:
+            self._proc.join()
+            failure = OcrError('tesserocr: engine process exited with status {0}'.format(self._proc.exitcode))
+        self.kill()
+        raise failure
+
+    def start(self, job, deadline=None):
+        """
+        Waits for tesserocr to be loaded in the process and returns the
+        engine id it answered. Raises OcrError if it could not load.
+        """
 
-def translate(boxing):
+        if self.engine_id is None:
+            engine_id, error = self._receive(job, deadline)
+            if error is not None:
+                self.kill()
+                raise OcrError('tesserocr: {0}'.format(error))
+            self.engine_id = engine_id
+        return self.engine_id
+
+    def recognize(self, path, job):
+        """
+        Returns the hocr text of the image ''path'', within the limits
+        of ''job''.
+        """
+
+        deadline = None if job.timeout is None else time.monotonic()+job.timeout
+        self.start(job, deadline)
+        hocr, error, cpu_time = self._receive(job, deadline, path)
+        job.cpu_time += cpu_time
+        if error is not None:
+            # the engine itself is still fine
+            raise OcrError('tesserocr: {0}'.format(error))
+        return hocr
+
+    def alive(self):
+        return self._proc.is_alive()
+
+    def close(self):
+        try:
+            self._conn.send(None)
+        except OSError:
+            pass
+        self._proc.join(5)
+        self.kill()
+
+    def kill(self):
+        if self._proc.is_alive():
+            self._proc.kill()
+        self._proc.join()
+        self._conn.close()
+
+class PersistentTesseract(Tesseract):
     """
-    Translate djvubind's internal boxing information into a djvused format.
+    Tesseract loaded once in long-lived engine processes (tesserocr
+    binding) fed one page after the other, instead of a tesseract
+    command, and a load of the language data, for each page.
 
-    .. warning::
-       This function will eventually migrate to djvubind.encode
+    ''options'' are the ones of the command that the binding knows:
+    -l, --psm, --oem, --tessdata-dir and -c var=value.
+    """
+
+    def __init__(self, options):
+        # tesserocr is loaded only in the engine processes, the first
+        # one tells the version (see analyze())
+        if importlib.util.find_spec('tesserocr') is None:
+            raise ImportError('No module named tesserocr')
+        self.engine_id = None
+        self.version = None
+        self.options = options
+        self._init_args, self._variables = self._parse_options(options)
+        self._idle = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _parse_options(options):
+        init_args = {}
+        variables = []
+        args = shlex.split(options)
+        while args:
+            opt = args.pop(0)
+            if not args:
+                raise ValueError('option {0} not supported by tesserocr'.format(opt))
+            value = args.pop(0)
+            if opt == '-l':
+                init_args['lang'] = value
+            elif opt == '--psm':
+                init_args['psm'] = int(value)
+            elif opt == '--oem':
+                init_args['oem'] = int(value)
+            elif opt == '--tessdata-dir':
+                init_args['path'] = value
+            elif (opt == '-c') and ('=' in value):
+                variables.append(tuple(value.split('=', 1)))
+            else:
+                raise ValueError('option {0} not supported by tesserocr'.format(opt))
+        return init_args, variables
+
+    def _engine(self, job):
+        # one engine process for each OcrScheduler thread, started on
+        # first use and kept until close()
+        with self._lock:
+            engine = self._idle.pop() if self._idle else None
+        if engine is None:
+            engine = _EngineProcess(job.env or {}, self._init_args, self._variables)
+        return engine
+
+    def _release(self, engine):
+        if engine.alive():
+            with self._lock:
+                self._idle.append(engine)
+
+    def _make_hocr(self, page, job):
+        engine = self._engine(job)
+        try:
+            hocr = engine.recognize(page.path, job)
+        finally:
+            self._release(engine)
+        with open(page.basepath+'.hocr', 'w') as handle:
+            handle.write(hocr)
+
+    def analyze(self, page, job=None):
+        if job is None:
+            job = OcrJob()
+        if self.engine_id is None:
+            # needed for the cache key, before any page is recognized
+            engine = self._engine(job)
+            deadline = None if job.timeout is None else time.monotonic()+job.timeout
+            try:
+                engine_id = engine.start(job, deadline)
+            finally:
+                self._release(engine)
+            self.version = int(engine_id.split()[-1].split('.')[0])
+            self.engine_id = engine_id
+        return Tesseract.analyze(self, page, job)
+
+    def close(self):
+        with self._lock:
+            engines, self._idle = self._idle, []
+        for engine in engines:
+            engine.close()
+
+def engine(ocr_engine, options=''):
+    """
+    Returns the engine object for ''ocr_engine'' ('tesseract' or
+    'tesserocr'). Without the tesserocr module, or with options it does
+    not know, 'tesserocr' falls back to the tesseract command.
     """
 
-    page = djvuPageBox()
-    line = djvuLineBox()
-    word = djvuWordBox()
+    if ocr_engine == 'tesserocr':
+        try:
+            return PersistentTesseract(options)
+        except (ImportError, ValueError) as e:
+            print('wrn: tesserocr not usable ({0}), using the tesseract command'.format(e), file=sys.stderr)
+        return Tesseract(options)
+    if ocr_engine == 'tesseract':
+        return Tesseract(options)
+    raise ValueError('The requested ocr engine ({0}) is not supported.'.format(ocr_engine))
+
+
+def boxing_words(boxing):
+    """
+    Words (OcrWord) of djvubind's internal boxing information, for the
+    engines giving the box of each character: the word box is the one
+    around its characters.
+    """
+
+    words = []
+    chars = []
+    line = 0
+
+    def add_word():
+        words.append(OcrWord(''.join([c['char'] for c in chars]),
+                             min([c['xmin'] for c in chars]), min([c['ymin'] for c in chars]),
+                             max([c['xmax'] for c in chars]), max([c['ymax'] for c in chars]), line))
+        del chars[:]
+
     for entry in boxing:
         if entry == 'newline':
-            if (word.children != []):
-                line.add_element(word)
-            page.add_element(line)
-            line = djvuLineBox()
-            word = djvuWordBox()
+            if chars:
+                add_word()
+            line += 1
         elif entry == 'space':
-            if (word.children != []):
-                line.add_element(word)
-            word = djvuWordBox()
+            if chars:
+                add_word()
         else:
-            word.add_character(entry)
+            chars.append(entry)
+    if chars:
+        add_word()
+    return words
+
+def _lines(words):
+    """
+    The words (OcrWord) of each line, with the box of the line: a list of
+    [xmin, ymin, xmax, ymax, words].
+    """
 
-    if (word.children != []):
-        line.add_element(word)
-    if (line.children != []):
-        page.add_element(line)
+    lines = []
+    line_id = None
+    for word in words:
+        if (word.xmin > word.xmax) or (word.ymin > word.ymax):
+            raise ValueError('Boxing information is impossible (x/y min exceed x/y max).')
+        if (not lines) or (word.line != line_id):
+            line_id = word.line
+            lines.append([word.xmin, word.ymin, word.xmax, word.ymax, []])
+        line = lines[-1]
+        line[0] = min(line[0], word.xmin)
+        line[1] = min(line[1], word.ymin)
+        line[2] = max(line[2], word.xmax)
+        line[3] = max(line[3], word.ymax)
+        line[4].append(word)
+    return lines
+
+def _page_box(lines):
+    return (min([l[0] for l in lines]), min([l[1] for l in lines]),
+            max([l[2] for l in lines]), max([l[3] for l in lines]))
+
+def translate(words):
+    """
+    Translate the words (OcrWord) of a page into a djvused format.
+
+    .. warning::
+       This function will eventually migrate to djvubind.encode
+    """
+
+    lines = _lines(words)
+    if not lines:
+        return ''
+
+    page = '(page {0} {1} {2} {3}'.format(*_page_box(lines))
+    lines = ['(line {0} {1} {2} {3}\n    {4})'.format(l[0], l[1], l[2], l[3],
+                                                     '\n    '.join(['(word {0} {1} {2} {3} "{4}")'.format(w.xmin, w.ymin, w.xmax, w.ymax, w.text)
+                                                                 for w in l[4]]))
+             for l in lines]
+    return page+'\n  '+'\n  '.join(lines)+')'
+
+def text_structure(words):
+    """
+    The hidden text structure (OcrGrammar) of the words (OcrWord) of a
+    page, the same as parsing translate(words) gives. None without words.
+    """
 
-    if (page.children != []):
-        return page.encode()
+    lines = _lines(words)
+    if not lines:
+        return None
+
+    block = hiddentext.djvused_block
+    rules = [block('line', l[0], l[1], l[2], l[3],
+                   [block('word', w.xmin, w.ymin, w.xmax, w.ymax, w.text) for w in l[4]])
+             for l in lines]
+    xmin, ymin, xmax, ymax = _page_box(lines)
+    return hiddentext.DjvusedOcrGrammar([block('page', xmin, ymin, xmax, ymax, rules)])
+
+OcrResult = collections.namedtuple("OcrResult", ["page", "ok", "wall_time", "cpu_time", "attempts", "error"])
+
+def available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+class OcrScheduler(object):
+    """
+    Runs the OCR of many pages, keeping the cpu busy but not
+    oversubscribed: every engine process is limited to
+    ''threads_per_job'' OpenMP threads (OMP_THREAD_LIMIT), and no more
+    than cpus/threads_per_job (and ''max_workers'') run at once.
+
+    A failed page is tried again up to ''retries'' times; a run longer
+    than ''timeout'' seconds is killed. cancel() stops the pending
+    pages and kills the running ones.
+    """
+
+    def __init__(self, ocr, max_workers=None, threads_per_job=1, timeout=None, retries=1,
+                 emit_status=None):
+        self._ocr = ocr
+        threads_per_job = max(1, threads_per_job)
+        self.max_workers = max(1, available_cpus()//threads_per_job)
+        if max_workers:
+            self.max_workers = min(self.max_workers, max_workers)
+        self.timeout = timeout
+        self.retries = retries
+        self._env = dict(os.environ, OMP_THREAD_LIMIT=str(threads_per_job))
+        self._emit_status = emit_status
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def _status(self, msg):
+        if self._emit_status is not None:
+            self._emit_status(msg)
+
+    def _ocr_page(self, page):
+        start = time.monotonic()
+        cpu_time = 0.0
+        error = None
+        attempts = 0
+        while attempts <= self.retries:
+            if self._cancelled.is_set():
+                error = 'cancelled'
+                break
+            attempts += 1
+            job = OcrJob(self._env, self.timeout, self._cancelled)
+            try:
+                page.apply_ocr(self._ocr, job)
+                error = None
+            except OcrCancelled as e:
+                error = str(e)
+                break
+            except Exception as e:
+                error = '{0}: {1}'.format(type(e).__name__, e)
+            finally:
+                cpu_time += job.cpu_time
+            if error is None:
+                break
+        return OcrResult(page, error is None, time.monotonic()-start, cpu_time, attempts, error)
+
+    def run(self, pages):
+        """
+        OCR of ''pages''. Returns an OcrResult for each page, in order.
+        """
 
-    return ''
+        self._cancelled.clear()
+        results = [None]*len(pages)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # the threads only wait for the engine processes
+            pending = { executor.submit(self._ocr_page, page): n for n, page in enumerate(pages) }
+            done = 0
+            while pending:
+                finished, not_done = concurrent.futures.wait(pending, timeout=0.5,
+                                                             return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    results[pending.pop(future)] = future.result()
+                    done += 1
+                self._status('OCR: {0}/{1} pages'.format(done, len(pages)))
+        return results
@@ -1,12 +1,16 @@
 from . import abstracts
 import collections
+import io
+import json
 import os.path
-import concurrent.futures
+import sys
 
 
 from . import book as libbook
 from . import ocr as libocr
 from . import encode as libencode
+from . import imageinfo
+from .hiddentext.djvused_hiddentext_semantics import _position
 
 class OutlineRow(object):
     def __init__(self,project,title,page,children=[]):
@@ -15,17 +19,25 @@ class OutlineRow(object):
         self._project=project
         self.children=children
         self.parent=None
+        self._pos=0
         for ch in self.children:
             ch.parent=self
 
-    def output(self,indent):
-        S='%s("%s" "#%s"' % (indent,self._title,self._page.title)
+    def write_tree(self,fd,indent="",compact=False):
+        fd.write('%s("%s" "#%s"' % ("" if compact else indent,self._title,self._page.title))
         if not self.children:
-            return S+")\n"
+            fd.write(")" if compact else ")\n")
+            return
+        sub_indent=indent+"    "
         for obj in self.children:
-            S+=obj.output(indent=indent+"    ")
-        S+="%s)\n" % indent
-        return S
+            if compact: fd.write(" ")
+            obj.write_tree(fd,indent=sub_indent,compact=compact)
+        fd.write(")" if compact else "%s)\n" % indent)
+
+    def output(self,indent,compact=False):
+        fd=io.StringIO()
+        self.write_tree(fd,indent=indent,compact=compact)
+        return fd.getvalue()
 
     @property
     def page(self):
@@ -39,14 +51,14 @@ class OutlineRow(object):
     def _get_title(self): return self._title
     def _set_title(self,value):
         self._title=value
-        self._project._save()
+        self._project._save("Outline")
 
     title=property(_get_title,_set_title)
 
     def update(self,title,page):
         self._title=title
         self._page=page
-        self._project._save()        
+        self._project._save("Outline")        
 
     def __serialize__(self):
         children=[]
@@ -61,7 +73,7 @@ class OutlineRow(object):
         return self.children[ind]
 
     def index_row(self,obj):
-        return self.children.index(obj)
+        return _position(self.children,obj)
 
     def insert_row(self,ind,child):
         self.children.insert(ind,child)
@@ -74,37 +86,39 @@ class OutlineRow(object):
     def insert_rows(self,ind,count):
         for n in range(count):
             self.insert_row(ind,OutlineRow(self._project,"",None,[]))
-        self._project._save()
+        self._project._save("Outline")
 
     def create_row(self,title,page):
         self.append_row(OutlineRow(self._project,title,page,[]))
-        self._project._save()
+        self._project._save("Outline")
 
     def remove_rows(self,ind,count):
         for n in range(count):
             self.children.pop(ind)
-        self._project._save()
+        self._project._save("Outline")
 
     def move_up(self,obj):
-        ind=self.children.index(obj)
+        ind=_position(self.children,obj)
         if ind==0: return
         self.children.pop(ind)
         self.children.insert(ind-1,obj)
-        self._project._save()
+        obj._pos,self.children[ind]._pos=ind-1,ind
+        self._project._save("Outline")
 
     def move_down(self,obj):
-        ind=self.children.index(obj)
+        ind=_position(self.children,obj)
         if ind==len(self.children)-1: return
         self.children.pop(ind)
         self.children.insert(ind+1,obj)
-        self._project._save()
+        obj._pos,self.children[ind]._pos=ind+1,ind
+        self._project._save("Outline")
 
     def move_right(self,obj):
-        ind=self.children.index(obj)
+        ind=_position(self.children,obj)
         if ind==0: return
         self.children.pop(ind)
         self.children[ind-1].append_row(obj)
-        self._project._save()
+        self._project._save("Outline")
 
 class Outline(object):
     def __init__(self,project,serialized=[]):
@@ -127,12 +141,19 @@ class Outline(object):
             S.append(OutlineRow(self._project,title,page,children))
         return S
 
-    def output(self):
-        S="(bookmarks\n"
+    def write_tree(self,fd,compact=False):
+        """Write the outline in djvused format on file object ''fd'';
+        in compact mode on a single line."""
+        fd.write("(bookmarks" if compact else "(bookmarks\n")
         for obj in self.rows:
-            S+=obj.output(indent="    ")
-        S+=")\n"
-        return S
+            if compact: fd.write(" ")
+            obj.write_tree(fd,indent="    ",compact=compact)
+        fd.write(")\n")
+
+    def output(self,compact=False):
+        fd=io.StringIO()
+        self.write_tree(fd,compact=compact)
+        return fd.getvalue()
 
     def write_on(self,fname):
         S=self.output()
@@ -148,7 +169,7 @@ class Outline(object):
 
     def index_row(self,obj):
         if obj.parent is None: 
-            return self.rows.index(obj)
+            return _position(self.rows,obj)
         return obj.parent.index_row(obj)
 
     def count_children(self,obj):
@@ -160,42 +181,72 @@ class Outline(object):
             return parent.insert_rows(ind,count)
         for n in range(count):
             self.rows.insert(ind,OutlineRow(self._project,"",None,[]))
-        self._project._save()
+        self._project._save("Outline")
 
     def remove_rows(self,parent,ind,count):
         if parent is not None:
             return parent.remove_rows(ind,count)
         for n in range(count):
             self.rows.pop(ind)
-        self._project._save()
+        self._project._save("Outline")
         
     def create_row(self,parent,title,page):
         if parent is not None: return parent.create_row(title,page)
         self.rows.append(OutlineRow(self._project,title,page,[]))
-        self._project._save()
+        self._project._save("Outline")
 
     def update_row(self,obj,title,page):
         obj.update(title,page)
 
+    def retarget(self,targets):
+        """Point the rows of the pages in ''targets'' (a dict page: new
+        page) to the new page; with None as new page the row is
+        dropped and its children take its place. Return the list of
+        (row,old page,new page) changed."""
+        changed=[]
+        self.rows=self._retarget(self.rows,None,targets,changed)
+        if changed: self._project._save("Outline")
+        return changed
+
+    def _retarget(self,rows,parent,targets,changed):
+        ret=[]
+        for row in rows:
+            row.children=self._retarget(row.children,row,targets,changed)
+            if row._page not in targets:
+                ret.append(row)
+                continue
+            page=targets[row._page]
+            changed.append( (row,row._page,page) )
+            if page is not None:
+                row._page=page
+                ret.append(row)
+                continue
+            for ch in row.children:
+                ch.parent=parent
+            ret+=row.children
+        return ret
+
     def move_up(self,obj): 
         if obj.parent is not None:
             obj.parent.move_up(obj)
             return
-        ind=self.rows.index(obj)
+        ind=_position(self.rows,obj)
         if ind==0: return
         self.rows.pop(ind)
         self.rows.insert(ind-1,obj)
-        self._project._save()
+        obj._pos,self.rows[ind]._pos=ind-1,ind
+        self._project._save("Outline")
 
     def move_down(self,obj): 
         if obj.parent is not None:
             obj.parent.move_down(obj)
             return
-        ind=self.rows.index(obj)
+        ind=_position(self.rows,obj)
         if ind==len(self.rows)-1: return
         self.rows.pop(ind)
         self.rows.insert(ind+1,obj)
-        self._project._save()
+        obj._pos,self.rows[ind]._pos=ind+1,ind
+        self._project._save("Outline")
 
     def move_left(self,obj): pass
 
@@ -203,11 +254,11 @@ class Outline(object):
         if obj.parent is not None:
             obj.parent.move_right(obj)
             return
-        ind=self.rows.index(obj)
+        ind=_position(self.rows,obj)
         if ind==0: return
         self.rows.pop(ind)
         self.rows[ind-1].append_row(obj)
-        self._project._save()
+        self._project._save("Outline")
 
 class Project(abstracts.SerializedDict): 
 
@@ -218,7 +269,7 @@ class Project(abstracts.SerializedDict):
 
         def __setitem__(self,idx,obj): 
             ret=abstracts.KeyValuePair.__setitem__(self,idx,obj)
-            self._project._save()
+            self._project._save("Metadata")
             return ret
 
     class ProjectMetadata(abstracts.ListProxy):
@@ -238,36 +289,36 @@ class Project(abstracts.SerializedDict):
         def delete_items(self,idx_list):
             to_remove=[ self._list[idx] for idx in idx_list ]
             self._list=[ obj for obj in self._list if obj not in to_remove ]
-            self._project._save()
+            self._project._save("Metadata")
 
         def add_metadata(self,key,value):
             self._list.append( Project.ProjectMetadataItem(self._project,key,value) )
-            self._project._save()
+            self._project._save("Metadata")
 
         def add_empty_item(self):
             self._list.append( Project.ProjectMetadataItem(self._project,"","") )
-            self._project._save()
+            self._project._save("Metadata")
 
         def __setitem__(self,key,obj): 
             obj=self._clean_value(obj)
             ret=abstracts.ListProxy.__setitem__(self,key,obj)
-            self._project._save()
+            self._project._save("Metadata")
             return ret
 
         def __delitem__(self,key):  
             ret=abstracts.ListProxy.__delitem__(self,key)
-            self._project._save()
+            self._project._save("Metadata")
             return ret
 
         def sort(self,*args,**kwargs): 
             ret=abstracts.ListProxy.sort(self,*args,**kwargs)
-            self._project._save()
+            self._project._save("Metadata")
             return ret
 
         def insert(self,key,obj):
             obj=self._clean_value(obj)
             ret=abstracts.ListProxy.insert(self,key,obj)
-            self._project._save()
+            self._project._save("Metadata")
             return ret
 
         def write_on(self,fname):
@@ -276,26 +327,29 @@ class Project(abstracts.SerializedDict):
                     fd.write('%(key)s "%(value)s"\n' % obj)
 
     class ProjectSubDict(abstracts.DictProxy):
-        def __init__(self,project,base=None):
+        def __init__(self,project,section,base=None):
             abstracts.DictProxy.__init__(self,base=base)
             self._project=project
+            self._section=section
 
-        def __delitem__(self,*args,**kwargs):  
-            ret=self._dict.__delitem__(*args,**kwargs)
-            self._project._save()
+        def __delitem__(self,key):  
+            ret=self._dict.__delitem__(key)
+            self._project._save(self._section,key)
             return ret
 
-        def __setitem__(self,*args,**kwargs): 
-            ret=self._dict.__setitem__(*args,**kwargs)
-            self._project._save()
+        def __setitem__(self,key,value): 
+            ret=self._dict.__setitem__(key,value)
+            self._project._save(self._section,key)
             return ret
 
     @property
     def base_dir(self):
         return os.path.dirname(self._fpath)
                 
-    def __init__(self,fpath):
-        abstracts.SerializedDict.__init__(self,fpath)
+    def __init__(self,fpath,journal=False,backend=None,emit_status=None):
+        abstracts.SerializedDict.__init__(self,fpath,journal=journal,backend=backend)
+        self._emit_status=emit_status
+        self._ocr_scheduler=None
         #self.book=None
 
         # ex book
@@ -308,117 +362,257 @@ class Project(abstracts.SerializedDict):
             'metadata':None,
             'bookmarks':None
         }
-        self.dpi = 0
+        self._dpi = None
         #
+        self.image_info=imageinfo.ImageInfoCache(os.path.join(self.base_dir,imageinfo.ImageInfoCache.fname))
+
+        loaded=json.dumps(self._dict)
+        with self.transaction():
+            if "Metadata" in self:
+                if type(self["Metadata"]) in [  collections.OrderedDict, dict ]:
+                    self["Metadata"]=list(self["Metadata"].items())
+                self["Metadata"]=self.ProjectMetadata(self,self["Metadata"])
+            else:
+                self["Metadata"]=self.ProjectMetadata(self)
 
-        if "Metadata" in self:
-            if type(self["Metadata"]) in [  collections.OrderedDict, dict ]:
-                self["Metadata"]=list(self["Metadata"].items())
-            self["Metadata"]=self.ProjectMetadata(self,self["Metadata"])
-        else:
-            self["Metadata"]=self.ProjectMetadata(self)
+            if ("Tiff directory" not in self) and ("Tif directory" in self):
+                self["Tiff directory"]=self["Tif directory"]
 
-        if ("Tiff directory" not in self) and ("Tif directory" in self):
-            self["Tiff directory"]=self["Tif directory"]
+            self._setup_options()
+            self._setup_book()
 
-        self._setup_options()
-        self._setup_book()
+            if "Outline" in self:
+                self["Outline"]=Outline(self,self["Outline"])
+            else:
+                self["Outline"]=Outline(self)
 
-        if "Outline" in self:
-            self["Outline"]=Outline(self,self["Outline"])
-        else:
-            self["Outline"]=Outline(self)
+            if json.dumps(self._dict)==loaded:
+                # sections only wrapped in their classes: nothing to
+                # write
+                self._discard_changes()
+            else:
+                # new or migrated document (converted values, defaults
+                # added): rewrite it whole (compacting the journal)
+                # instead of logging every section again
+                self._save()
+
+    def flush(self):
+        abstracts.SerializedDict.flush(self)
+        self.image_info.save()
+
+    def close(self):
+        self.save_texts()
+        abstracts.SerializedDict.close(self)
+        self.image_info.save()
+
+    def save_texts(self):
+        """Write the text of the pages changed since last saved."""
+        for page in self.pages:
+            page.save_text_structure()
 
     def new_project(self,metadata,tiff_dir):
-        self.clear()
-        self["Tiff directory"]=tiff_dir
-        f_metadata=os.path.join(self["Tiff directory"],"metadata")
-        if os.path.exists(f_metadata):
-            new_metadata_dict=collections.OrderedDict(metadata)
-            with open(f_metadata,'r') as fd:
-                for r in fd.readlines():
-                    r=r.strip()
-                    if not r: continue
-                    t=r.strip().split()
-                    key=t[0]
-                    value=(" ".join(t[1:])).strip('"')
-                    if key in new_metadata_dict:
-                        if new_metadata_dict[key]==value: continue
-                        if not new_metadata_dict[key]:
-                            new_metadata_dict[key]=value
-                            continue
-                        while key in new_metadata_dict: key+="_"
-                    new_metadata_dict[key]=value
-            metadata=list(new_metadata_dict.items())
-
-        self["Metadata"]=self.ProjectMetadata(self,metadata)
-        self["Outline"]=Outline(self)
-        self._save()
-        self._setup_options()
-        self._setup_book()
+        with self.transaction():
+            self.clear()
+            self["Tiff directory"]=tiff_dir
+            f_metadata=os.path.join(self["Tiff directory"],"metadata")
+            if os.path.exists(f_metadata):
+                new_metadata_dict=collections.OrderedDict(metadata)
+                with open(f_metadata,'r') as fd:
+                    for r in fd.readlines():
+                        r=r.strip()
+                        if not r: continue
+                        t=r.strip().split()
+                        key=t[0]
+                        value=(" ".join(t[1:])).strip('"')
+                        if key in new_metadata_dict:
+                            if new_metadata_dict[key]==value: continue
+                            if not new_metadata_dict[key]:
+                                new_metadata_dict[key]=value
+                                continue
+                            while key in new_metadata_dict: key+="_"
+                        new_metadata_dict[key]=value
+                metadata=list(new_metadata_dict.items())
+
+            self["Metadata"]=self.ProjectMetadata(self,metadata)
+            self["Outline"]=Outline(self)
+            self._setup_options()
+            self._setup_book()
+            # a new document: written whole
+            self._save()
 
     def _setup_options(self):
-        if "Encoding Options" in self:
-            self["Encoding Options"]=self.ProjectSubDict(self,self["Encoding Options"])
-        else:
-            self["Encoding Options"]=self.ProjectSubDict(self)
-
-        for k,default in [ 
-                ("bitonal_encoder","cjb2"),
-                ("color_encoder","csepdjvu"),
-                ("c44_options",""),
-                ("cjb2_options","-lossy"),
-                ("cpaldjvu_options",""),
-                ("csepdjvu_options",""),
-                ("minidjvu_options","--match --pages-per-dict 100") ]:
-            if k not in self["Encoding Options"]:
-                self["Encoding Options"][k]=default
-
-        if "Ocr Options" in self:
-            self["Ocr Options"]=self.ProjectSubDict(self,self["Ocr Options"])
-        else:
-            self["Ocr Options"]=self.ProjectSubDict(self)
-
-        for k,default in [ 
-                ("ocr_engine","tesseract"),
-                ("tesseract_options",""),
-                ("cuneiform_options","") ]:
-            if k not in self["Ocr Options"]:
-                self["Ocr Options"][k]=default
-
-        if "Max threads" not in self: self["Max threads"]=10
-
-        self._save()
+        with self.transaction():
+            if "Encoding Options" in self:
+                self["Encoding Options"]=self.ProjectSubDict(self,"Encoding Options",self["Encoding Options"])
+            else:
+                self["Encoding Options"]=self.ProjectSubDict(self,"Encoding Options")
+
+            for k,default in [ 
+                    ("bitonal_encoder","cjb2"),
+                    ("color_encoder","csepdjvu"),
+                    ("c44_options",""),
+                    ("cjb2_options","-lossy"),
+                    ("cpaldjvu_options",""),
+                    ("csepdjvu_options",""),
+                    ("minidjvu_options","--match --pages-per-dict 100") ]:
+                if k not in self["Encoding Options"]:
+                    self["Encoding Options"][k]=default
+
+            if "Ocr Options" in self:
+                self["Ocr Options"]=self.ProjectSubDict(self,"Ocr Options",self["Ocr Options"])
+            else:
+                self["Ocr Options"]=self.ProjectSubDict(self,"Ocr Options")
+
+            for k,default in [ 
+                    ("ocr_engine","tesseract"),
+                    ("tesseract_options",""),
+                    ("tesseract_threads",1),
+                    ("ocr_timeout",0),
+                    ("ocr_retries",1),
+                    ("cuneiform_options","") ]:
+                if k not in self["Ocr Options"]:
+                    self["Ocr Options"][k]=default
+
+            if "Max threads" not in self: self["Max threads"]=10
 
     def _setup_book(self):
-        if "Pages" in self:
-            self["Pages"]=self.ProjectSubDict(self,self["Pages"])
-        else:
-            self["Pages"]=self.ProjectSubDict(self)
-        if "Tiff directory" not in self: return
-        file_list=self._file_list()
-        self.set_pages(file_list)
+        with self.transaction():
+            if "Pages" in self:
+                self["Pages"]=self.ProjectSubDict(self,"Pages",self["Pages"])
+            else:
+                self["Pages"]=self.ProjectSubDict(self,"Pages")
+            if "Tiff directory" not in self: return
+            file_list=self._file_list()
+            self.set_pages(file_list)
 
     def set_pages(self,file_list):
-        for fpath,ftype,title in file_list:
-            if ftype=="cover_front":
-                self.cover_front=libbook.Cover(fpath)
-                continue
-            if ftype=="cover_back":
-                self.cover_back=libbook.Cover(fpath)
-                continue
-            if ftype!="page":
-                self.suppliments[ftype]=fpath
-                continue
-            page=libbook.Page(fpath)
-            page.title=title
-            if (self.dpi) and (page.dpi != self.dpi):
+        # cached headers are read by the pages when needed: only the
+        # missing ones are probed, and without any no pool is started
+        missing=imageinfo.missing_paths(self.image_info,
+                                        [ fpath for fpath,ftype,title in file_list if ftype in ["page","cover_front","cover_back"] ])
+        if missing:
+            imageinfo.probe(self.image_info,[ fpath for fpath,st in missing ],emit_status=self._emit_status)
+        with self.transaction():
+            for fpath,ftype,title in file_list:
+                if ftype=="cover_front":
+                    self.cover_front=libbook.Cover(fpath,self.image_info)
+                    continue
+                if ftype=="cover_back":
+                    self.cover_back=libbook.Cover(fpath,self.image_info)
+                    continue
+                if ftype!="page":
+                    self.suppliments[ftype]=fpath
+                    continue
+                page=libbook.Page(fpath,self.image_info)
+                page.title=title
+                self.pages.append(page)
+                self.pages_by_path[page.path]=page
+                self._dpi=None
+
+    ScanChanges=collections.namedtuple("ScanChanges",["added","removed","changed","outline"])
+
+    def rescan(self):
+        """Compare the Tiff directory with the known pages and update
+        only what is different: pages of new files are created, pages
+        of deleted files dropped, pages of modified files refreshed.
+        Other pages (and their text) are kept as they are. A page is
+        modified when size or modification time of its file differ
+        from the ones of its header. Outline rows of removed pages
+        are moved to the next page left (the previous one at the end),
+        or dropped if no page is left.
+
+        Return a ScanChanges: ''added'' and ''removed'' are lists of
+        (index,page), with indexes in the new and in the old page list
+        respectively; ''changed'' is the list of refreshed pages;
+        ''outline'' the list of (row,old page,new page) of the outline
+        rows changed (new page None: row dropped).
+
+        Not while the OCR runs (nothing changed is returned).
+
+        """
+        if self.ocr_running:
+            print("wrn: OCR running, no rescan", file=sys.stderr)
+            return self.ScanChanges([],[],[],[])
+        with self.transaction():
+            file_list=self._file_list()
+            self.set_pages([ t for t in file_list if t[1]!="page" ])
+
+            page_list=[ (fpath,title) for fpath,ftype,title in file_list if ftype=="page" ]
+            new_paths=set([ os.path.abspath(fpath) for fpath,title in page_list ])
+
+            removed=[]
+            changed=[]
+            for ind,page in enumerate(self.pages):
+                if page.path not in new_paths:
+                    removed.append( (ind,page) )
+                    continue
+                stamp=page.file_stamp()
+                if (stamp is not None) and (stamp!=page.stamp):
+                    changed.append(page)
+
+            for ind,page in removed:
+                del self.pages_by_path[page.path]
+                if page.path in self["Pages"]: del self["Pages"][page.path]
+                self.image_info.discard(page.path)
+
+            new_pages=[ fpath for fpath,title in page_list 
+                        if os.path.abspath(fpath) not in self.pages_by_path ]
+            imageinfo.probe(self.image_info,new_pages+[ page.path for page in changed ],
+                            emit_status=self._emit_status)
+
+            for page in changed:
+                page.refresh()
+
+            # outline rows of removed pages: to the next page left,
+            # or to the previous one at the end
+            removed_pages=set([ page for ind,page in removed ])
+            targets={}
+            near=None
+            for page in reversed(self.pages):
+                if page in removed_pages: 
+                    targets[page]=near
+                else:
+                    near=page
+            near=None
+            for page in self.pages:
+                if page not in removed_pages: 
+                    near=page
+                elif targets[page] is None:
+                    targets[page]=near
+            outline=self["Outline"].retarget(targets) if targets else []
+
+            added=[]
+            pages=[]
+            for fpath,title in page_list:
+                path=os.path.abspath(fpath)
+                if path in self.pages_by_path:
+                    pages.append(self.pages_by_path[path])
+                    continue
+                page=libbook.Page(fpath,self.image_info)
+                page.title=title
+                self.pages_by_path[page.path]=page
+                added.append( (len(pages),page) )
+                pages.append(page)
+            self.pages=pages
+
+            if added or removed or changed: self._dpi=None
+
+        return self.ScanChanges(added,removed,changed,outline)
+
+    @property
+    def dpi(self):
+        """Max dpi of the pages (needed by minidjvu). Computed on first
+        access, because it requires reading all the image headers."""
+        if self._dpi is not None: return self._dpi
+        dpi=0
+        for page in self.pages:
+            if (dpi) and (page.dpi != dpi):
                 print("msg: [organizer.Book.analyze()] {0}".format(page.path))
                 print("     Page dpi is different from the previous page.", file=sys.stderr)
                 print("     If you encounter problems with minidjvu, this is probably why.", file=sys.stderr)
-            self.dpi = max(self.dpi,page.dpi)
-            self.pages.append(page)
-            self.pages_by_path[page.path]=page
+            dpi = max(dpi,page.dpi)
+        self._dpi=dpi
+        return self._dpi
 
         
     def _file_list(self):
@@ -466,32 +660,44 @@ class Project(abstracts.SerializedDict):
         for p in self.pages:
             p.title=self["Pages"][p.path]
 
-    def apply_ocr(self):
-        def ocr_on_page(page):
-            return page.apply_ocr(ocr)
-
-        max_threads=self["Max threads"]
-        ocr=libocr.Tesseract(self["Ocr Options"]['tesseract_options'])
-        print('Performing optical character recognition.')
+    @property
+    def ocr_running(self):
+        """apply_ocr() is running: in the gui, events are processed
+        meanwhile."""
+        return self._ocr_scheduler is not None
 
-        if max_threads==1:
-            for page in self.pages:
-                ocr_on_page(page)
-            return
+    def apply_ocr(self):
+        """OCR of the pages without text. Return the list of
+        ocr.OcrResult, errors are also printed."""
+        if self.ocr_running: 
+            print("wrn: OCR already running", file=sys.stderr)
+            return []
+        options=self["Ocr Options"]
+        # other engines are not supported here yet: the tesseract command
+        engine="tesserocr" if options["ocr_engine"]=="tesserocr" else "tesseract"
+        ocr=libocr.engine(engine,options['tesseract_options'])
+        self._ocr_scheduler=libocr.OcrScheduler(ocr,max_workers=self["Max threads"],
+                                                threads_per_job=options["tesseract_threads"],
+                                                timeout=options["ocr_timeout"] or None,
+                                                retries=options["ocr_retries"],
+                                                emit_status=self._emit_status)
+        print('Performing optical character recognition (%d workers).' % self._ocr_scheduler.max_workers)
+        try:
+            results=self._ocr_scheduler.run(self.pages)
+        finally:
+            self._ocr_scheduler=None
+            ocr.close()
+        for res in results:
+            if res.ok:
+                print('Page %s: %.1fs, cpu %.1fs' % (res.page.title,res.wall_time,res.cpu_time))
+            else:
+                print('err: page %s (%d attempts): %s' % (res.page.title,res.attempts,res.error), 
+                      file=sys.stderr)
+        return results
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_threads) as executor:
-            # Start the load operations and mark each future with its URL
-            future_to_page = {executor.submit(ocr_on_page, page): 
-                              page for page in self.pages}
-            for future in concurrent.futures.as_completed(future_to_page):
-                page = future_to_page[future]
-                try:
-                    data = future.result()
-                except Exception as e:
-                    print('Page %s generated an exception: %s' % (page.title, e))
-                    traceback.print_exc()
-                else:
-                    print('Page %s is %d bytes' % (page.title, len(data)))
+    def cancel_ocr(self):
+        if self._ocr_scheduler is not None:
+            self._ocr_scheduler.cancel()
 
     def djvubind(self,djvu_name):
         if len(self.pages) == 0: return
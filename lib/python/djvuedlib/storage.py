@@ -0,0 +1,422 @@
+"""
+Backends keeping the project document on filesystem.
+
+A storage loads the document as a plain OrderedDict and then receives
+from SerializedDict the list of changed paths (tuples of keys, None
+for the whole document) to persist.
+"""
+
+import atexit
+import collections
+import collections.abc
+import itertools
+import json
+import os
+import os.path
+import sqlite3
+import sys
+import threading
+
+from . import jsonlib
+
+class AsyncFileWriter(threading.Thread):
+    """Writes files in background, in submission order.
+
+    replace() writes a new version of a file in a temporary file,
+    fsyncs it and renames it over the old one, so a crash leaves
+    either the old or the new version. A replace supersedes any
+    pending job on the same file (and on the files it removes), so a
+    burst of changes costs one write. append() adds text to a file.
+
+    """
+
+    def __init__(self):
+        threading.Thread.__init__(self,daemon=True)
+        self._jobs=[]
+        self._busy=False
+        self._stopping=False
+        self._cond=threading.Condition()
+        self.error=None
+        atexit.register(self.flush)
+
+    def _submit(self,job,superseded=[]):
+        if self._stopping:
+            self._execute(*job)
+            return
+        with self._cond:
+            if superseded:
+                self._jobs=[ j for j in self._jobs if j[1] not in superseded ]
+            if (job[0]=="append") and self._jobs and (self._jobs[-1][:2]==job[:2]):
+                self._jobs[-1]=(job[0],job[1],self._jobs[-1][2]+job[2],[])
+            else:
+                self._jobs.append(job)
+            if self.ident is None: self.start()
+            self._cond.notify_all()
+
+    def replace(self,fpath,data,remove=[]):
+        """Atomically replace ''fpath'' with ''data'', then delete the
+        files in ''remove''."""
+        self._submit(("replace",fpath,data,list(remove)),superseded=[fpath]+list(remove))
+
+    def append(self,fpath,data):
+        self._submit(("append",fpath,data,[]))
+
+    def run(self):
+        while True:
+            with self._cond:
+                while (not self._jobs) and (not self._stopping):
+                    self._cond.wait()
+                if not self._jobs: return
+                job=self._jobs.pop(0)
+                self._busy=True
+            try:
+                self._execute(*job)
+            except Exception as e:
+                # the writer goes on: flush() would wait forever
+                # for the jobs left
+                self.error=e
+                print("err: [AsyncFileWriter] %s: %s" % (job[1],e), file=sys.stderr)
+            finally:
+                with self._cond:
+                    self._busy=False
+                    self._cond.notify_all()
+
+    def _execute(self,action,fpath,data,remove):
+        if action=="append":
+            with open(fpath,"a") as fd:
+                fd.write(data)
+                fd.flush()
+                os.fsync(fd.fileno())
+            return
+        tmp_path=fpath+".tmp"
+        with open(tmp_path,"w") as fd:
+            fd.write(data)
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.replace(tmp_path,fpath)
+        for r in remove:
+            if os.path.exists(r): os.remove(r)
+
+    def flush(self):
+        """Wait until all submitted jobs are on disk. Raise the last
+        error met by the writer, if any."""
+        with self._cond:
+            while self._jobs or self._busy:
+                self._cond.wait()
+            error,self.error=self.error,None
+        if error is not None: raise error
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            with self._cond:
+                self._stopping=True
+                self._cond.notify_all()
+            atexit.unregister(self.flush)
+
+def _journal_path(fpath):
+    return os.path.splitext(fpath)[0]+".journal"
+
+def _replay(jpath,data):
+    with open(jpath,"r") as fd:
+        for r in fd:
+            try:
+                record=json.loads(r,object_pairs_hook=collections.OrderedDict)
+            except ValueError:
+                # truncated by a crash while appending
+                break
+            path=record["path"]
+            obj=data
+            for k in path[:-1]:
+                obj=obj[k]
+            if "value" in record:
+                obj[path[-1]]=record["value"]
+                continue
+            if path[-1] in obj: 
+                del obj[path[-1]]
+
+def read_json(fpath):
+    """The json document ''fpath'', with its journal (if any)
+    replayed. Nothing is written."""
+    if os.path.exists(fpath):
+        data=jsonlib.json_load(fpath)
+    else:
+        data=collections.OrderedDict()
+    jpath=_journal_path(fpath)
+    if os.path.exists(jpath):
+        _replay(jpath,data)
+    return data
+
+class JsonStorage(object):
+    """The document is a single json file, ''fpath''.
+
+    In journal mode, single changes are appended to a journal file
+    next to ''fpath'' and the whole document is rewritten only when
+    the journal grows over ''journal_max_size'' or on close(). A
+    journal left on filesystem is always replayed on load.
+
+    Files are written in background by an AsyncFileWriter.
+
+    """
+
+    journal_max_size=512*1024
+
+    def __init__(self,fpath,journal=False):
+        self._fpath=fpath
+        self._jpath=_journal_path(fpath)
+        self._journal=journal
+        self._journal_size=0
+        self._writer=AsyncFileWriter()
+
+    def load(self):
+        data=read_json(self._fpath)
+        if os.path.exists(self._jpath):
+            self._journal_size=os.path.getsize(self._jpath)
+            if not self._journal: self._write(data)
+        return data
+
+    def commit(self,document,changes):
+        if (not self._journal) or (None in changes):
+            self._write(document._dict)
+            return
+        records=[]
+        for path in changes:
+            try:
+                records.append(json.dumps({ "path": path, "value": document._lookup(path) }))
+            except (KeyError,IndexError):
+                records.append(json.dumps({ "path": path, "delete": True }))
+        data="\n".join(records)+"\n"
+        self._writer.append(self._jpath,data)
+        self._journal_size+=len(data)
+        if self._journal_size > self.journal_max_size: 
+            self._write(document._dict)
+
+    def _write(self,data):
+        self._writer.replace(self._fpath,json.dumps(data),remove=[self._jpath])
+        self._journal_size=0
+
+    def flush(self):
+        self._writer.flush()
+
+    def close(self,document):
+        if self._journal_size:
+            self._write(document._dict)
+        self._writer.close()
+
+class SqliteStorage(object):
+    """The document is kept in a sqlite database, ''fpath''.
+
+    Top level keys are listed in table settings, with their kind:
+
+      * value: a json value, kept in settings itself;
+      * section: a dictionary, one row for each item in table sections;
+      * metadata: a list of key/value pairs, in table metadata;
+      * outline: a tree of (title,page,children), in table outline.
+
+    So a change to a single page title is a single row update. Metadata
+    and outline are saved whole by the project: their rows are matched
+    by position with the stored ones, and only the differences are
+    written. A key keeps its row in settings, and so its place in the
+    document, when rewritten.
+
+    """
+
+    sections=[ "Pages", "Encoding Options", "Ocr Options" ]
+
+    schema=[
+        "CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, kind TEXT, value TEXT)",
+        "CREATE TABLE IF NOT EXISTS sections (section TEXT, key TEXT, value TEXT, PRIMARY KEY (section,key))",
+        "CREATE TABLE IF NOT EXISTS metadata (pos INTEGER PRIMARY KEY, key TEXT, value TEXT)",
+        "CREATE TABLE IF NOT EXISTS outline (id INTEGER PRIMARY KEY, parent INTEGER, pos INTEGER, title TEXT, page TEXT)",
+        "CREATE INDEX IF NOT EXISTS outline_parent ON outline (parent,pos)",
+    ]
+
+    def __init__(self,fpath,json_fpath=None):
+        self._fpath=fpath
+        self._json_fpath=json_fpath
+        migrate=(not os.path.exists(self._fpath)) and (json_fpath is not None) and os.path.exists(json_fpath)
+        self._conn=sqlite3.connect(self._fpath)
+        with self._conn:
+            for sql in self.schema:
+                self._conn.execute(sql)
+        if migrate:
+            self.import_json(json_fpath)
+
+    def _kind(self,key,value):
+        if key=="Metadata": return "metadata"
+        if key=="Outline": return "outline"
+        if (key in self.sections) or isinstance(value,(dict,collections.abc.Mapping)): 
+            return "section"
+        return "value"
+
+    def load(self):
+        data=collections.OrderedDict()
+        rows=self._conn.execute("SELECT key,kind,value FROM settings ORDER BY rowid").fetchall()
+        for key,kind,value in rows:
+            if kind=="value":
+                data[key]=json.loads(value,object_pairs_hook=collections.OrderedDict)
+            elif kind=="section":
+                data[key]=self._load_section(key)
+            elif kind=="metadata":
+                data[key]=[ [k,v] for k,v in self._conn.execute("SELECT key,value FROM metadata ORDER BY pos") ]
+            elif kind=="outline":
+                data[key]=self._load_outline()
+        return data
+
+    def _load_section(self,section):
+        ret=collections.OrderedDict()
+        cursor=self._conn.execute("SELECT key,value FROM sections WHERE section=? ORDER BY rowid",(section,))
+        for k,v in cursor:
+            ret[k]=json.loads(v,object_pairs_hook=collections.OrderedDict)
+        return ret
+
+    def _load_outline(self):
+        children=collections.defaultdict(list)
+        for row_id,parent,title,page in self._conn.execute("SELECT id,parent,title,page FROM outline ORDER BY parent,pos"):
+            children[parent].append( (row_id,title,page) )
+        def subtree(parent):
+            return [ [title,page,subtree(row_id)] for row_id,title,page in children[parent] ]
+        return subtree(None)
+
+    def commit(self,document,changes):
+        with self._conn:
+            if None in changes:
+                self._write(document._dict)
+                return
+            for path in changes:
+                self._write_path(document,path)
+
+    def _write(self,data):
+        for table in [ "settings", "sections", "metadata", "outline" ]:
+            self._conn.execute("DELETE FROM %s" % table)
+        for key in data:
+            self._write_key(key,data[key])
+
+    def _write_path(self,document,path):
+        try:
+            value=document._lookup(path)
+        except (KeyError,IndexError):
+            value=None
+            missing=True
+        else:
+            missing=False
+        if len(path)==1:
+            if missing:
+                self._delete_key(path[0])
+                return
+            self._write_key(path[0],value)
+            return
+        if (len(path)==2) and (path[0] in self.sections):
+            if missing:
+                self._conn.execute("DELETE FROM sections WHERE section=? AND key=?",path)
+                return
+            self._conn.execute("INSERT INTO sections (section,key,value) VALUES (?,?,?) "
+                               "ON CONFLICT (section,key) DO UPDATE SET value=excluded.value",
+                               (path[0],path[1],json.dumps(value)))
+            return
+        self._write_key(path[0],document._lookup(path[:1]))
+
+    def _clear_items(self,key,kind):
+        if kind=="section":
+            self._conn.execute("DELETE FROM sections WHERE section=?",(key,))
+        elif kind=="metadata":
+            self._conn.execute("DELETE FROM metadata")
+        elif kind=="outline":
+            self._conn.execute("DELETE FROM outline")
+
+    def _delete_key(self,key):
+        row=self._conn.execute("SELECT kind FROM settings WHERE key=?",(key,)).fetchone()
+        if row is None: return
+        self._conn.execute("DELETE FROM settings WHERE key=?",(key,))
+        self._clear_items(key,row[0])
+
+    def _write_key(self,key,value):
+        kind=self._kind(key,value)
+        row=self._conn.execute("SELECT kind FROM settings WHERE key=?",(key,)).fetchone()
+        if (row is not None) and ((row[0]!=kind) or (kind=="section")):
+            self._clear_items(key,row[0])
+        # plain python structures, with __serialize__ applied
+        value=json.loads(json.dumps(value),object_pairs_hook=collections.OrderedDict)
+        # an update keeps the rowid: the order of the keys on load
+        self._conn.execute("INSERT INTO settings (key,kind,value) VALUES (?,?,?) "
+                           "ON CONFLICT (key) DO UPDATE SET kind=excluded.kind,value=excluded.value",
+                           (key,kind,json.dumps(value) if kind=="value" else None))
+        if kind=="section":
+            self._conn.executemany("INSERT INTO sections (section,key,value) VALUES (?,?,?)",
+                                   [ (key,k,json.dumps(v)) for k,v in value.items() ])
+        elif kind=="metadata":
+            # older documents keep it as a dictionary
+            if isinstance(value,collections.abc.Mapping): value=list(value.items())
+            self._write_metadata(value)
+        elif kind=="outline":
+            children=collections.defaultdict(list)
+            for row_id,parent,title,page in self._conn.execute("SELECT id,parent,title,page FROM outline ORDER BY parent,pos"):
+                children[parent].append( (row_id,title,page) )
+            # new rows get ids never used by the stored ones
+            last_id=self._conn.execute("SELECT max(id) FROM outline").fetchone()[0] or 0
+            self._write_outline(value,None,children[None],children,itertools.count(last_id+1))
+
+    def _write_metadata(self,value):
+        old=self._conn.execute("SELECT pos,key,value FROM metadata ORDER BY pos").fetchall()
+        rows=[ (pos,k,v) for pos,(k,v) in enumerate(value) ]
+        self._conn.executemany("INSERT INTO metadata (pos,key,value) VALUES (?,?,?) "
+                               "ON CONFLICT (pos) DO UPDATE SET key=excluded.key,value=excluded.value",
+                               [ r for r in rows if (r[0]>=len(old)) or (tuple(old[r[0]])!=r) ])
+        self._conn.execute("DELETE FROM metadata WHERE pos>=?",(len(rows),))
+
+    def _write_outline(self,rows,parent,old,children,new_ids):
+        """Write ''rows'' under ''parent'' in place of the stored rows
+        ''old''; ''children'' are the stored rows for each parent."""
+        for pos,(title,page,subrows) in enumerate(rows):
+            if pos<len(old):
+                row_id,old_title,old_page=old[pos]
+                if (old_title,old_page)!=(title,page):
+                    self._conn.execute("UPDATE outline SET title=?,page=? WHERE id=?",(title,page,row_id))
+                old_children=children[row_id]
+            else:
+                row_id=next(new_ids)
+                self._conn.execute("INSERT INTO outline (id,parent,pos,title,page) VALUES (?,?,?,?,?)",
+                                   (row_id,parent,pos,title,page))
+                old_children=[]
+            self._write_outline(subrows,row_id,old_children,children,new_ids)
+        for row_id,title,page in old[len(rows):]:
+            self._delete_outline(row_id,children)
+
+    def _delete_outline(self,row_id,children):
+        for child in children[row_id]:
+            self._delete_outline(child[0],children)
+        self._conn.execute("DELETE FROM outline WHERE id=?",(row_id,))
+
+    def import_json(self,fpath):
+        """Replace the content of the database with the json document
+        ''fpath'' (and its journal, if any)."""
+        data=read_json(fpath)
+        with self._conn:
+            self._write(data)
+
+    def export_json(self,fpath):
+        with open(fpath,"w") as fd:
+            json.dump(self.load(),fd)
+
+    def flush(self): pass
+
+    def close(self,document):
+        self._conn.close()
+
+def open_storage(fpath,backend=None,journal=False):
+    """Return the storage for the project ''fpath''.
+
+    Without ''backend'', it is guessed from the suffix of ''fpath''.
+    A sqlite backend on a ''.json'' project uses a ''.sqlite'' file
+    with the same name, created from the json one on first use.
+
+    """
+    base,ext=os.path.splitext(fpath)
+    if backend is None:
+        backend="sqlite" if ext in [ ".sqlite", ".db" ] else "json"
+    if backend=="json":
+        return JsonStorage(fpath,journal=journal)
+    if ext==".json":
+        return SqliteStorage(base+".sqlite",json_fpath=fpath)
+    return SqliteStorage(fpath,json_fpath=base+".json")
@@ -0,0 +1,89 @@
+"""
+In-memory undo/redo of the changes of a text structure (OcrGrammar).
+
+A change is recorded as the state of the nodes it touches, before and
+after: undo and redo put back one of the two states.
+"""
+
+class TreeState(object):
+    """State of some nodes of ''grammar'' (None for its list of rules):
+    level, box, text and children."""
+
+    def __init__(self,grammar,nodes):
+        self._grammar=grammar
+        self._states=[]
+        seen=set()
+        for node in nodes:
+            if id(node) in seen: continue
+            seen.add(id(node))
+            if node is None:
+                self._states.append( (None,list(grammar.rules)) )
+                continue
+            children=node.children
+            if type(children) is list: children=list(children)
+            self._states.append( (node,(node._level,node._xmin,node._ymin,node._xmax,node._ymax,
+                                        node.text,children)) )
+
+    def restore(self):
+        for node,state in self._states:
+            if node is None:
+                self._grammar.rules[:]=state
+                for rule in state:
+                    rule.parent=None
+                continue
+            (node._level,node._xmin,node._ymin,node._xmax,node._ymax,
+             node.text,children)=state
+            # the saved list stays as it is, for the next restore
+            if type(children) is list: children=list(children)
+            node.children=children
+            for ch in children:
+                ch.parent=node
+        self._grammar.reset_index()
+
+class Command(object):
+    def __init__(self,label,before,after):
+        self.label=label
+        self._before=before
+        self._after=after
+
+    def undo(self): self._before.restore()
+    def redo(self): self._after.restore()
+
+class UndoStack(object):
+    """Commands done (before the current index) and undone (after
+    it). The clean index is where the last save happened, -1 if no
+    longer reachable."""
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._commands=[]
+        self._index=0
+        self._clean=0
+
+    def push(self,command):
+        del self._commands[self._index:]
+        if self._clean>self._index: self._clean=-1
+        self._commands.append(command)
+        self._index+=1
+
+    def can_undo(self): return self._index>0
+    def can_redo(self): return self._index<len(self._commands)
+
+    def undo(self):
+        if not self.can_undo(): return None
+        self._index-=1
+        command=self._commands[self._index]
+        command.undo()
+        return command
+
+    def redo(self):
+        if not self.can_redo(): return None
+        command=self._commands[self._index]
+        command.redo()
+        self._index+=1
+        return command
+
+    def set_clean(self): self._clean=self._index
+    def is_clean(self): return self._clean==self._index
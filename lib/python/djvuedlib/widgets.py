@@ -16,10 +16,12 @@ class HButtonBar(qtwidgets.QWidget):
     def __init__(self,def_list):
         qtwidgets.QWidget.__init__(self)
         b_layout=self.layout()
+        self.buttons={}
         for label,callback in def_list:
             button = qtwidgets.QPushButton(label)
             button.clicked.connect(callback)
             b_layout.addWidget(button)
+            self.buttons[label]=button
         self.setLayout(b_layout)
 
 class VButtonBar(HButtonBar):
@@ -0,0 +1,86 @@
+#! /usr/bin/env python3
+
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc.
+
+"""Timings of the hot paths, on synthetic pages: python3 benchmarks.py"""
+
+import copy
+import difflib
+import os
+import random
+import sys
+import timeit
+
+# Adjust the python path to use live code and not an installed version
+loc=os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0,os.path.normpath(os.path.join(loc,'../../../opt/djvubind')))
+sys.path.insert(0,os.path.normpath(os.path.join(loc,'..')))
+
+from djvuedlib import hiddentext
+from djvuedlib import ocr
+
+# unittests.py here, not the unittests directory seen from ..
+sys.path.insert(0,loc)
+from unittests import BaselineTesseract, synthetic_boxfile
+
+REPEAT=5
+
+def report(name,func,number=1):
+    best=min(timeit.repeat(func,number=number,repeat=REPEAT))/number
+    print("%-40s %8.2f ms" % (name,best*1000))
+
+def hiddentext_page(lines=100,words=12):
+    """A djvused page with ''lines'' lines of ''words'' words, chars
+    included."""
+    rnd=random.Random(0)
+    out=[ "(page 0 0 2480 3508" ]
+    for l in range(lines):
+        y=3400-30*l
+        out.append(" (line 100 %d 2400 %d" % (y,y+25))
+        for w in range(words):
+            x=100+190*w
+            text=''.join(rnd.choice('abcdefghij"\\') for n in range(6))
+            chars=' '.join('(char %d %d %d %d "%s")' % (x+30*n,y,x+30*n+25,y+25,'\\'+c if c in '"\\' else c)
+                           for n,c in enumerate(text))
+            out.append("  (word %d %d %d %d %s)" % (x,y,x+180,y+25,chars))
+        out[-1]+=")"
+    out[-1]+=")"
+    return "\n".join(out)
+
+def bench_hiddentext():
+    text=hiddentext_page()
+    print("hidden text: %d bytes" % len(text))
+    report("djvused_parse_text",lambda: hiddentext.djvused_parse_text(text))
+    report("djvused_parse_text_grako",lambda: hiddentext.djvused_parse_text_grako(text))
+
+def bench_boxfile():
+    tesseract=ocr.Tesseract.__new__(ocr.Tesseract)
+    baseline=BaselineTesseract()
+    # with few distinct characters, SequenceMatcher takes them all as
+    # junk on a long page and gives a handful of opcodes: a wide
+    # alphabet keeps one opcode per edit
+    alphabet=''.join(chr(0x400+n) for n in range(400))
+    for rate in (0.002,0.01,0.03):
+        boxdata,text=synthetic_boxfile(10000,rate,7,alphabet)
+        boxtext=''.join(entry['char'] for entry in boxdata)
+        opcodes=difflib.SequenceMatcher(None,boxtext,text.replace(' ','').replace('\n','')).get_opcodes()
+        print("boxfile: 10000 chars, edit rate %.3f, %d opcodes" % (rate,len(opcodes)))
+        report("baseline _correct_boxfile",lambda: baseline._correct_boxfile(copy.deepcopy(boxdata),text))
+        report("Tesseract._correct_boxfile",lambda: tesseract._correct_boxfile(boxdata,text))
+        report("copy.deepcopy (in the baseline time)",lambda: copy.deepcopy(boxdata))
+
+if __name__ == '__main__':
+    bench_hiddentext()
+    bench_boxfile()
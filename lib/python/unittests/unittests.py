@@ -0,0 +1,1030 @@
+#! /usr/bin/env python3
+
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc.
+
+import collections
+import copy
+import difflib
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+from html.parser import HTMLParser
+
+# Adjust the python path to use live code and not an installed version
+loc=os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0,os.path.normpath(os.path.join(loc,'../../../opt/djvubind')))
+sys.path.insert(0,os.path.normpath(os.path.join(loc,'..')))
+
+# the caches of the tests are not the ones of the user
+cache_home=tempfile.TemporaryDirectory()
+os.environ['XDG_CACHE_HOME']=cache_home.name
+
+from djvuedlib import abstracts
+from djvuedlib import book
+from djvuedlib import hiddentext
+from djvuedlib import ocr
+from djvuedlib import project
+from djvuedlib import storage
+
+from djvubind import utils
+
+# Move into the directory of the unittests
+os.chdir(loc)
+
+HIDDENTEXT_FILES=[ 'data/hiddentext_lines.txt',
+                   'data/hiddentext_nested.txt',
+                   'data/hiddentext_spacing.txt' ]
+
+def dump_block(block):
+    """The tree under ''block'' as nested tuples."""
+    return (block.level,block.xmin,block.ymin,block.xmax,block.ymax,block.text,
+            [ dump_block(ch) for ch in block.children ])
+
+def dump_grammar(grammar):
+    return [ dump_block(r) for r in grammar.rules ]
+
+class HiddenText(unittest.TestCase):
+    """
+    Tests for djvuedlib/hiddentext
+    """
+
+    def test_01_reader_same_as_grako(self):
+        for fname in HIDDENTEXT_FILES:
+            with open(fname,'r') as fd:
+                text=fd.read()
+            reader=hiddentext.djvused_parse_text(text)
+            grako=hiddentext.djvused_parse_text_grako(text)
+            self.assertEqual(dump_grammar(grako),dump_grammar(reader),fname)
+            self.assertEqual(grako.out_tree(),reader.out_tree(),fname)
+
+    def test_02_escapes_and_empty_zones(self):
+        with open('data/hiddentext_nested.txt','r') as fd:
+            grammar=hiddentext.djvused_parse_text(fd.read())
+        word=grammar.rules[0].children[0].children[0].children[0].children[0].children[1]
+        self.assertEqual(['"','\\','','\\303\\240'],[ ch.text for ch in word.children ])
+        self.assertEqual('char',word.children[2].level)
+        self.assertEqual(2,len(grammar.rules[0].children))
+
+    def test_03_malformed_input(self):
+        for text in [ '',
+                      '(page 0 0 10 10',
+                      '(page 0 0 10 10 "a"))',
+                      '(page 0 0 10 "a")',
+                      '(page 0 0 10 10)',
+                      '(page 0 0 10 10 "a" (word 0 0 1 1 "b"))',
+                      '(page 0 0 10 10 (word 0 0 1 1 "b") "a")',
+                      '(page 0 0 10 10 "unterminated)',
+                      '(page 0 0 10 10 "a") garbage' ]:
+            self.assertRaises(hiddentext.ParseError,hiddentext.djvused_parse_text,text)
+
+def all_rules(grammar):
+    rules=[]
+    stack=list(grammar.rules)
+    while stack:
+        rule=stack.pop()
+        rules.append(rule)
+        stack.extend(rule.children)
+    return rules
+
+def depth(rule):
+    if not rule.children: return 0
+    return 1+max([ depth(ch) for ch in rule.children ])
+
+def random_edit(page,rnd):
+    """Apply to the text of ''page'' a random change, as the editor
+    does. Return its name."""
+    grammar=page.text_structure
+    obj=rnd.choice(all_rules(grammar))
+    siblings=grammar.rules if obj.parent is None else obj.parent.children
+    op=rnd.choice([ 'shift', 'split', 'merge_above', 'merge_below', 'duplicate', 'move_up',
+                    'move_down', 'move_left', 'move_right', 'remove', 'insert', 'create', 'set' ])
+    if op=='shift':
+        getattr(page,'shift_%s_text_rule' % rnd.choice(['up','down','left','right']))(obj,rnd.randint(1,300))
+    elif op=='split':
+        page.split_rule(obj,['a','b','c'][:rnd.randint(1,3)])
+    elif op in ['merge_above','merge_below']:
+        # blocks of the same level, as the editor offers
+        ind=grammar.index(obj)+(1 if op=='merge_below' else -1)
+        if (0<=ind<len(siblings)) and (siblings[ind].level==obj.level):
+            getattr(page,op+'_text_rule')(obj)
+    elif op=='duplicate':
+        page.duplicate_text_rule(obj)
+    elif op=='move_right':
+        # only where the levels below leave room for the subtree
+        ind=grammar.index(obj)
+        if (ind>0) and (len(siblings[ind-1].sub_rule_levels())>depth(obj)):
+            page.move_right(obj)
+    elif op in ['move_up','move_down','move_left']:
+        getattr(page,op)(obj)
+    elif op=='remove':
+        ind=grammar.index(obj)
+        count=min(rnd.randint(1,2),len(siblings)-ind)
+        if (obj.parent is not None) or (count<len(grammar.rules)):
+            page.remove_text_rules(obj.parent,ind,count)
+    elif op=='insert':
+        page.insert_text_rules(obj.parent,rnd.randint(0,len(siblings)),rnd.randint(1,2))
+    elif op=='create':
+        if not obj.sub_rule_levels(): return op
+        x,y=rnd.randint(0,2000),rnd.randint(0,3000)
+        page.create_text_rule(obj,'word',x,y,x+rnd.randint(1,400),y+rnd.randint(1,400),'new')
+    else:
+        x,y=rnd.randint(0,2000),rnd.randint(0,3000)
+        page.set_text_rule(obj,xmin=x,ymin=y,xmax=x+rnd.randint(0,900),ymax=y+rnd.randint(0,900))
+    return op
+
+class TextEdit(unittest.TestCase):
+    """
+    Tests for the changes of the text of a page (djvuedlib/book.py,
+    djvuedlib/hiddentext)
+    """
+
+    def setUp(self):
+        self.dir=tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def page(self,fname):
+        path=os.path.join(self.dir,os.path.basename(fname).replace('.txt','.tif'))
+        shutil.copy(fname,os.path.join(self.dir,os.path.basename(fname)))
+        return book.Page(path)
+
+    def test_01_block_index(self):
+        rnd=random.Random(0)
+        for fname in HIDDENTEXT_FILES:
+            page=self.page(fname)
+            grammar=page.text_structure
+            for n in range(300):
+                op=random_edit(page,rnd)
+                self.check_index(page,rnd,(fname,n,op))
+
+    def check_index(self,page,rnd,msg):
+        """The block index of ''page'' against a linear scan."""
+        rules=all_rules(page.text_structure)
+        for k in range(5):
+            x,y=rnd.randint(0,2600),rnd.randint(0,3600)
+            expected={ id(r) for r in rules if r.xmin<=x<=r.xmax and r.ymin<=y<=r.ymax }
+            self.assertEqual(expected,{ id(r) for r in page.text_rules_at(x,y) },msg)
+            x2,y2=x+rnd.randint(0,1500),y+rnd.randint(0,1500)
+            expected={ id(r) for r in rules if x<=r.xmin and r.xmax<=x2 and y<=r.ymin and r.ymax<=y2 }
+            self.assertEqual(expected,{ id(r) for r in page.text_rules_inside(x,y,x2,y2) },msg)
+
+    def test_02_positions(self):
+        rnd=random.Random(1)
+        for fname in HIDDENTEXT_FILES:
+            page=self.page(fname)
+            grammar=page.text_structure
+            for n in range(300):
+                op=random_edit(page,rnd)
+                for rule in all_rules(grammar):
+                    siblings=grammar.rules if rule.parent is None else rule.parent.children
+                    expected=[ id(r) for r in siblings ].index(id(rule))
+                    self.assertEqual(expected,grammar.index(rule),(fname,n,op))
+
+    def test_03_undo_redo(self):
+        rnd=random.Random(2)
+        for fname in HIDDENTEXT_FILES:
+            page=self.page(fname)
+            grammar=page.text_structure
+            # the tree after each command on the undo stack
+            states=[ grammar.out_tree() ]
+            for n in range(200):
+                op=random_edit(page,rnd)
+                # one command per change, none if skipped
+                self.assertIn(page.undo_stack._index,[len(states)-1,len(states)],op)
+                if page.undo_stack._index==len(states):
+                    states.append(grammar.out_tree())
+            self.assertTrue(page.dirty)
+            for n in range(len(states)-2,-1,-1):
+                self.assertIsNotNone(page.undo_text())
+                self.assertEqual(states[n],grammar.out_tree(),(fname,n))
+            self.assertIsNone(page.undo_text())
+            self.assertFalse(page.dirty)
+            self.check_index(page,rnd,fname)
+            for n in range(1,len(states)):
+                self.assertIsNotNone(page.redo_text())
+                self.assertEqual(states[n],grammar.out_tree(),(fname,n))
+            self.assertIsNone(page.redo_text())
+            self.check_index(page,rnd,fname)
+
+class OutlineProject(object):
+    """What project.Outline needs of its project."""
+
+    pages_by_path={}
+
+    def _save(self,key): pass
+
+def all_rows(outline):
+    rows=[]
+    stack=list(outline.rows)
+    while stack:
+        row=stack.pop()
+        rows.append(row)
+        stack.extend(row.children)
+    return rows
+
+class OutlineEdit(unittest.TestCase):
+    """
+    Tests for the changes of the outline (djvuedlib/project.py)
+    """
+
+    def test_01_positions(self):
+        rnd=random.Random(0)
+        outline=project.Outline(OutlineProject())
+        outline.insert_rows(None,0,5)
+        for n in range(1000):
+            rows=all_rows(outline)
+            obj=rnd.choice(rows)
+            op=rnd.choice([ 'move_up', 'move_down', 'move_right', 'insert', 'remove', 'create' ])
+            if op in ['move_up','move_down','move_right']:
+                getattr(outline,op)(obj)
+            elif op=='insert':
+                outline.insert_rows(obj.parent,rnd.randint(0,outline.count_children(obj.parent)),rnd.randint(1,2))
+            elif op=='remove':
+                ind=outline.index_row(obj)
+                count=min(rnd.randint(1,2),outline.count_children(obj.parent)-ind)
+                if (obj.parent is not None) or (count<len(outline.rows)):
+                    outline.remove_rows(obj.parent,ind,count)
+            else:
+                outline.create_row(obj,'new',None)
+            for row in all_rows(outline):
+                siblings=outline.rows if row.parent is None else row.parent.children
+                expected=[ id(r) for r in siblings ].index(id(row))
+                self.assertEqual(expected,outline.index_row(row),(n,op))
+
+class BaselineTesseract(object):
+    """
+    Tesseract._correct_boxfile() verbatim as it was before it was
+    rewritten (git show 49676ce:lib/python/djvuedlib/ocr.py): the
+    reference of the current implementation.
+    """
+
+    def _correct_boxfile(self, boxdata, text):
+        """
+        Reconciles Tesseract's boxfile data with it's plain text data.
+
+        The Tesseract boxfile does not include information like spacing, which is kinda important
+        since we want to know where one word ends and the next begins.  The plain textfile will
+        give that information, but sometimes its content does not exactly match the boxfile.  So we
+        do our best to merge those two pieces of data together and "fix" the boxfile to match the
+        textfile.
+        """
+
+        # Convert the boxing information into a plain text string with no bounding information.
+        boxtext = ''
+        for entry in boxdata:
+            boxtext = boxtext + entry['char']
+        # Remove spacing and newlines from the readable text because the boxing data doesn't have those.
+        text = text.replace(' ', '')
+        text = text.replace('\n', '')
+
+        # Figure out what changes are needed, but don't do them immediately since it would
+        # change the boxdata index and screw up the next action.
+        diff = difflib.SequenceMatcher(None, boxtext, text)
+        queu = []
+        for action, a_start, a_end, b_start, b_end in diff.get_opcodes():
+            entry = boxdata[a_start]
+            item = {'action':action, 'target':entry, 'boxtext':boxtext[a_start:a_end], 'text':text[b_start:b_end]}
+            queu.append(item)
+
+        # Make necessary changes
+        for change in queu:
+            if (change['action'] == 'replace'):
+                if (len(change['boxtext']) == 1) and (len(change['text']) == 1):
+                    index = boxdata.index(change['target'])
+                    boxdata[index]['char'] = change['text']
+                elif (len(change['boxtext']) > 1) and (len(change['text']) == 1):
+                    # Combine the boxing data
+                    index = boxdata.index(change['target'])
+                    new = {'char':'', 'xmin':0, 'ymin':0, 'xmax':0, 'ymax':0}
+                    new['char'] = change['text']
+                    new['xmin'] = min([x['xmin'] for x in boxdata[index:index+len(change['boxtext'])]])
+                    new['ymin'] = min([x['ymin'] for x in boxdata[index:index+len(change['boxtext'])]])
+                    new['xmax'] = min([x['xmax'] for x in boxdata[index:index+len(change['boxtext'])]])
+                    new['ymax'] = min([x['ymax'] for x in boxdata[index:index+len(change['boxtext'])]])
+                    del(boxdata[index:index+len(change['boxtext'])])
+                    boxdata.insert(index, new)
+                elif (len(change['boxtext']) == 1) and (len(change['text']) > 1):
+                    # Use the same boxing data.  Will djvused complain that character
+                    # boxes overlap?
+                    index = boxdata.index(change['target'])
+                    del(boxdata[index])
+                    i = 0
+                    for char in list(change['text']):
+                        new = {'char':char, 'xmin':change['target']['xmin'], 'ymin':change['target']['ymin'], 'xmax':change['target']['xmax'], 'ymax':change['target']['ymax']}
+                        boxdata.insert(index+i, new)
+                        i = i + 1
+                elif (len(change['boxtext']) > 1) and (len(change['text']) > 1):
+                    if (len(change['boxtext']) == len(change['text'])):
+                        index = boxdata.index(change['target'])
+                        for char in list(change['text']):
+                            boxdata[index]['char'] = char
+                            index = index + 1
+                    else:
+                        # Delete the boxdata and replace with the plain text data
+                        index = boxdata.index(change['target'])
+                        deletions = boxdata[index:index+len(change['boxtext'])]
+                        for target in deletions:
+                            boxdata.remove(target)
+
+                        i = 0
+                        for char in list(change['text']):
+                            new = {'char':char, 'xmin':change['target']['xmin'], 'ymin':change['target']['ymin'], 'xmax':change['target']['xmax'], 'ymax':change['target']['ymax']}
+                            boxdata.insert(index+i, new)
+                            i = i + 1
+            elif (change['action'] == 'delete'):
+                index = boxdata.index(change['target'])
+                deletions = boxdata[index:index+len(change['boxtext'])]
+                for target in deletions:
+                    boxdata.remove(target)
+            elif (change['action'] == 'insert'):
+                # *Don't* use the boundaries of previous and next characters to guess at a boundary
+                # box.  Things would be ugly if the next character happened to be on a new line.
+                # Just duplicate the boundaries of the previous character
+                index = boxdata.index(change['target'])
+                i = 0
+                for char in list(change['text']):
+                    new = {'char':char, 'xmin':change['target']['xmin'], 'ymin':change['target']['ymin'], 'xmax':change['target']['xmax'], 'ymax':change['target']['ymax']}
+                    boxdata.insert(index+i, new)
+                    i = i + 1
+
+        return boxdata
+
+class BaselineTesseractParser(HTMLParser):
+    """
+    TesseractParser verbatim as it was before it was rewritten (git
+    show 49676ce:lib/python/djvuedlib/ocr.py).
+    """
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.boxing = []
+        self.version = 'tesseract'
+        self.data = ''
+
+    def parse(self, data):
+        self.data = data
+        self.feed(data)
+
+    def handle_starttag(self, tag, attrs):
+        if (tag == 'br') or (tag == 'p'):
+            if (len(self.boxing) > 0):
+                self.boxing.append('newline')
+            return
+        if tag != "span": return
+        if not (('class', 'ocrx_word') in attrs): return
+        #elif (tag == 'span') and (('class', 'ocrx_word') in attrs):
+        # Get the whole element, not just the tag.
+        element = {}
+        element['complete'] = re.search('{0}(.*?)</span>'.format(self.get_starttag_text()), self.data).group(0)
+        element['text'] = re.search('\'>(.*?)</span', element['complete']).group(1)
+        element['text'] = re.sub('<[\w\/\.]*>', '', element['text'])
+        element['text'] = utils.replace_html_codes(element['text'])
+        element['positions'] = re.search('bbox ([0-9\s]*)', element['complete']).group(1)
+        element['positions'] = [int(item) for item in element['positions'].split()]
+
+        i = 0
+        for char in element['text']:
+            if element['positions'][i:i+4] == []:
+                continue
+            section = element['positions'][i:i+4]
+            positions = {'char':char, 'xmin':section[0], 'ymin':section[1], 'xmax':section[2], 'ymax':section[3]}
+            #i = i+4
+
+            # A word break is indicated by a space (go figure).
+            if (char == ' '):
+                self.boxing.append('space')
+                continue
+
+            # Escape special characters
+            subst = {'"': '\\"', "'":"\\'", '\\': '\\\\'}
+            if positions['char'] in subst.keys():
+                positions['char'] = subst[positions['char']]
+            self.boxing.append(positions)
+
+        self.boxing.append('space')
+
+def baseline_boxing(text, height):
+    """
+    The boxing of a hocr document, as Tesseract.analyze() gave it
+    before it was rewritten.
+    """
+
+    parser = BaselineTesseractParser()
+    parser.parse(text)
+
+    for entry in parser.boxing:
+        if entry not in ['space', 'newline']:
+            ymin, ymax = entry['ymin'], entry['ymax']
+            entry['ymin'] = height - ymax
+            entry['ymax'] = height - ymin
+
+    return parser.boxing
+
+def baseline_translate(boxing):
+    """
+    translate() verbatim as it was before it was rewritten.
+    """
+
+    page = ocr.djvuPageBox()
+    line = ocr.djvuLineBox()
+    word = ocr.djvuWordBox()
+    for entry in boxing:
+        if entry == 'newline':
+            if (word.children != []):
+                line.add_element(word)
+            page.add_element(line)
+            line = ocr.djvuLineBox()
+            word = ocr.djvuWordBox()
+        elif entry == 'space':
+            if (word.children != []):
+                line.add_element(word)
+            word = ocr.djvuWordBox()
+        else:
+            word.add_character(entry)
+
+    if (word.children != []):
+        line.add_element(word)
+    if (line.children != []):
+        page.add_element(line)
+
+    if (page.children != []):
+        return page.encode()
+
+    return ''
+
+def synthetic_boxing(seed):
+    """
+    djvubind's boxing of a page, characters with their own box: words
+    between spaces, lines between newlines, some empty.
+    """
+
+    rnd = random.Random(seed)
+    boxing = []
+    for n in range(rnd.randint(1, 300)):
+        r = rnd.random()
+        if r < 0.05:
+            boxing.append('newline')
+        elif r < 0.25:
+            boxing.append('space')
+        else:
+            x, y = rnd.randint(0, 2000), rnd.randint(0, 3000)
+            boxing.append({'char':rnd.choice('ab"\\\'c'), 'xmin':x, 'ymin':y,
+                           'xmax':x+rnd.randint(0, 40), 'ymax':y+rnd.randint(0, 60)})
+    return boxing
+
+class HocrPage(object):
+    """What Tesseract.analyze() needs of a page."""
+
+    def __init__(self, path, height):
+        self.path = path
+        self.basepath = os.path.splitext(path)[0]
+        self.height = height
+
+def synthetic_boxfile(size, rate, seed, alphabet='abcdefghijklmnopqrstuvwxyz'):
+    """
+    A boxfile of ''size'' characters (all boxes different) and the text
+    of the same page, where about ''rate'' of the characters are edited:
+    1->1, n->1, 1->n, n->n replacements, insertions and deletions. The
+    last characters are left alone (the baseline fails on an insertion
+    at the end). The boxes are drawn from ''alphabet''.
+    """
+    rnd = random.Random(seed)
+    boxdata = [{'char':rnd.choice(alphabet), 'xmin':10*i, 'ymin':rnd.randint(0, 9),
+                'xmax':10*i+rnd.randint(5, 9), 'ymax':rnd.randint(10, 19)} for i in range(size)]
+    chars = [entry['char'] for entry in boxdata]
+    text = []
+    i = 0
+    while i < size-3:
+        x = rnd.random()
+        if x < rate:
+            text.append(rnd.choice('ABC'))
+        elif x < 2*rate:
+            text.append(rnd.choice('XYZ')*rnd.randint(2, 3))
+        elif x < 3*rate:
+            text.append(rnd.choice('XYZ'))
+            i += rnd.randint(1, 2)
+        elif x < 4*rate:
+            text.append(rnd.choice('XYZ')+rnd.choice('XYZ'))
+            i += 1
+        elif x < 5*rate:
+            pass
+        elif x < 6*rate:
+            text.append(chars[i]+rnd.choice('XYZ'))
+        else:
+            text.append(chars[i])
+        if rnd.random() < 0.15:
+            text.append(rnd.choice(' \n'))
+        i += 1
+    text.extend(chars[i:])
+    return boxdata, ''.join(text)
+
+class Ocr(unittest.TestCase):
+    """
+    Tests for djvuedlib/ocr.py
+    """
+
+    def setUp(self):
+        # no tesseract needed to merge a boxfile
+        self.tesseract = ocr.Tesseract.__new__(ocr.Tesseract)
+
+    def test_01_correct_boxfile_same_as_baseline(self):
+        for seed in range(300):
+            size = random.Random(seed).randint(4, 200)
+            boxdata, text = synthetic_boxfile(size, 0.03, seed)
+            expected = BaselineTesseract()._correct_boxfile(copy.deepcopy(boxdata), text)
+            self.assertEqual(expected, self.tesseract._correct_boxfile(boxdata, text), seed)
+
+    def test_02_correct_boxfile_merge(self):
+        boxdata = [{'char':'a', 'xmin':0, 'ymin':0, 'xmax':8, 'ymax':20},
+                   {'char':'r', 'xmin':10, 'ymin':2, 'xmax':20, 'ymax':30},
+                   {'char':'n', 'xmin':21, 'ymin':0, 'xmax':32, 'ymax':28},
+                   {'char':'c', 'xmin':40, 'ymin':0, 'xmax':48, 'ymax':20}]
+        expected = BaselineTesseract()._correct_boxfile(copy.deepcopy(boxdata), 'a mc')
+        result = self.tesseract._correct_boxfile(boxdata, 'a mc')
+        self.assertEqual(expected, result)
+        self.assertEqual('amc', ''.join([entry['char'] for entry in result]))
+
+    def test_03_correct_boxfile_split(self):
+        boxdata = [{'char':'a', 'xmin':0, 'ymin':0, 'xmax':8, 'ymax':20},
+                   {'char':'m', 'xmin':10, 'ymin':0, 'xmax':32, 'ymax':30},
+                   {'char':'c', 'xmin':40, 'ymin':0, 'xmax':48, 'ymax':20}]
+        expected = BaselineTesseract()._correct_boxfile(copy.deepcopy(boxdata), 'arnc')
+        result = self.tesseract._correct_boxfile(boxdata, 'arnc')
+        self.assertEqual(expected, result)
+        self.assertEqual([boxdata[1]['xmax']]*2, [entry['xmax'] for entry in result[1:3]])
+
+    def test_04_correct_boxfile_insert_at_end(self):
+        boxdata = [{'char':'a', 'xmin':0, 'ymin':0, 'xmax':8, 'ymax':20},
+                   {'char':'b', 'xmin':10, 'ymin':0, 'xmax':18, 'ymax':20}]
+        # the baseline failed there, the new characters take the last box
+        self.assertRaises(IndexError, BaselineTesseract()._correct_boxfile, copy.deepcopy(boxdata), 'ab cd')
+        result = self.tesseract._correct_boxfile(boxdata, 'ab cd')
+        self.assertEqual(boxdata+[dict(boxdata[1], char='c'), dict(boxdata[1], char='d')], result)
+
+    def test_05_hocr_same_as_baseline(self):
+        with open('data/tesseract.hocr', 'r') as handle:
+            text = handle.read()
+        with tempfile.TemporaryDirectory() as tmp:
+            page = HocrPage(os.path.join(tmp, 'page.tif'), 2200)
+            with open(page.path, 'wb') as handle:
+                handle.write(b'image')
+            # analyze() takes the hocr from the cache, without tesseract
+            self.tesseract.engine_id = 'tesseract test'
+            self.tesseract.options = ''
+            ocr.cache.ocr_results.put(ocr.cache.ocr_results.key(page.path, 'tesseract test', ''), text)
+            words = self.tesseract.analyze(page)
+        expected = baseline_translate(baseline_boxing(text, 2200))
+        self.assertEqual(expected, ocr.translate(words))
+        # a line per paragraph: the ocr_line spans are not line breaks
+        self.assertEqual(3, expected.count('(line '))
+
+    def test_06_translate_same_as_baseline(self):
+        for seed in range(300):
+            boxing = synthetic_boxing(seed)
+            if not [entry for entry in boxing if entry not in ['space', 'newline']]:
+                continue
+            expected = baseline_translate(copy.deepcopy(boxing))
+            # the baseline left a blank for each empty line
+            expected = re.sub(r'\n  (?=[\n)])', '', expected)
+            self.assertEqual(expected, ocr.translate(ocr.boxing_words(boxing)), seed)
+
+    def test_07_text_structure_same_as_parse(self):
+        with open('data/tesseract.hocr', 'r') as handle:
+            parser = ocr.TesseractParser()
+            parser.parse(handle.read())
+        pages = [parser.words]
+        for seed in range(300):
+            # escaped, as the parsers give them
+            pages.append([word._replace(text=ocr.escape_word(word.text))
+                          for word in ocr.boxing_words(synthetic_boxing(seed))])
+        for words in pages:
+            structure = ocr.text_structure(words)
+            if not words:
+                self.assertIsNone(structure)
+                continue
+            parsed = hiddentext.djvused_parse_text(ocr.translate(words))
+            self.assertEqual(dump_grammar(parsed), dump_grammar(structure))
+            self.assertEqual(parsed.out_tree(), structure.out_tree())
+
+class OcrCache(unittest.TestCase):
+    """
+    Tests for the OCR results cache (djvuedlib/cache.py)
+    """
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def image(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as handle:
+            handle.write(data)
+        return path
+
+    def test_01_key(self):
+        results = ocr.cache.ocr_results
+        key = results.key(self.image('a.tif', b'image'), 'tesseract 4.1.1', '-l eng')
+        # the content counts, not the name
+        self.assertEqual(key, results.key(self.image('b.tif', b'image'), 'tesseract 4.1.1', '-l eng'))
+        self.assertEqual(key, results.key(self.image('a.tif', b'image'), 'tesseract 4.1.1', '-l eng'))
+        others = [ results.key(self.image('a.tif', b'imagf'), 'tesseract 4.1.1', '-l eng'),
+                   results.key(self.image('a.tif', b'image'), 'tesseract 4.1.2', '-l eng'),
+                   results.key(self.image('a.tif', b'image'), 'tesserocr 2.5.2 4.1.1', '-l eng'),
+                   results.key(self.image('a.tif', b'image'), 'tesseract 4.1.1', '-l deu'),
+                   results.key(self.image('a.tif', b'image'), 'tesseract 4.1.1', '') ]
+        self.assertEqual(len(others)+1, len(set([key]+others)))
+
+    def test_02_put_get(self):
+        results = ocr.cache.ocr_results
+        key = results.key(self.image('a.tif', b'image'), 'tesseract put get', '')
+        self.assertIsNone(results.get(key))
+        results.put(key, 'hocr \u00e0')
+        self.assertEqual('hocr \u00e0', results.get(key))
+        other = results.key(self.image('a.tif', b'changed'), 'tesseract put get', '')
+        self.assertIsNone(results.get(other))
+
+def sample_document():
+    doc=collections.OrderedDict()
+    doc["Title"]="A book"
+    doc["Pages"]=collections.OrderedDict([ ("p%03d.tif" % n,{ "num": n, "text": "t%d" % n }) for n in range(5) ])
+    doc["Metadata"]=[ ["Author","Someone"], ["Year","1900"] ]
+    doc["Outline"]=[ ["One","p000.tif",[ ["One.a","p001.tif",[]] ]], ["Two","p003.tif",[]] ]
+    doc["Ocr Options"]=collections.OrderedDict([ ("engine","tesseract") ])
+    return doc
+
+class StorageTest(unittest.TestCase):
+    """Base of the storage tests: a temporary directory."""
+
+    def setUp(self):
+        self.dir=tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def path(self,name):
+        return os.path.join(self.dir,name)
+
+    def open(self,name,**kwargs):
+        return abstracts.SerializedDict(self.path(name),**kwargs)
+
+    def create(self,name,**kwargs):
+        doc=self.open(name,**kwargs)
+        with doc.transaction():
+            for k,v in sample_document().items():
+                doc[k]=v
+        return doc
+
+class Transaction(StorageTest):
+    """
+    Tests for djvuedlib/abstracts.py, SerializedDict.transaction()
+    """
+
+    def count_writes(self,doc):
+        """The list where each file write of ''doc'' is recorded."""
+        writes=[]
+        writer=doc._storage._writer
+        execute=writer._execute
+        def counted(action,fpath,data,remove):
+            writes.append(fpath)
+            execute(action,fpath,data,remove)
+        writer._execute=counted
+        return writes
+
+    def test_01_one_write_per_transaction(self):
+        doc=self.open("p.json")
+        writes=self.count_writes(doc)
+        with doc.transaction():
+            doc["Title"]="A book"
+            doc["Pages"]={}
+            with doc.transaction():
+                doc["Metadata"]=[]
+            doc.flush()
+            self.assertEqual([],writes)
+        doc.flush()
+        self.assertEqual([ self.path("p.json") ],writes)
+        doc["Title"]="Another"
+        doc.flush()
+        self.assertEqual(2,len(writes))
+        doc.close()
+        self.assertEqual(["Title","Pages","Metadata"],list(self.open("p.json").keys()))
+
+    def test_02_no_write_after_discard(self):
+        doc=self.open("p.json")
+        writes=self.count_writes(doc)
+        with doc.transaction():
+            doc["Title"]="A book"
+            doc._discard_changes()
+        doc.flush()
+        self.assertEqual([],writes)
+        doc.close()
+        self.assertFalse(os.path.exists(self.path("p.json")))
+
+class Journal(StorageTest):
+    """
+    Tests for djvuedlib/storage.py, JsonStorage in journal mode
+    """
+
+    def crash(self,doc):
+        """Leave ''doc'' as a crash would: changes on disk, no final
+        rewrite."""
+        doc.flush()
+        doc._storage._writer.close()
+
+    def test_01_replay(self):
+        self.create("p.json",journal=True).close()
+        doc=self.open("p.json",journal=True)
+        doc["Title"]="Another"
+        doc["Pages"]["p001.tif"]["num"]=7
+        doc._save("Pages","p001.tif")
+        del doc["Ocr Options"]
+        self.crash(doc)
+        self.assertTrue(os.path.exists(self.path("p.journal")))
+        expected=sample_document()
+        expected["Title"]="Another"
+        expected["Pages"]["p001.tif"]["num"]=7
+        del expected["Ocr Options"]
+        self.assertEqual(expected,storage.read_json(self.path("p.json")))
+        doc=self.open("p.json",journal=True)
+        self.assertEqual(json.dumps(expected),json.dumps(doc._dict))
+        doc.close()
+
+    def test_02_truncated_record(self):
+        self.create("p.json",journal=True).close()
+        doc=self.open("p.json",journal=True)
+        doc["Title"]="Another"
+        self.crash(doc)
+        with open(self.path("p.journal"),"a") as fd:
+            fd.write('{"path": ["Title"], "val')
+        doc=self.open("p.json",journal=True)
+        self.assertEqual("Another",doc["Title"])
+        doc.close()
+
+    def test_03_compaction(self):
+        doc=self.create("p.json",journal=True)
+        doc.flush()
+        doc._storage.journal_max_size=300
+        for n in range(5):
+            doc["Pages"]["p%03d.tif" % n]["text"]="x"*100
+            doc._save("Pages","p%03d.tif" % n)
+        doc.flush()
+        # rewritten past journal_max_size: the journal starts again
+        self.assertLess(os.path.getsize(self.path("p.journal")) if os.path.exists(self.path("p.journal")) else 0,300)
+        with open(self.path("p.json")) as fd:
+            self.assertEqual("x"*100,json.load(fd)["Pages"]["p002.tif"]["text"])
+        doc.close()
+        self.assertFalse(os.path.exists(self.path("p.journal")))
+        with open(self.path("p.json")) as fd:
+            self.assertEqual("x"*100,json.load(fd)["Pages"]["p004.tif"]["text"])
+
+class FileWriter(StorageTest):
+    """
+    Tests for djvuedlib/storage.py, AsyncFileWriter
+    """
+
+    def test_01_superseded(self):
+        writer=storage.AsyncFileWriter()
+        gate=threading.Event()
+        written=[]
+        execute=writer._execute
+        def gated(action,fpath,data,remove):
+            gate.wait()
+            written.append((fpath,data))
+            execute(action,fpath,data,remove)
+        writer._execute=gated
+        # the writer is busy with the first job while the others queue
+        writer.replace(self.path("first"),"0")
+        for n in range(1,4):
+            writer.replace(self.path("a"),str(n))
+        writer.append(self.path("log"),"x")
+        writer.append(self.path("log"),"y")
+        gate.set()
+        writer.flush()
+        self.assertEqual([ (self.path("first"),"0"), (self.path("a"),"3"), (self.path("log"),"xy") ],written)
+        with open(self.path("a")) as fd:
+            self.assertEqual("3",fd.read())
+        writer.close()
+
+    def test_02_error(self):
+        writer=storage.AsyncFileWriter()
+        writer.replace(self.path("missing/a"),"1")
+        writer.replace(self.path("b"),"2")
+        self.assertRaises(FileNotFoundError,writer.flush)
+        # the writer goes on after an error, raised only once
+        with open(self.path("b")) as fd:
+            self.assertEqual("2",fd.read())
+        writer.replace(self.path("c"),"3")
+        writer.flush()
+        self.assertTrue(os.path.exists(self.path("c")))
+        writer.close()
+
+class Sqlite(StorageTest):
+    """
+    Tests for djvuedlib/storage.py, SqliteStorage
+    """
+
+    def test_01_round_trip(self):
+        self.create("p.sqlite").close()
+        doc=self.open("p.sqlite")
+        self.assertEqual(json.dumps(sample_document()),json.dumps(doc._dict))
+        doc.export_json(self.path("out.json"))
+        with open(self.path("out.json")) as fd:
+            self.assertEqual(sample_document(),json.load(fd,object_pairs_hook=collections.OrderedDict))
+        doc.close()
+
+    def test_02_migration_from_json(self):
+        self.create("p.json",journal=True).close()
+        with open(self.path("p.json")) as fd:
+            before=fd.read()
+        # a change left in the journal is migrated too
+        doc=self.open("p.json",journal=True)
+        doc["Title"]="Another"
+        doc.flush()
+        doc._storage._writer.close()
+        doc=self.open("p.json",backend="sqlite")
+        expected=sample_document()
+        expected["Title"]="Another"
+        self.assertEqual(json.dumps(expected),json.dumps(doc._dict))
+        doc.close()
+        with open(self.path("p.json")) as fd:
+            self.assertEqual(before,fd.read())
+        self.assertTrue(os.path.exists(self.path("p.journal")))
+
+    def test_03_key_order(self):
+        doc=self.create("p.sqlite")
+        doc["Metadata"]=[ ["Author","Someone else"] ]
+        doc["Outline"]=[ ["Two","p003.tif",[]] ]
+        doc["Title"]="Another"
+        doc["Pages"]["p001.tif"]["num"]=7
+        doc._save("Pages","p001.tif")
+        doc.close()
+        doc=self.open("p.sqlite")
+        self.assertEqual(list(sample_document().keys()),list(doc.keys()))
+        self.assertEqual([ ["Author","Someone else"] ],doc["Metadata"])
+        self.assertEqual([ ["Two","p003.tif",[]] ],doc["Outline"])
+        self.assertEqual(7,doc["Pages"]["p001.tif"]["num"])
+        doc.close()
+
+    def test_04_rows_written(self):
+        doc=self.create("p.sqlite")
+        conn=doc._storage._conn
+        before=conn.total_changes
+        doc["Outline"][0][2][0][0]="One.b"
+        doc._save("Outline")
+        doc["Metadata"][1][1]="1901"
+        doc._save("Metadata")
+        # the settings row of each key and the changed row
+        self.assertEqual(4,conn.total_changes-before)
+        doc.close()
+        doc=self.open("p.sqlite")
+        self.assertEqual("One.b",doc["Outline"][0][2][0][0])
+        self.assertEqual("1901",doc["Metadata"][1][1])
+        doc.close()
+
+class Rescan(unittest.TestCase):
+    """
+    Tests for the rescan of the Tiff directory of a project
+    (djvuedlib/project.py)
+    """
+
+    def setUp(self):
+        self.dir=tempfile.mkdtemp()
+        self.tiff_dir=os.path.join(self.dir,"tiff")
+        os.makedirs(self.tiff_dir)
+        for name in [ "a", "b", "c", "d" ]:
+            self.image(name)
+        self.project=project.Project(os.path.join(self.dir,"project.json"))
+        self.project.new_project([],self.tiff_dir)
+
+    def tearDown(self):
+        self.project.close()
+        shutil.rmtree(self.dir)
+
+    def image(self,name,width=10):
+        """A pgm page, enough for the header of a page."""
+        with open(os.path.join(self.tiff_dir,name+".pgm"),'wb') as fd:
+            fd.write(b"P5\n%d 8\n255\n" % width+bytes(width*8))
+
+    def remove(self,name):
+        os.remove(os.path.join(self.tiff_dir,name+".pgm"))
+
+    def names(self,pages):
+        return [ os.path.basename(page.path)[:-4] for page in pages ]
+
+    def pages(self):
+        return { name: page for name,page in zip(self.names(self.project.pages),self.project.pages) }
+
+    def outline(self):
+        """Titles and pages of the outline rows, nested."""
+        def dump(rows):
+            return [ (row.title,self.names([row.page])[0],dump(row.children)) for row in rows ]
+        return dump(self.project["Outline"].rows)
+
+    def test_01_unchanged(self):
+        pages=list(self.project.pages)
+        for n in range(2):
+            self.assertEqual(([],[],[],[]),tuple(self.project.rescan()))
+        self.assertEqual([ id(page) for page in pages ],[ id(page) for page in self.project.pages ])
+
+    def test_02_added_removed_changed(self):
+        pages=self.pages()
+        self.remove("b")
+        self.image("bb")
+        # same size, other time
+        path=pages["c"].path
+        st=os.stat(path)
+        os.utime(path,ns=(st.st_atime_ns,st.st_mtime_ns+10**9))
+        # other size
+        self.image("d",width=20)
+        changes=self.project.rescan()
+        self.assertEqual(["a","bb","c","d"],self.names(self.project.pages))
+        self.assertEqual([ (1,"bb") ],[ (ind,self.names([page])[0]) for ind,page in changes.added ])
+        self.assertEqual([ (1,pages["b"]) ],changes.removed)
+        self.assertEqual([ pages["c"], pages["d"] ],changes.changed)
+        self.assertEqual([],changes.outline)
+        # the pages left are the same objects, refreshed when changed
+        for name in [ "a", "c", "d" ]:
+            self.assertIs(pages[name],self.pages()[name])
+        self.assertEqual(20,pages["d"].width)
+        self.assertEqual(sorted([ page.path for page in self.project.pages ]),sorted(self.project.pages_by_path))
+        self.assertEqual(([],[],[],[]),tuple(self.project.rescan()))
+
+    def test_03_outline(self):
+        pages=self.pages()
+        outline=self.project["Outline"]
+        outline.create_row(None,"A",pages["a"])
+        outline.create_row(None,"B",pages["b"])
+        outline.create_row(outline.rows[1],"B1",pages["c"])
+        outline.create_row(None,"D",pages["d"])
+        # to the next page left
+        self.remove("b")
+        self.remove("c")
+        changes=self.project.rescan()
+        self.assertEqual([ ("B1",pages["c"],pages["d"]), ("B",pages["b"],pages["d"]) ],
+                         [ (row.title,old,new) for row,old,new in changes.outline ])
+        self.assertEqual([ ("A","a",[]), ("B","d",[ ("B1","d",[]) ]), ("D","d",[]) ],self.outline())
+        # at the end, to the previous one
+        self.remove("d")
+        self.project.rescan()
+        self.assertEqual([ ("A","a",[]), ("B","a",[ ("B1","a",[]) ]), ("D","a",[]) ],self.outline())
+        # written with the project
+        self.project.close()
+        self.project=project.Project(os.path.join(self.dir,"project.json"))
+        self.assertEqual([ ("A","a",[]), ("B","a",[ ("B1","a",[]) ]), ("D","a",[]) ],self.outline())
+        # no page left: the rows are dropped
+        self.remove("a")
+        changes=self.project.rescan()
+        self.assertEqual([],self.project.pages)
+        self.assertEqual([ None ]*4,[ new for row,old,new in changes.outline ])
+        self.assertEqual([],self.outline())
+
+    def test_04_retarget_dropped_row(self):
+        pages=self.pages()
+        outline=self.project["Outline"]
+        outline.create_row(None,"A",pages["a"])
+        outline.create_row(None,"B",pages["b"])
+        outline.create_row(outline.rows[1],"B1",pages["c"])
+        outline.create_row(outline.rows[1],"B2",pages["d"])
+        outline.create_row(None,"C",pages["c"])
+        # the children of a row dropped take its place
+        changes=outline.retarget({ pages["b"]: None })
+        self.assertEqual([ ("B",pages["b"],None) ],[ (row.title,old,new) for row,old,new in changes ])
+        self.assertEqual([ ("A","a",[]), ("B1","c",[]), ("B2","d",[]), ("C","c",[]) ],self.outline())
+        self.assertEqual([ None ]*4,[ row.parent for row in outline.rows ])
+        self.assertEqual([],outline.retarget({}))
+
+    def test_05_not_while_ocr_runs(self):
+        pages=list(self.project.pages)
+        self.remove("b")
+        # as while apply_ocr() waits for the scheduler
+        self.project._ocr_scheduler=object()
+        self.assertTrue(self.project.ocr_running)
+        self.assertEqual(([],[],[],[]),tuple(self.project.rescan()))
+        self.assertEqual(pages,self.project.pages)
+        self.assertEqual([],self.project.apply_ocr())
+        self.project._ocr_scheduler=None
+        self.assertEqual([ (1,pages[1]) ],self.project.rescan().removed)
+
+if __name__ == '__main__':
+    unittest.main()